@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+import math
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import faiss
+import numpy as np
+
+
+@dataclass(frozen=True)
+class AnnSettings:
+    hnsw_min_chunks: int = 2_000
+    ivf_min_chunks: int = 20_000
+    ivfpq_min_chunks: int = 200_000
+    hnsw_m: int = 32
+    ef_construction: int = 80
+    ef_search: int = 64
+    nlist: int = 0
+    nprobe: int = 0
+    pq_m: int = 48
+    pq_bits: int = 8
+    seed: int = 1234
+
+
+def settings_from_config(cfg) -> AnnSettings:
+    return AnnSettings(
+        hnsw_min_chunks=cfg.ann_hnsw_min_chunks,
+        ivf_min_chunks=cfg.ann_ivf_min_chunks,
+        ivfpq_min_chunks=cfg.ann_ivfpq_min_chunks,
+        ef_search=cfg.ann_ef_search,
+        nlist=cfg.ann_nlist,
+        nprobe=cfg.ann_nprobe,
+        pq_m=cfg.ann_pq_m,
+    )
+
+
+def choose_index_type(n: int, settings: AnnSettings) -> str:
+    if n >= settings.ivfpq_min_chunks:
+        return "ivf_pq"
+    if n >= settings.ivf_min_chunks:
+        return "ivf_flat"
+    if n >= settings.hnsw_min_chunks:
+        return "hnsw"
+    return "flat"
+
+
+def _nlist_for(n: int, settings: AnnSettings) -> int:
+    nlist = settings.nlist or int(4 * math.sqrt(n))
+    # FAISS wants ~39 training points per centroid
+    return max(1, min(nlist, n // 39, 65_536))
+
+
+def _pq_m_for(d: int, settings: AnnSettings) -> int:
+    m = min(settings.pq_m, d)
+    while d % m:
+        m -= 1
+    return m
+
+
+def build_index(vectors: np.ndarray, settings: AnnSettings, index_type: Optional[str] = None) -> Tuple[Any, Dict[str, Any]]:
+    n, d = vectors.shape
+    index_type = index_type or choose_index_type(n, settings)
+    params: Dict[str, Any] = {"type": index_type, "ntotal": n, "dim": d}
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(d)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(d, settings.hnsw_m)
+        index.hnsw.efConstruction = settings.ef_construction
+        params.update(m=settings.hnsw_m, ef_construction=settings.ef_construction, ef_search=settings.ef_search)
+    elif index_type in {"ivf_flat", "ivf_pq"}:
+        nlist = _nlist_for(n, settings)
+        quantizer = faiss.IndexFlatL2(d)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist)
+        else:
+            pq_m = _pq_m_for(d, settings)
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m, settings.pq_bits)
+            params.update(pq_m=pq_m, pq_bits=settings.pq_bits)
+
+        rng = np.random.default_rng(settings.seed)
+        sample = vectors
+        if n > 256 * nlist:
+            sample = vectors[rng.choice(n, 256 * nlist, replace=False)]
+        t0 = time.time()
+        index.train(sample)
+        params.update(
+            nlist=nlist,
+            nprobe=settings.nprobe or min(nlist, max(8, nlist // 16)),
+            train_seconds=round(time.time() - t0, 3),
+            train_size=len(sample),
+        )
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+
+    index.add(vectors)
+    apply_search_params(index, params)
+    return index, params
+
+
+def finish_index(flat, settings: AnnSettings) -> Tuple[Any, Dict[str, Any]]:
+    # flat holds every vector of a document that was added batch by batch;
+    # small documents keep it as is, larger ones get the same index
+    # build_index would build from those vectors
+    n, d = flat.ntotal, flat.d
+    index_type = choose_index_type(n, settings)
+    if index_type == "flat":
+        return flat, {"type": "flat", "ntotal": n, "dim": d}
+    return build_index(flat.reconstruct_n(0, n), settings, index_type)
+
+
+def apply_search_params(index, params: Optional[Dict[str, Any]]) -> None:
+    if not params:
+        return
+    if params.get("type") == "hnsw" and params.get("ef_search"):
+        faiss.downcast_index(index).hnsw.efSearch = int(params["ef_search"])
+    elif params.get("type") in {"ivf_flat", "ivf_pq"} and params.get("nprobe"):
+        faiss.extract_index_ivf(index).nprobe = int(params["nprobe"])
+
+
+def search_parameters(params: Optional[Dict[str, Any]], exclude: np.ndarray):
+    # skips the excluded rows (tombstoned chunks) inside the search, so k
+    # hits still come back. Search parameters replace the index's own
+    # efSearch / nprobe, so those are passed again.
+    batch = faiss.IDSelectorBatch(np.asarray(exclude, dtype=np.int64))
+    sel = faiss.IDSelectorNot(batch)
+    index_type = (params or {}).get("type")
+    if index_type == "hnsw":
+        out = faiss.SearchParametersHNSW(sel=sel, efSearch=int(params.get("ef_search") or 16))
+    elif index_type in {"ivf_flat", "ivf_pq"}:
+        out = faiss.SearchParametersIVF(sel=sel, nprobe=int(params.get("nprobe") or 1))
+    else:
+        out = faiss.SearchParameters(sel=sel)
+    # the SWIG objects only hold pointers to the selectors
+    out.referenced_objects = [batch, sel]
+    return out
+
+
+def live_vectors(index, params: Optional[Dict[str, Any]], rows: np.ndarray) -> Optional[np.ndarray]:
+    # stored vectors of the given rows, or None when the index only keeps
+    # lossy codes (IVF-PQ) and the chunks should be embedded again
+    index_type = (params or {}).get("type", "flat")
+    if index_type == "ivf_pq":
+        return None
+    if index_type == "ivf_flat":
+        faiss.extract_index_ivf(index).make_direct_map()
+    rows = np.asarray(rows, dtype=np.int64)
+    if not len(rows):
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_batch(rows)
+
+
+def _sample_queries(vectors: np.ndarray, n_queries: int, seed: int) -> np.ndarray:
+    # held-out queries do not exist for a single document, so perturb
+    # stored chunk vectors to stand in for questions about them
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)
+    noise = rng.normal(0, vectors.std() * 0.1, size=(len(rows), vectors.shape[1])).astype(np.float32)
+    return vectors[rows] + noise
+
+
+def _timed_search(index, queries: np.ndarray, k: int) -> Tuple[np.ndarray, float]:
+    t0 = time.perf_counter()
+    for q in queries:
+        index.search(q[None, :], k)
+    latency_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+    _, rows = index.search(queries, k)
+    return rows, latency_ms
+
+
+def recall_report(
+    index,
+    vectors: np.ndarray,
+    k: int = 10,
+    n_queries: int = 100,
+    seed: int = 1234,
+) -> Dict[str, float]:
+    queries = _sample_queries(vectors, n_queries, seed)
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+
+    truth, flat_ms = _timed_search(flat, queries, k)
+    found, ann_ms = _timed_search(index, queries, k)
+    recall = np.mean([len(set(t) & set(f)) / len(t) for t, f in zip(truth, found)])
+    return {
+        f"recall_at_{k}": round(float(recall), 4),
+        "latency_ms": round(ann_ms, 4),
+        "flat_latency_ms": round(flat_ms, 4),
+    }
+
+
+def compare_index_types(vectors: np.ndarray, settings: AnnSettings, k: int = 10) -> Dict[str, Dict[str, Any]]:
+    report: Dict[str, Dict[str, Any]] = {}
+    for index_type in ("flat", "hnsw", "ivf_flat", "ivf_pq"):
+        # IVF needs enough points per centroid, PQ at least 2**bits per codebook
+        if index_type == "ivf_flat" and len(vectors) < 39 * 4:
+            continue
+        if index_type == "ivf_pq" and len(vectors) < 4 * 2 ** settings.pq_bits:
+            continue
+        t0 = time.time()
+        index, params = build_index(vectors, settings, index_type)
+        params["build_seconds"] = round(time.time() - t0, 3)
+        params["bytes"] = int(faiss.serialize_index(index).nbytes)
+        params.update(recall_report(index, vectors, k=k, seed=settings.seed))
+        report[index_type] = params
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    from app.compact_store import CompactDocstore, read_tombstones
+    from app.config import AppConfig
+    from app.embedding_cache import CachedEmbeddings, EmbeddingCache
+    from app.storage import index_files_dir
+    from app.vectorstore import embeddings_from_config
+
+    parser = argparse.ArgumentParser(description="Recall vs latency of each ANN index type on one document")
+    parser.add_argument("doc_id")
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    cfg = AppConfig()
+    index_path = cfg.index_dir / args.doc_id
+    files_path = index_files_dir(index_path)
+    store = CompactDocstore(files_path)
+    deleted = set(read_tombstones(files_path).tolist())
+    texts = [store.get(i).page_content for i in range(len(store)) if i not in deleted]
+
+    embeddings = embeddings_from_config(cfg)
+    if cfg.embedding_cache_enabled:
+        embeddings = CachedEmbeddings(embeddings, EmbeddingCache(cfg.embedding_cache_dir, cfg.embedding_cache_key))
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+
+    report = compare_index_types(vectors, settings_from_config(cfg), k=args.k)
+    with open(index_path / "ann_report.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    for index_type, row in report.items():
+        print(
+            f"{index_type:9s} recall@{args.k}={row[f'recall_at_{args.k}']:.3f} "
+            f"latency_ms={row['latency_ms']:.3f} flat_ms={row['flat_latency_ms']:.3f} bytes={row['bytes']}"
+        )
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import base64
+from contextlib import contextmanager
+import json
+from pathlib import Path
+import sqlite3
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+CATALOG_FILE = "catalog.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL DEFAULT '',
+    sha256 TEXT,
+    status TEXT NOT NULL DEFAULT 'ready',
+    chunks INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL DEFAULT '',
+    manifest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_created_at ON documents (created_at DESC, doc_id DESC);
+CREATE INDEX IF NOT EXISTS documents_filename ON documents (filename);
+CREATE INDEX IF NOT EXISTS documents_sha256 ON documents (sha256);
+"""
+
+
+def encode_cursor(created_at: str, doc_id: str) -> str:
+    raw = json.dumps([created_at, doc_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return str(created_at), str(doc_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
+class Catalog:
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # a connection per call: cheap for SQLite, and safe across the
+        # request threads, ingest workers and other uvicorn processes
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def upsert(self, manifest: Dict[str, Any]) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO documents (doc_id, filename, sha256, status, chunks, created_at, manifest)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (doc_id) DO UPDATE SET
+                    filename = excluded.filename,
+                    sha256 = excluded.sha256,
+                    status = excluded.status,
+                    chunks = excluded.chunks,
+                    created_at = excluded.created_at,
+                    manifest = excluded.manifest
+                """,
+                (
+                    manifest["doc_id"],
+                    manifest.get("filename", ""),
+                    manifest.get("sha256"),
+                    manifest.get("status", "ready"),
+                    int(manifest.get("chunks", 0) or 0),
+                    manifest.get("created_at", ""),
+                    json.dumps(manifest, ensure_ascii=False),
+                ),
+            )
+
+    def delete(self, doc_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT manifest FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_by_hash(self, sha256: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT manifest FROM documents WHERE sha256 = ? AND status != 'failed' "
+                "ORDER BY created_at LIMIT 1",
+                (sha256,),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def count(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def list(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        filename: Optional[str] = None,
+        status: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        where, args = [], []
+        if cursor:
+            created_at, doc_id = decode_cursor(cursor)
+            where.append("(created_at < ? OR (created_at = ? AND doc_id < ?))")
+            args += [created_at, created_at, doc_id]
+        if filename:
+            where.append("filename LIKE ? ESCAPE '\\'")
+            escaped = filename.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            args.append(f"%{escaped}%")
+        if status:
+            where.append("status = ?")
+            args.append(status)
+
+        sql = "SELECT created_at, doc_id, manifest FROM documents"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC, doc_id DESC LIMIT ?"
+        args.append(limit + 1)
+
+        with self._connect() as conn:
+            rows = conn.execute(sql, args).fetchall()
+
+        next_cursor = encode_cursor(rows[limit - 1][0], rows[limit - 1][1]) if len(rows) > limit else None
+        return [json.loads(r[2]) for r in rows[:limit]], next_cursor
+
+    def all_ids(self) -> Set[str]:
+        with self._connect() as conn:
+            return {r[0] for r in conn.execute("SELECT doc_id FROM documents")}
+
+    def all_manifests(self) -> Dict[str, Dict[str, Any]]:
+        with self._connect() as conn:
+            return {doc_id: json.loads(raw) for doc_id, raw in conn.execute("SELECT doc_id, manifest FROM documents")}
+
+
+def import_manifests(catalog: Catalog, index_root: Path) -> int:
+    from app.storage import read_manifest
+
+    imported = 0
+    for p in sorted(index_root.glob("*")):
+        m = read_manifest(p) if p.is_dir() else {}
+        if m.get("doc_id"):
+            catalog.upsert(m)
+            imported += 1
+    return imported
+
+
+def check_consistency(catalog: Catalog, index_root: Path, repair: bool = False) -> Dict[str, List[str]]:
+    from app.storage import read_manifest
+
+    on_disk: Dict[str, Dict[str, Any]] = {}
+    for p in index_root.glob("*"):
+        m = read_manifest(p) if p.is_dir() else {}
+        if m.get("doc_id"):
+            on_disk[m["doc_id"]] = m
+
+    in_catalog = catalog.all_manifests()
+    report = {
+        "missing_in_catalog": sorted(set(on_disk) - set(in_catalog)),
+        "missing_on_disk": sorted(set(in_catalog) - set(on_disk)),
+        "mismatched": sorted(d for d in set(on_disk) & set(in_catalog) if on_disk[d] != in_catalog[d]),
+    }
+
+    if repair:
+        for doc_id in report["missing_in_catalog"] + report["mismatched"]:
+            catalog.upsert(on_disk[doc_id])
+        for doc_id in report["missing_on_disk"]:
+            catalog.delete(doc_id)
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from app.config import AppConfig
+
+    parser = argparse.ArgumentParser(description="Maintain the document catalog")
+    parser.add_argument("command", choices=["import", "check"])
+    parser.add_argument("--repair", action="store_true", help="with check: make the catalog match the manifests")
+    args = parser.parse_args()
+
+    cfg = AppConfig()
+    catalog = Catalog(cfg.index_dir / CATALOG_FILE)
+    if args.command == "import":
+        print(f"Imported {import_manifests(catalog, cfg.index_dir)} manifests")
+    else:
+        report = check_consistency(catalog, cfg.index_dir, repair=args.repair)
+        for name, ids in report.items():
+            print(f"{name}: {len(ids)}")
+            for doc_id in ids:
+                print(f"  {doc_id}")
+        if any(report.values()) and not args.repair:
+            raise SystemExit(1)
@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+from array import array
+from collections.abc import Mapping
+import json
+import mmap
+import os
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Union
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+# Index directory layout:
+#   index.faiss     the FAISS index, written with faiss.write_index
+#   chunks.bin      utf-8 chunk text followed by its JSON metadata, per row
+#   chunks.idx.npy  int64 (n, 3) array: byte offset, text length, metadata length
+#   tombstones.npy  sorted int64 rows that were deleted but are still in the
+#                   FAISS index (written by updates, absent when there are none)
+#   rowids.npy      int64 chunk serial of each row; serials survive compaction,
+#                   so the corpus can refer to chunks by them (absent: row i
+#                   has serial i)
+# Row i of the FAISS index is chunk i, and the docstore id of a row is str(i).
+INDEX_FILE = "index.faiss"
+CHUNKS_FILE = "chunks.bin"
+OFFSETS_FILE = "chunks.idx.npy"
+TOMBSTONES_FILE = "tombstones.npy"
+ROWIDS_FILE = "rowids.npy"
+LEGACY_DOCSTORE_FILE = "index.pkl"
+
+
+def is_compact(index_path: Path) -> bool:
+    return (index_path / OFFSETS_FILE).exists()
+
+
+def is_legacy(index_path: Path) -> bool:
+    return (index_path / LEGACY_DOCSTORE_FILE).exists() and not is_compact(index_path)
+
+
+class RowIds(Mapping):
+    # index_to_docstore_id for a compact store, without a dict of n strings
+    def __init__(self, n: int):
+        self.n = n
+
+    def __getitem__(self, row: int) -> str:
+        if not 0 <= row < self.n:
+            raise KeyError(row)
+        return str(row)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.n))
+
+    def __len__(self) -> int:
+        return self.n
+
+
+class CompactDocstore:
+    def __init__(self, index_path: Path):
+        self.offsets = np.load(index_path / OFFSETS_FILE, mmap_mode="r")
+        # set by load_compact when the FAISS index beside it is mmapped
+        self.index_mmapped = False
+        size = (index_path / CHUNKS_FILE).stat().st_size
+        self._file = open(index_path / CHUNKS_FILE, "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def get(self, row: int) -> Document:
+        start, text_len, meta_len = (int(x) for x in self.offsets[row])
+        text = self._data[start:start + text_len].decode("utf-8")
+        meta = json.loads(self._data[start + text_len:start + text_len + meta_len].decode("utf-8"))
+        return Document(page_content=text, metadata=meta)
+
+    def search(self, search: str) -> Union[str, Document]:
+        try:
+            return self.get(int(search))
+        except (ValueError, IndexError):
+            return f"ID {search} not found."
+
+    # FAISS.add_texts / delete would otherwise leave the index and the
+    # chunk files out of step; writers build a new generation with ChunkWriter
+    def add(self, texts: Dict[str, Document]) -> None:
+        raise TypeError("CompactDocstore is read-only; write chunks with ChunkWriter")
+
+    def delete(self, ids: List) -> None:
+        raise TypeError("CompactDocstore is read-only; write chunks with ChunkWriter")
+
+
+class ChunkWriter:
+    # Appends chunks to chunks.bin as they are produced and keeps only the
+    # (n, 3) offset table in memory. Nothing is visible until close(), which
+    # renames both files into place.
+    def __init__(self, index_path: Path):
+        index_path.mkdir(parents=True, exist_ok=True)
+        self.index_path = index_path
+        self._tmp_chunks = index_path / f"{CHUNKS_FILE}.tmp"
+        self._file = open(self._tmp_chunks, "wb")
+        self._offsets = array("q")
+        self._pos = 0
+
+    def __len__(self) -> int:
+        return len(self._offsets) // 3
+
+    def add(self, docs: Sequence[Document]) -> None:
+        for d in docs:
+            text = (d.page_content or "").encode("utf-8")
+            meta = json.dumps(d.metadata, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            self._file.write(text)
+            self._file.write(meta)
+            self._offsets.extend((self._pos, len(text), len(meta)))
+            self._pos += len(text) + len(meta)
+
+    def copy_from(self, store_path: Path, rows: Optional[Sequence[int]] = None) -> None:
+        # raw bytes of chunks already in another store, without decoding them
+        offsets = np.load(store_path / OFFSETS_FILE)
+        with open(store_path / CHUNKS_FILE, "rb") as src:
+            for row in range(len(offsets)) if rows is None else rows:
+                start, text_len, meta_len = (int(x) for x in offsets[row])
+                src.seek(start)
+                self._file.write(src.read(text_len + meta_len))
+                self._offsets.extend((self._pos, text_len, meta_len))
+                self._pos += text_len + meta_len
+
+    def close(self) -> None:
+        self._file.close()
+        offsets = np.frombuffer(self._offsets, dtype=np.int64).reshape(-1, 3)
+        tmp_offsets = self.index_path / f"{OFFSETS_FILE}.tmp"
+        with open(tmp_offsets, "wb") as f:
+            np.save(f, offsets)
+
+        os.replace(self._tmp_chunks, self.index_path / CHUNKS_FILE)
+        os.replace(tmp_offsets, self.index_path / OFFSETS_FILE)
+
+    def abort(self) -> None:
+        self._file.close()
+        self._tmp_chunks.unlink(missing_ok=True)
+
+
+def write_chunks(index_path: Path, docs: Sequence[Document]) -> None:
+    writer = ChunkWriter(index_path)
+    writer.add(docs)
+    writer.close()
+
+
+def write_faiss_index(index_path: Path, index) -> None:
+    tmp_index = index_path / f"{INDEX_FILE}.tmp"
+    faiss.write_index(index, str(tmp_index))
+    os.replace(tmp_index, index_path / INDEX_FILE)
+
+
+def _write_rows(path: Path, rows: np.ndarray) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, np.asarray(rows, dtype=np.int64))
+    os.replace(tmp, path)
+
+
+def read_tombstones(index_path: Path) -> np.ndarray:
+    path = index_path / TOMBSTONES_FILE
+    return np.load(path) if path.exists() else np.zeros(0, dtype=np.int64)
+
+
+def write_tombstones(index_path: Path, rows: np.ndarray) -> None:
+    _write_rows(index_path / TOMBSTONES_FILE, np.unique(np.asarray(rows, dtype=np.int64)))
+
+
+def read_rowids(index_path: Path, n: int) -> np.ndarray:
+    path = index_path / ROWIDS_FILE
+    return np.load(path) if path.exists() else np.arange(n, dtype=np.int64)
+
+
+def write_rowids(index_path: Path, rowids: np.ndarray) -> None:
+    _write_rows(index_path / ROWIDS_FILE, rowids)
+
+
+def write_index_dir(index_path: Path, index, docs: Sequence[Document]) -> None:
+    write_chunks(index_path, docs)
+    write_faiss_index(index_path, index)
+
+
+def save_compact(vs: FAISS, index_path: Path) -> None:
+    docs = [vs.docstore.search(vs.index_to_docstore_id[i]) for i in range(vs.index.ntotal)]
+    write_index_dir(index_path, vs.index, docs)
+
+    legacy = index_path / LEGACY_DOCSTORE_FILE
+    if legacy.exists():
+        legacy.unlink()
+
+
+def _read_index_mmap(path: Path) -> tuple:
+    # the index, and whether it was mmapped
+    flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    try:
+        return faiss.read_index(str(path), flag | faiss.IO_FLAG_READ_ONLY), True
+    except RuntimeError:
+        # index types without mmap support are read into memory
+        return faiss.read_index(str(path)), False
+
+
+def load_compact(index_path: Path, embeddings: Embeddings, mutable: bool = False) -> FAISS:
+    if not mutable:
+        index, mmapped = _read_index_mmap(index_path / INDEX_FILE)
+        docstore = CompactDocstore(index_path)
+        docstore.index_mmapped = mmapped
+        return FAISS(embeddings, index, docstore, RowIds(len(docstore)))
+
+    # writers need an in-memory index and a docstore they can add to
+    index = faiss.read_index(str(index_path / INDEX_FILE))
+    compact = CompactDocstore(index_path)
+    docs = {str(i): compact.get(i) for i in range(len(compact))}
+    return FAISS(embeddings, index, InMemoryDocstore(docs), {i: str(i) for i in range(len(compact))})
+
+
+def faiss_memory_nbytes(index, mmapped: bool) -> int:
+    # bytes a loaded FAISS index holds in memory. Mmapped flat codes (also
+    # the storage of HNSW) are left to the page cache and not counted; IVF
+    # lists, the HNSW graph and quantizers are always read into memory.
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        hnsw = index.hnsw
+        graph = hnsw.neighbors.size() * 4 + hnsw.levels.size() * 4 + hnsw.offsets.size() * 8
+        return graph + faiss_memory_nbytes(index.storage, mmapped)
+    if isinstance(index, faiss.IndexIVF):
+        return index.ntotal * (index.code_size + 8) + faiss_memory_nbytes(index.quantizer, False)
+    if isinstance(index, faiss.IndexFlatCodes):
+        return 0 if mmapped else index.ntotal * index.code_size
+    return index.ntotal * index.d * 4
+
+
+def memory_nbytes(vs: FAISS) -> int:
+    # what a loaded index costs in memory, for cache budgets: the FAISS index
+    # and, for compact stores, the offset table (chunk text is mmapped).
+    # Pickle-based stores hold every chunk in memory.
+    docstore = vs.docstore
+    if isinstance(docstore, CompactDocstore):
+        return faiss_memory_nbytes(vs.index, docstore.index_mmapped) + docstore.offsets.nbytes
+    chunks = getattr(docstore, "_dict", {}).values()
+    return faiss_memory_nbytes(vs.index, False) + sum(len(d.page_content) + 200 for d in chunks)
+
+
+def load_legacy(index_path: Path, embeddings: Embeddings) -> FAISS:
+    return FAISS.load_local(str(index_path), embeddings, allow_dangerous_deserialization=True)
+
+
+def migrate(index_path: Path, embeddings: Embeddings) -> bool:
+    if not is_legacy(index_path):
+        return False
+    save_compact(load_legacy(index_path, embeddings), index_path)
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from app.config import AppConfig
+    from app.vectorstore import embeddings_from_config
+
+    parser = argparse.ArgumentParser(description="Convert pickle-based FAISS indexes to the compact format")
+    parser.parse_args()
+
+    cfg = AppConfig()
+    embeddings = embeddings_from_config(cfg)
+    candidates = [p for p in cfg.index_dir.glob("*") if p.is_dir()]
+    candidates += [p for p in cfg.corpus_dir.glob("shard_*") if p.is_dir()]
+
+    migrated = 0
+    for p in sorted(candidates):
+        if migrate(p, embeddings):
+            migrated += 1
+            print(f"Migrated {p}")
+    print(f"Migrated {migrated} of {len(candidates)} index directories")
@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+import logging
+import os
+from pathlib import Path
+import shutil
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, Optional, Set
+
+from app.jobs import claim_job
+from app.storage import GENERATION_PREFIX, doc_lock, generation_dir, index_files, read_manifest, write_manifest
+
+if TYPE_CHECKING:
+    from langchain_core.embeddings import Embeddings
+
+    from app.ann import AnnSettings
+    from app.catalog import Catalog
+    from app.corpus import CorpusIndex
+
+# Reclaims disk space left behind by updates and deletes:
+#   - documents with many tombstoned chunks get a compacted generation
+#   - generations older than the current one are removed once no reader
+#     can still be using them (grace_seconds after the switch)
+#   - upload files and index directories no document refers to
+#   - corpus shards with many dropped rows, see app.corpus
+# FAISS and the embedding model are only imported when a document is
+# compacted, so the API process can import this module cheaply.
+
+TRASH_PREFIX = ".trash-"
+
+logger = logging.getLogger("pdf_insight_assistant")
+
+
+@dataclass(frozen=True)
+class CompactionSettings:
+    # share of a document's rows that are tombstoned before it is compacted
+    min_deleted_percent: int = 20
+    # how long a superseded generation or an unreferenced file is kept
+    grace_seconds: int = 300
+    ann: Optional[AnnSettings] = None  # None uses the AnnSettings defaults
+
+
+def needs_compaction(manifest: Dict[str, Any], settings: CompactionSettings) -> bool:
+    deleted = int(manifest.get("deleted_chunks", 0) or 0)
+    total = deleted + int(manifest.get("chunks", 0) or 0)
+    return manifest.get("status", "ready") == "ready" and deleted > 0 and deleted * 100 >= settings.min_deleted_percent * total
+
+
+@contextmanager
+def _claimed(index_path: Path) -> Iterator[bool]:
+    # False while an ingest, update or delete of the document holds its
+    # claim, in this or another worker process; those write the same next
+    # generation, so the document is skipped until the next pass
+    claim = claim_job(index_path)
+    try:
+        yield claim is not None
+    finally:
+        if claim is not None:
+            claim.release()
+
+
+def compact_document(
+    index_path: Path,
+    embeddings: Callable[[], Embeddings],
+    settings: CompactionSettings = CompactionSettings(),
+    force: bool = False,
+) -> Optional[Dict[str, Any]]:
+    # writes the live rows into a new generation and switches the manifest
+    # to it; returns the new index parameters, or None when there was
+    # nothing to compact
+    from app.ann import AnnSettings
+    from app.vectorstore import compact_faiss_index
+
+    with _claimed(index_path) as claimed, doc_lock(index_path):
+        if not claimed:
+            return None
+        manifest = read_manifest(index_path)
+        if not manifest.get("deleted_chunks") or not manifest.get("chunks"):
+            return None
+        if not force and not needs_compaction(manifest, settings):
+            return None
+
+        generation = int(manifest.get("generation", 0) or 0)
+        params = manifest.get("index") or {}
+        new_dir = generation_dir(index_path, generation + 1)
+        shutil.rmtree(new_dir, ignore_errors=True)
+        t0 = time.time()
+        try:
+            new_params = compact_faiss_index(
+                generation_dir(index_path, generation),
+                new_dir,
+                params,
+                # only IVF-PQ rows are embedded again, so the model is not loaded otherwise
+                embeddings() if params.get("type") == "ivf_pq" else None,
+                ann=settings.ann or AnnSettings(),
+            )
+        except BaseException:
+            shutil.rmtree(new_dir, ignore_errors=True)
+            raise
+
+        manifest.update(
+            {
+                "generation": generation + 1,
+                "generation_at": time.time(),
+                "index": new_params,
+                "chunks": int(new_params["ntotal"]),
+                "deleted_chunks": 0,
+                "compacted_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "compaction_seconds": round(time.time() - t0, 3),
+            }
+        )
+        write_manifest(index_path, manifest)
+        return new_params
+
+
+def remove_path(path: Path) -> int:
+    # bytes freed; a directory is renamed out of the way first so a
+    # half-removed one is never mistaken for a document
+    if not path.exists():
+        return 0
+    if path.is_file():
+        size = path.stat().st_size
+        path.unlink(missing_ok=True)
+        return size
+    size = sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+    if not path.name.startswith(TRASH_PREFIX):
+        trash = path.with_name(f"{TRASH_PREFIX}{path.name}-{time.time_ns()}")
+        os.replace(path, trash)
+        path = trash
+    shutil.rmtree(path, ignore_errors=True)
+    return size
+
+
+def remove_stale_generations(index_path: Path, grace_seconds: int) -> int:
+    # superseded generations of one document, once the grace period after
+    # the last switch has passed; returns the bytes freed
+    with _claimed(index_path) as claimed, doc_lock(index_path):
+        if not claimed:
+            return 0
+        manifest = read_manifest(index_path)
+        generation = int(manifest.get("generation", 0) or 0)
+        if not generation or time.time() - float(manifest.get("generation_at", 0) or 0) < grace_seconds:
+            return 0
+
+        freed = 0
+        for p in index_path.glob(f"{GENERATION_PREFIX}*"):
+            number = p.name[len(GENERATION_PREFIX):]
+            # newer ones may be an update in progress in another process
+            if p.is_dir() and number.isdigit() and int(number) < generation:
+                freed += remove_path(p)
+        # generation 0 is the document directory itself
+        for p in index_files(index_path):
+            freed += remove_path(p)
+        return freed
+
+
+def _older_than(path: Path, seconds: int) -> bool:
+    try:
+        return time.time() - path.stat().st_mtime > seconds
+    except FileNotFoundError:
+        return False
+
+
+def remove_orphans(
+    index_root: Path,
+    upload_dir: Path,
+    catalog: Catalog,
+    grace_seconds: int,
+    busy: Callable[[str], bool] = lambda doc_id: False,
+) -> Dict[str, int]:
+    # upload files no manifest refers to, index directories with neither a
+    # manifest nor a catalog entry, and leftovers of deletes. Everything
+    # younger than the grace period is kept: it may belong to an upload or
+    # an update that has not written its manifest yet.
+    removed = {"uploads": 0, "index_dirs": 0, "bytes_freed": 0}
+    known = catalog.all_ids()
+    referenced: Set[str] = set()
+    for p in index_root.iterdir() if index_root.exists() else ():
+        if not p.is_dir():
+            continue
+        if p.name.startswith(TRASH_PREFIX):
+            removed["index_dirs"] += 1
+            removed["bytes_freed"] += remove_path(p)
+            continue
+        manifest = read_manifest(p)
+        if manifest:
+            referenced.add(os.path.abspath(manifest.get("stored_path", "")))
+            referenced.update(os.path.abspath(part) for part in manifest.get("parts", []))
+        elif p.name not in known and not busy(p.name) and _older_than(p, grace_seconds):
+            removed["index_dirs"] += 1
+            removed["bytes_freed"] += remove_path(p)
+
+    for p in upload_dir.iterdir() if upload_dir.exists() else ():
+        if not p.is_file() or os.path.abspath(p) in referenced or not _older_than(p, grace_seconds):
+            continue
+        # stored files are named <doc_id>_...; temp files of uploads in progress .upload.*.part
+        doc_id = p.name.split("_", 1)[0]
+        if not p.name.startswith(".upload.") and busy(doc_id):
+            continue
+        removed["uploads"] += 1
+        removed["bytes_freed"] += remove_path(p)
+    return removed
+
+
+def run_compaction(
+    index_root: Path,
+    upload_dir: Path,
+    catalog: Catalog,
+    embeddings: Callable[[], Embeddings],
+    settings: CompactionSettings = CompactionSettings(),
+    busy: Callable[[str], bool] = lambda doc_id: False,
+    on_change: Optional[Callable[[str], None]] = None,
+    corpus: Optional[CorpusIndex] = None,
+) -> Dict[str, int]:
+    # one pass over every document; a failure on one document is logged and
+    # the pass goes on
+    report = {"compacted": 0, "generations_bytes_freed": 0}
+    for p in sorted(index_root.iterdir()) if index_root.exists() else ():
+        if not p.is_dir() or p.name.startswith(TRASH_PREFIX) or busy(p.name):
+            continue
+        try:
+            if compact_document(p, embeddings, settings) is not None:
+                report["compacted"] += 1
+                if on_change:
+                    on_change(p.name)
+                logger.info(f"Compacted index | doc_id={p.name}")
+            report["generations_bytes_freed"] += remove_stale_generations(p, settings.grace_seconds)
+        except Exception:
+            logger.exception(f"Compaction failed | doc_id={p.name}")
+    report.update(remove_orphans(index_root, upload_dir, catalog, settings.grace_seconds, busy))
+    if corpus is not None:
+        try:
+            report.update(corpus.compact(settings.min_deleted_percent, settings.grace_seconds))
+        except Exception:
+            logger.exception("Corpus compaction failed")
+    return report
+
+
+class Compactor:
+    # runs run_compaction every interval_seconds on a daemon thread
+    def __init__(self, interval_seconds: float, run: Callable[[], Dict[str, int]]):
+        self.interval_seconds = interval_seconds
+        self._run = run
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_report: Dict[str, int] = {}
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._loop, name="compactor", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        # waits up to timeout seconds for a pass in progress to finish
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.last_report = self._run()
+            except Exception:
+                logger.exception("Compaction pass failed")
+                continue
+            if any(self.last_report.values()):
+                logger.info(f"Compaction pass | {self.last_report}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from app.ann import settings_from_config
+    from app.config import AppConfig
+    from app.corpus import CorpusIndex
+    from app.storage import get_catalog
+    from app.vectorstore import embeddings_from_config
+
+    parser = argparse.ArgumentParser(description="Compact document indexes and remove unreferenced files")
+    parser.add_argument("--grace-seconds", type=int, help="keep superseded files this long (default: COMPACTION_GRACE_SECONDS)")
+    args = parser.parse_args()
+
+    cfg = AppConfig()
+    settings = CompactionSettings(
+        min_deleted_percent=cfg.compaction_min_deleted_percent,
+        grace_seconds=cfg.compaction_grace_seconds if args.grace_seconds is None else args.grace_seconds,
+        ann=settings_from_config(cfg),
+    )
+    report = run_compaction(
+        cfg.index_dir,
+        cfg.upload_dir,
+        get_catalog(cfg.index_dir),
+        lambda: embeddings_from_config(cfg),
+        settings,
+        corpus=CorpusIndex(cfg.corpus_dir, lambda: embeddings_from_config(cfg), n_shards=cfg.corpus_shards)
+        if cfg.corpus_enabled
+        else None,
+    )
+    print(", ".join(f"{k}={v}" for k, v in report.items()))
@@ -17,6 +17,25 @@ def _get_int(name: str, default: int) -> int:
         raise RuntimeError(f"Invalid int for {name}: {raw}") from e
 
 
+def _get_bool(name: str, default: bool) -> bool:
+    raw = os.getenv(name)
+    if raw is None or raw == "":
+        return default
+    val = raw.strip().lower()
+    if val in {"1", "true", "yes", "on"}:
+        return True
+    if val in {"0", "false", "no", "off"}:
+        return False
+    raise RuntimeError(f"Invalid bool for {name}: {raw}")
+
+
+def _get_choice(name: str, default: str, choices: tuple) -> str:
+    raw = os.getenv(name, default).strip().lower()
+    if raw not in choices:
+        raise RuntimeError(f"Invalid value for {name}: {raw} (expected one of {', '.join(choices)})")
+    return raw
+
+
 def _must_get(name: str) -> str:
     val = os.getenv(name)
     if not val:
@@ -30,7 +49,63 @@ class AppConfig:
     data_dir: Path = Path(os.getenv("DATA_DIR", "data"))
     default_model: str = os.getenv("DEFAULT_MODEL", "llama-3.1-8b-instant")
     fallback_model: str = os.getenv("FALLBACK_MODEL", "llama-3.3-70b-versatile")
+    groq_base_url: str = os.getenv("GROQ_BASE_URL", "")
     max_upload_mb: int = _get_int("MAX_UPLOAD_MB", 25)
+    embedding_model: str = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+    embedding_warmup: bool = _get_bool("EMBEDDING_WARMUP", True)
+    embedding_backend: str = _get_choice("EMBEDDING_BACKEND", "torch", ("torch", "int8", "onnx"))
+    embedding_onnx_file: str = os.getenv("EMBEDDING_ONNX_FILE", "")
+    embedding_batching: bool = _get_bool("EMBEDDING_BATCHING", True)
+    embedding_batch_max_size: int = _get_int("EMBEDDING_BATCH_MAX_SIZE", 32)
+    embedding_batch_max_wait_ms: int = _get_int("EMBEDDING_BATCH_MAX_WAIT_MS", 5)
+    index_cache_max_entries: int = _get_int("INDEX_CACHE_MAX_ENTRIES", 16)
+    index_cache_max_mb: int = _get_int("INDEX_CACHE_MAX_MB", 512)
+    ingest_workers: int = _get_int("INGEST_WORKERS", 1)
+    ingest_queue_depth: int = _get_int("INGEST_QUEUE_DEPTH", 8)
+    pdf_extract_workers: int = _get_int("PDF_EXTRACT_WORKERS", min(4, os.cpu_count() or 1))
+    pdf_parallel_min_pages: int = _get_int("PDF_PARALLEL_MIN_PAGES", 64)
+    ingest_prefetch_chunks: int = _get_int("INGEST_PREFETCH_CHUNKS", 256)
+    embedding_cache_enabled: bool = _get_bool("EMBEDDING_CACHE_ENABLED", True)
+    embedding_cache_max_rows: int = _get_int("EMBEDDING_CACHE_MAX_ROWS", 200_000)
+    query_cache_max_entries: int = _get_int("QUERY_CACHE_MAX_ENTRIES", 2048)
+    query_cache_ttl_seconds: int = _get_int("QUERY_CACHE_TTL_SECONDS", 3600)
+    answer_cache_enabled: bool = _get_bool("ANSWER_CACHE_ENABLED", True)
+    corpus_enabled: bool = _get_bool("CORPUS_ENABLED", True)
+    corpus_shards: int = _get_int("CORPUS_SHARDS", 4)
+    ann_hnsw_min_chunks: int = _get_int("ANN_HNSW_MIN_CHUNKS", 2_000)
+    ann_ivf_min_chunks: int = _get_int("ANN_IVF_MIN_CHUNKS", 20_000)
+    ann_ivfpq_min_chunks: int = _get_int("ANN_IVFPQ_MIN_CHUNKS", 200_000)
+    ann_ef_search: int = _get_int("ANN_EF_SEARCH", 64)
+    ann_nlist: int = _get_int("ANN_NLIST", 0)
+    ann_nprobe: int = _get_int("ANN_NPROBE", 0)
+    ann_pq_m: int = _get_int("ANN_PQ_M", 48)
+    hybrid_enabled: bool = _get_bool("HYBRID_ENABLED", True)
+    hybrid_fetch_k: int = _get_int("HYBRID_FETCH_K", 20)
+    hybrid_rrf_k: int = _get_int("HYBRID_RRF_K", 60)
+    history_max_sessions: int = _get_int("HISTORY_MAX_SESSIONS", 10_000)
+    history_ttl_seconds: int = _get_int("HISTORY_TTL_SECONDS", 7 * 24 * 3600)
+    history_max_tokens: int = _get_int("HISTORY_MAX_TOKENS", 2000)
+    context_max_tokens: int = _get_int("CONTEXT_MAX_TOKENS", 3000)
+    ask_batch_max_questions: int = _get_int("ASK_BATCH_MAX_QUESTIONS", 64)
+    ask_batch_concurrency: int = _get_int("ASK_BATCH_CONCURRENCY", 4)
+    preload: str = _get_choice("PRELOAD", "eager", ("eager", "lazy"))
+    llm_hedge_enabled: bool = _get_bool("LLM_HEDGE_ENABLED", True)
+    llm_hedge_min_ms: int = _get_int("LLM_HEDGE_MIN_MS", 300)
+    llm_hedge_default_ms: int = _get_int("LLM_HEDGE_DEFAULT_MS", 2000)
+    llm_breaker_error_percent: int = _get_int("LLM_BREAKER_ERROR_PERCENT", 50)
+    llm_breaker_cooldown_seconds: int = _get_int("LLM_BREAKER_COOLDOWN_SECONDS", 30)
+    compaction_interval_seconds: int = _get_int("COMPACTION_INTERVAL_SECONDS", 600)
+    compaction_min_deleted_percent: int = _get_int("COMPACTION_MIN_DELETED_PERCENT", 20)
+    compaction_grace_seconds: int = _get_int("COMPACTION_GRACE_SECONDS", 300)
+
+    @property
+    def embedding_cache_key(self) -> str:
+        # vectors of a quantized or ONNX model differ slightly from fp32, so
+        # each backend caches under its own name
+        if self.embedding_backend == "torch":
+            return self.embedding_model
+        key = f"{self.embedding_model}@{self.embedding_backend}"
+        return f"{key}:{self.embedding_onnx_file}" if self.embedding_onnx_file else key
 
     @property
     def upload_dir(self) -> Path:
@@ -40,6 +115,18 @@ class AppConfig:
     def index_dir(self) -> Path:
         return self.data_dir / "index"
 
+    @property
+    def corpus_dir(self) -> Path:
+        return self.data_dir / "corpus"
+
+    @property
+    def embedding_cache_dir(self) -> Path:
+        return self.data_dir / "embedding_cache"
+
+    @property
+    def history_db(self) -> Path:
+        return self.data_dir / "history.sqlite3"
+
 
 def load_config() -> AppConfig:
     _must_get("GROQ_API_KEY")
@@ -0,0 +1,654 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import hashlib
+import json
+import mmap
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app.compact_store import CHUNKS_FILE, CompactDocstore, INDEX_FILE, OFFSETS_FILE, is_compact
+from app.compaction import remove_path
+from app.storage import GENERATION_PREFIX, generation_dir
+from app.utils import FileLock, ensure_dir
+
+# Shard directory layout:
+#   log.jsonl       committed changes, one JSON object per line. The first
+#                   line is {"generation": g, "dim": d, "created_at": t}; each
+#                   other line changes one document:
+#                     {"doc_id": ..., "drop": true | [serials], "rows": [start, stop]}
+#                   "drop" true drops the document's rows and a list drops
+#                   those serials; "rows" then adds rows start..stop-1
+#   gen-<g>/        row files of the generation, only ever appended to:
+#     vectors.f32   float32 (n, dim)
+#     serials.i64   int64 chunk serial of each row
+#     chunks.idx    int64 (n, 3): byte offset, text length, metadata length
+#     chunks.bin    utf-8 chunk text followed by its JSON metadata
+# A write appends its rows and then one log line, so it costs what it adds,
+# not the size of the shard. Dropped rows stay in the files until the
+# compactor copies the live rows into the next generation and replaces
+# log.jsonl. Readers memmap the row files and replay the log as it grows.
+LOG_FILE = "log.jsonl"
+VECTORS_FILE = "vectors.f32"
+SERIALS_FILE = "serials.i64"
+ROW_OFFSETS_FILE = "chunks.idx"
+
+# rows read in per step of a search
+SEARCH_BLOCK_ROWS = 16384
+# rows copied per step of a compaction
+COPY_BLOCK_ROWS = 1024
+
+_NO_ROWS = np.zeros(0, dtype=np.int64)
+
+
+def _header(generation: int, dim: int) -> Dict[str, Any]:
+    return {"generation": generation, "dim": dim, "created_at": time.time()}
+
+
+class _RowFiles:
+    # the row files of one shard generation. Rows are read through memmaps,
+    # so neither chunk text nor vectors are held in memory.
+    def __init__(self, path: Path, dim: int):
+        self.path = path
+        self.dim = dim
+        self.vectors = np.zeros((0, dim), dtype="<f4")
+        self.serials = _NO_ROWS
+        self.offsets = np.zeros((0, 3), dtype="<i8")
+        self._data: Union[mmap.mmap, bytes] = b""
+
+    def _size(self, name: str) -> int:
+        try:
+            return (self.path / name).stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def _row_end(self, row: int) -> int:
+        start, text_len, meta_len = np.fromfile(self.path / ROW_OFFSETS_FILE, dtype="<i8", count=3, offset=row * 24)
+        return int(start + text_len + meta_len)
+
+    def count(self) -> int:
+        # complete rows on disk
+        n = min(
+            self._size(VECTORS_FILE) // (4 * self.dim),
+            self._size(SERIALS_FILE) // 8,
+            self._size(ROW_OFFSETS_FILE) // 24,
+        )
+        chunks = self._size(CHUNKS_FILE)
+        while n and self._row_end(n - 1) > chunks:
+            n -= 1
+        return n
+
+    def repair(self) -> int:
+        # a writer that died while appending leaves a partial row behind;
+        # cut it off before the next append. Returns the row count.
+        n = self.count()
+        sizes = {
+            VECTORS_FILE: n * 4 * self.dim,
+            SERIALS_FILE: n * 8,
+            ROW_OFFSETS_FILE: n * 24,
+            CHUNKS_FILE: self._row_end(n - 1) if n else 0,
+        }
+        for name, size in sizes.items():
+            if self._size(name) > size:
+                os.truncate(self.path / name, size)
+        return n
+
+    def append(self, texts: Sequence[str], metadatas: Sequence[dict], vectors: np.ndarray, serials: Sequence[int]) -> int:
+        pieces = [
+            (t.encode("utf-8"), json.dumps(m, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+            for t, m in zip(texts, metadatas)
+        ]
+        return self._write(vectors, np.asarray(serials, dtype="<i8"), pieces)
+
+    def copy_rows(self, src: "_RowFiles", rows: np.ndarray) -> int:
+        # raw bytes of rows already in src, without decoding them
+        for start in range(0, len(rows), COPY_BLOCK_ROWS):
+            block = rows[start:start + COPY_BLOCK_ROWS]
+            pieces = []
+            for offset, text_len, meta_len in src.offsets[block].tolist():
+                pieces.append((src._data[offset:offset + text_len], src._data[offset + text_len:offset + text_len + meta_len]))
+            self._write(src.vectors[block], src.serials[block], pieces)
+        return len(rows)
+
+    def _write(self, vectors, serials: np.ndarray, pieces: List[Tuple[bytes, bytes]]) -> int:
+        # the caller holds the shard's file lock and has called repair()
+        vectors = np.ascontiguousarray(vectors, dtype="<f4")
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Vectors have {vectors.shape[1]} dimensions, the corpus has {self.dim}")
+        ensure_dir(self.path)
+        pos = self._size(CHUNKS_FILE)
+        offsets = np.zeros((len(pieces), 3), dtype="<i8")
+        with open(self.path / CHUNKS_FILE, "ab") as f:
+            for i, (text, meta) in enumerate(pieces):
+                f.write(text)
+                f.write(meta)
+                offsets[i] = (pos, len(text), len(meta))
+                pos += len(text) + len(meta)
+        for name, arr in ((VECTORS_FILE, vectors), (SERIALS_FILE, serials), (ROW_OFFSETS_FILE, offsets)):
+            with open(self.path / name, "ab") as f:
+                f.write(np.ascontiguousarray(arr).tobytes())
+        return len(pieces)
+
+    def map(self, n: int) -> None:
+        # memmaps of the first n rows; rows appended later are mapped by the next call
+        self.vectors = np.memmap(self.path / VECTORS_FILE, dtype="<f4", mode="r", shape=(n, self.dim))
+        self.serials = np.memmap(self.path / SERIALS_FILE, dtype="<i8", mode="r", shape=(n,))
+        self.offsets = np.memmap(self.path / ROW_OFFSETS_FILE, dtype="<i8", mode="r", shape=(n, 3))
+        with open(self.path / CHUNKS_FILE, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get(self, row: int) -> Document:
+        start, text_len, meta_len = (int(x) for x in self.offsets[row])
+        text = self._data[start:start + text_len].decode("utf-8")
+        meta = json.loads(self._data[start + text_len:start + text_len + meta_len].decode("utf-8"))
+        return Document(page_content=text, metadata=meta)
+
+
+class _Shard:
+    # lock guards the in-memory view for searches; writers also hold
+    # write_lock and the shard's file lock, so one writer at a time across
+    # threads and worker processes appends to the shard
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.files: Optional[_RowFiles] = None
+        self.generation = 0
+        self.created_at = 0.0
+        # live rows of each document, and of the shard
+        self.members: Dict[str, np.ndarray] = {}
+        self.live = np.zeros(0, dtype=bool)
+        self.norms = np.zeros(0, dtype=np.float32)
+        self.n_rows = 0
+        self._log_ino = 0
+        self._log_pos = 0
+
+    @property
+    def log_path(self) -> Path:
+        return self.path / LOG_FILE
+
+    def signature(self) -> Tuple[int, int]:
+        try:
+            st = self.log_path.stat()
+        except FileNotFoundError:
+            return (0, 0)
+        return (st.st_ino, st.st_size)
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        ensure_dir(self.path)
+        with self.write_lock, FileLock(self.path / ".lock"):
+            yield
+
+    def load(self) -> None:
+        # replays the log lines written since the last load, by this or
+        # another worker; a compacted shard has a new log and is read again
+        try:
+            f = open(self.log_path, "rb")
+        except FileNotFoundError:
+            if self.files is not None:
+                self._reset()
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            if st.st_ino != self._log_ino:
+                self._reset()
+                self._log_ino = st.st_ino
+            if st.st_size <= self._log_pos:
+                return
+            f.seek(self._log_pos)
+            data = f.read(st.st_size - self._log_pos)
+        # a line still being appended is read by the next load
+        data = data[:data.rfind(b"\n") + 1]
+        self._log_pos += len(data)
+        entries = [json.loads(line) for line in data.splitlines() if line.strip()]
+
+        for e in entries:
+            if "generation" in e:
+                self.generation = int(e["generation"])
+                self.created_at = float(e.get("created_at", 0))
+                self.files = _RowFiles(generation_dir(self.path, self.generation), int(e["dim"]))
+        stops = [int(e["rows"][1]) for e in entries if "rows" in e]
+        if stops:
+            self._grow(max(stops))
+        for e in entries:
+            if "doc_id" in e:
+                self._apply(e)
+
+    def _grow(self, n: int) -> None:
+        if n <= self.n_rows:
+            return
+        self.files.map(n)
+        norms = [self.norms]
+        for start in range(self.n_rows, n, SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.files.vectors[start:min(start + SEARCH_BLOCK_ROWS, n)])
+            norms.append((block * block).sum(axis=1))
+        self.norms = np.concatenate(norms)
+        self.live = np.concatenate([self.live, np.zeros(n - self.n_rows, dtype=bool)])
+        self.n_rows = n
+
+    def _apply(self, entry: Dict[str, Any]) -> None:
+        doc_id = entry["doc_id"]
+        rows = self.members.get(doc_id, _NO_ROWS)
+        drop = entry.get("drop")
+        if drop is True:
+            self.live[rows] = False
+            rows = _NO_ROWS
+        elif drop:
+            gone = np.isin(self.files.serials[rows], np.asarray(drop, dtype=np.int64))
+            self.live[rows[gone]] = False
+            rows = rows[~gone]
+
+        if "rows" in entry:
+            start, stop = (int(x) for x in entry["rows"])
+            self.live[start:stop] = True
+            rows = np.concatenate([rows, np.arange(start, stop, dtype=np.int64)])
+        elif drop is True:
+            # the document was removed
+            self.members.pop(doc_id, None)
+            return
+        self.members[doc_id] = rows
+
+    def nearest(self, queries: np.ndarray, k: int, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        # exact squared L2 distances, as IndexFlatL2 gives, over the live
+        # rows or the given ones; one block of vectors is read in at a time.
+        # Missing hits have an infinite distance.
+        q_norms = (queries * queries).sum(axis=1)[:, None]
+        best_d = np.zeros((len(queries), 0), dtype=np.float32)
+        best_r = np.zeros((len(queries), 0), dtype=np.int64)
+        total = self.n_rows if rows is None else len(rows)
+        for start in range(0, total, SEARCH_BLOCK_ROWS):
+            stop = min(start + SEARCH_BLOCK_ROWS, total)
+            if rows is None:
+                block = np.arange(start, stop, dtype=np.int64)
+                d = q_norms + self.norms[start:stop] - 2 * (queries @ self.files.vectors[start:stop].T)
+                d[:, ~self.live[start:stop]] = np.inf
+            else:
+                block = rows[start:stop]
+                d = q_norms + self.norms[block] - 2 * (queries @ self.files.vectors[block].T)
+            best_d = np.hstack([best_d, d])
+            best_r = np.hstack([best_r, np.broadcast_to(block, d.shape)])
+            if best_d.shape[1] > k:
+                top = np.argpartition(best_d, k - 1, axis=1)[:, :k]
+                best_d = np.take_along_axis(best_d, top, axis=1)
+                best_r = np.take_along_axis(best_r, top, axis=1)
+        order = np.argsort(best_d, axis=1, kind="stable")
+        return np.take_along_axis(best_d, order, axis=1), np.take_along_axis(best_r, order, axis=1)
+
+    def dead_rows(self) -> int:
+        return self.n_rows - int(self.live.sum())
+
+    def write_log(self, entries: List[Dict[str, Any]]) -> None:
+        # a new log, e.g. after compaction: readers see a new inode and read it whole
+        tmp = self.path / f".{LOG_FILE}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(e) + "\n" for e in entries)
+        os.replace(tmp, self.log_path)
+
+    def append_log(self, entry: Dict[str, Any]) -> None:
+        # one write of a whole line; readers skip a line until it is complete
+        with open(self.log_path, "ab") as f:
+            f.write((json.dumps(entry) + "\n").encode("utf-8"))
+
+    def create(self, dim: int) -> None:
+        # the first write to an empty shard
+        shutil.rmtree(generation_dir(self.path, 1), ignore_errors=True)
+        self.write_log([_header(1, dim)])
+
+    def compact(self) -> None:
+        # caller holds exclusive(): copies the live rows into the next
+        # generation, each document's rows together, then switches the log
+        generation = self.generation + 1
+        new = _RowFiles(generation_dir(self.path, generation), self.files.dim)
+        shutil.rmtree(new.path, ignore_errors=True)
+        ensure_dir(new.path)
+        with self.lock:
+            members = dict(self.members)
+        entries = [_header(generation, new.dim)]
+        n = 0
+        for doc_id, rows in members.items():
+            added = new.copy_rows(self.files, rows)
+            entries.append({"doc_id": doc_id, "rows": [n, n + added]})
+            n += added
+        self.write_log(entries)
+
+    def remove_stale_generations(self, grace_seconds: int) -> int:
+        # generations before the current one, once no search can still be
+        # reading them; returns the bytes freed
+        if not self.generation or time.time() - self.created_at < grace_seconds:
+            return 0
+        freed = 0
+        for p in self.path.glob(f"{GENERATION_PREFIX}*"):
+            number = p.name[len(GENERATION_PREFIX):]
+            if p.is_dir() and number.isdigit() and int(number) < self.generation:
+                freed += remove_path(p)
+        return freed
+
+    def upgrade(self) -> bool:
+        # Shards written before the log kept a FAISS index and a compact
+        # chunk store in the shard directory and were rewritten whole on
+        # every change. They are converted once into generation 1. Rows
+        # without a stored serial number each document's rows in order.
+        if self.log_path.exists() or not is_compact(self.path):
+            return False
+        import faiss
+
+        index = faiss.read_index(str(self.path / INDEX_FILE))
+        store = CompactDocstore(self.path)
+        by_doc: Dict[str, List[int]] = {}
+        for row in range(len(store)):
+            by_doc.setdefault(store.get(row).metadata.get("doc_id", ""), []).append(row)
+
+        files = _RowFiles(generation_dir(self.path, 1), index.d)
+        shutil.rmtree(files.path, ignore_errors=True)
+        entries = [_header(1, index.d)]
+        n = 0
+        for doc_id, rows in by_doc.items():
+            for start in range(0, len(rows), COPY_BLOCK_ROWS):
+                block = rows[start:start + COPY_BLOCK_ROWS]
+                docs = [store.get(r) for r in block]
+                serials = [int(d.metadata.get("serial", start + i)) for i, d in enumerate(docs)]
+                files.append(
+                    [d.page_content for d in docs],
+                    [{**d.metadata, "serial": s} for d, s in zip(docs, serials)],
+                    index.reconstruct_batch(np.asarray(block, dtype=np.int64)),
+                    serials,
+                )
+            entries.append({"doc_id": doc_id, "rows": [n, n + len(rows)]})
+            n += len(rows)
+        self.write_log(entries)
+
+        for name in (INDEX_FILE, CHUNKS_FILE, OFFSETS_FILE, "members.json"):
+            (self.path / name).unlink(missing_ok=True)
+        return True
+
+
+class CorpusWriter:
+    # Collects a document's chunks during ingest. Without first_serial the
+    # chunks are the whole document and replace it in the corpus; with it
+    # they are added as serials first_serial, first_serial + 1, ... and the
+    # serials in removed are dropped (an incremental update). Each embedded
+    # batch goes straight to a spill directory in the shard's row format,
+    # so the writer holds no chunks; commit() copies the spill into the
+    # shard block by block and removes it, and discard() drops it.
+    def __init__(self, corpus: "CorpusIndex", doc_id: str, first_serial: Optional[int] = None):
+        self.corpus = corpus
+        self.doc_id = doc_id
+        self.first_serial = first_serial
+        self.removed: List[int] = []
+        self.rows = 0
+        self._spill: Optional[_RowFiles] = None
+
+    def add(self, docs: Sequence[Document], vectors: Sequence[Sequence[float]]) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self._spill is None:
+            ensure_dir(self.corpus.pending_dir)
+            path = Path(tempfile.mkdtemp(prefix=f"{self.doc_id}-", dir=self.corpus.pending_dir))
+            self._spill = _RowFiles(path, vectors.shape[1])
+        first = (self.first_serial or 0) + self.rows
+        serials = list(range(first, first + len(docs)))
+        metadatas = [{**d.metadata, "doc_id": self.doc_id, "serial": s} for d, s in zip(docs, serials)]
+        self.rows += self._spill.append([d.page_content for d in docs], metadatas, vectors, serials)
+
+    def commit(self) -> None:
+        try:
+            append = None
+            if self.rows:
+                spill, rows = self._spill, np.arange(self.rows, dtype=np.int64)
+                spill.map(self.rows)
+                append = (spill.dim, lambda files: files.copy_rows(spill, rows))
+            if self.first_serial is None:
+                if append is not None:
+                    self.corpus._commit(self.doc_id, True, append)
+            else:
+                self.corpus._commit(self.doc_id, [int(s) for s in self.removed], append, existing_only=True)
+        finally:
+            self.discard()
+
+    def discard(self) -> None:
+        if self._spill is not None:
+            shutil.rmtree(self._spill.path, ignore_errors=True)
+            self._spill = None
+
+
+class CorpusIndex:
+    # Chunks from all documents, spread over a fixed number of shards by
+    # doc_id hash and searched exactly. Chunks keep their serial (see
+    # app.compact_store), so an update can drop single chunks of a document
+    # and a delete all of them without rewriting the shard.
+    def __init__(
+        self,
+        root: Path,
+        embeddings: Callable[[], Embeddings],
+        n_shards: int = 4,
+        search_workers: int = 4,
+    ):
+        self.root = root
+        self._embeddings = embeddings
+        self.shards = [_Shard(root / f"shard_{i:03d}") for i in range(n_shards)]
+        self._pool = ThreadPoolExecutor(max_workers=max(1, min(search_workers, n_shards)), thread_name_prefix="corpus")
+        ensure_dir(root)
+        for shard in self.shards:
+            if not shard.log_path.exists() and is_compact(shard.path):
+                with shard.exclusive():
+                    shard.upgrade()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embeddings()
+
+    @property
+    def pending_dir(self) -> Path:
+        # spills of CorpusWriters that have not committed yet
+        return self.root / ".pending"
+
+    def shard_for(self, doc_id: str) -> _Shard:
+        h = int(hashlib.sha1(doc_id.encode("utf-8")).hexdigest()[:8], 16)
+        return self.shards[h % len(self.shards)]
+
+    def writer(self, doc_id: str, first_serial: Optional[int] = None) -> CorpusWriter:
+        return CorpusWriter(self, doc_id, first_serial)
+
+    def add_document(
+        self,
+        doc_id: str,
+        texts: List[str],
+        vectors: Sequence[Sequence[float]],
+        metadatas: List[dict],
+        serials: Optional[Sequence[int]] = None,
+    ) -> None:
+        if not texts:
+            return
+        serials = [int(s) for s in (serials if serials is not None else range(len(texts)))]
+        self._commit(doc_id, True, self._appender(doc_id, texts, vectors, metadatas, serials))
+
+    def update_document(
+        self,
+        doc_id: str,
+        removed: Sequence[int],
+        texts: List[str],
+        vectors: Sequence[Sequence[float]],
+        metadatas: List[dict],
+        serials: Sequence[int],
+    ) -> bool:
+        # drops and adds chunks by serial. A document that is not in the
+        # corpus is left out rather than added in part; backfill adds it whole.
+        append = self._appender(doc_id, texts, vectors, metadatas, [int(s) for s in serials]) if texts else None
+        return self._commit(doc_id, [int(s) for s in removed], append, existing_only=True)
+
+    def remove_document(self, doc_id: str) -> bool:
+        return self._commit(doc_id, True, existing_only=True)
+
+    @staticmethod
+    def _appender(doc_id: str, texts: List[str], vectors, metadatas: List[dict], serials: List[int]):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        metadatas = [{**m, "doc_id": doc_id, "serial": s} for m, s in zip(metadatas, serials)]
+        return vectors.shape[1], lambda files: files.append(texts, metadatas, vectors, serials)
+
+    def _commit(
+        self,
+        doc_id: str,
+        drop: Union[bool, List[int]],
+        append: Optional[Tuple[int, Callable[[_RowFiles], int]]] = None,
+        existing_only: bool = False,
+    ) -> bool:
+        # appends the rows, then the log line that makes them and the drop
+        # visible; searches go on meanwhile
+        shard = self.shard_for(doc_id)
+        with shard.exclusive():
+            # re-read under the file lock: another worker may have just written
+            with shard.lock:
+                shard.load()
+            if existing_only and doc_id not in shard.members:
+                return False
+
+            entry: Dict[str, Any] = {"doc_id": doc_id, "drop": drop}
+            if append is not None:
+                dim, write = append
+                if shard.files is None:
+                    shard.create(dim)
+                    with shard.lock:
+                        shard.load()
+                start = shard.files.repair()
+                entry["rows"] = [start, start + write(shard.files)]
+            shard.append_log(entry)
+            return True
+
+    def contains(self, doc_id: str) -> bool:
+        shard = self.shard_for(doc_id)
+        with shard.lock:
+            shard.load()
+            return doc_id in shard.members
+
+    def signature(self) -> Tuple[Tuple[int, int], ...]:
+        return tuple(s.signature() for s in self.shards)
+
+    def compact(self, min_deleted_percent: int, grace_seconds: int) -> Dict[str, int]:
+        # shards whose share of dropped rows reaches min_deleted_percent get
+        # a new generation; superseded ones are removed grace_seconds later
+        report = {"corpus_shards_compacted": 0, "corpus_bytes_freed": 0}
+        # spills of ingests that died; a live one is written to every batch
+        for p in self.pending_dir.glob("*") if self.pending_dir.exists() else ():
+            mtimes = [f.stat().st_mtime for f in p.iterdir()] if p.is_dir() else []
+            if time.time() - max(mtimes, default=p.stat().st_mtime) > grace_seconds:
+                report["corpus_bytes_freed"] += remove_path(p)
+        for shard in self.shards:
+            with shard.exclusive():
+                with shard.lock:
+                    shard.load()
+                report["corpus_bytes_freed"] += shard.remove_stale_generations(grace_seconds)
+                dead = shard.dead_rows()
+                if dead and dead * 100 >= min_deleted_percent * shard.n_rows:
+                    shard.compact()
+                    report["corpus_shards_compacted"] += 1
+        return report
+
+    def search(
+        self,
+        vector: List[float],
+        k: int,
+        doc_ids: Optional[Set[str]] = None,
+    ) -> List[Tuple[Document, float]]:
+        return self.search_many([vector], k, doc_ids)[0]
+
+    def search_many(
+        self,
+        vectors: List[List[float]],
+        k: int,
+        doc_ids: Optional[Set[str]] = None,
+    ) -> List[List[Tuple[Document, float]]]:
+        # one pass over each shard for all queries
+        queries = np.asarray(vectors, dtype=np.float32)
+        shards = self.shards
+        if doc_ids is not None:
+            wanted = {id(self.shard_for(d)) for d in doc_ids}
+            shards = [s for s in shards if id(s) in wanted]
+
+        futures = [self._pool.submit(self._search_shard, s, queries, k, doc_ids) for s in shards]
+        hits: List[List[Tuple[Document, float]]] = [[] for _ in range(len(queries))]
+        for fut in futures:
+            for i, shard_hits in enumerate(fut.result()):
+                hits[i].extend(shard_hits)
+
+        for h in hits:
+            h.sort(key=lambda x: x[1])
+        return [h[:k] for h in hits]
+
+    def _search_shard(
+        self,
+        shard: _Shard,
+        queries: np.ndarray,
+        k: int,
+        doc_ids: Optional[Set[str]],
+    ) -> List[List[Tuple[Document, float]]]:
+        empty: List[List[Tuple[Document, float]]] = [[] for _ in range(len(queries))]
+        with shard.lock:
+            shard.load()
+            if not shard.n_rows:
+                return empty
+
+            rows = None
+            if doc_ids is not None:
+                picked = [shard.members[d] for d in doc_ids if d in shard.members]
+                rows = np.concatenate(picked) if picked else _NO_ROWS
+                if not len(rows):
+                    return empty
+
+            distances, rows = shard.nearest(queries, k, rows)
+            return [
+                [(shard.files.get(int(row)), float(dist)) for dist, row in zip(q_dist, q_rows) if np.isfinite(dist)]
+                for q_dist, q_rows in zip(distances, rows)
+            ]
+
+
+def backfill(index_root: Path, corpus: CorpusIndex) -> int:
+    from app.compact_store import read_rowids, read_tombstones
+    from app.storage import index_files_dir, read_manifest
+    from app.vectorstore import load_faiss_index
+
+    added = 0
+    for p in sorted(index_root.glob("*")):
+        m = read_manifest(p) if p.is_dir() else {}
+        if m.get("status", "ready") != "ready" or not m.get("doc_id") or corpus.contains(m["doc_id"]):
+            continue
+
+        vs = load_faiss_index(p, corpus.embeddings, manifest=m)
+        files_path = index_files_dir(p, m)
+        deleted = set(read_tombstones(files_path).tolist())
+        rows = [i for i in range(vs.index.ntotal) if i not in deleted]
+        serials = read_rowids(files_path, vs.index.ntotal)[rows].tolist()
+        docs = [vs.docstore.search(vs.index_to_docstore_id[i]) for i in rows]
+        # re-embed rather than reconstruct: IVF-PQ vectors are lossy
+        vectors = corpus.embeddings.embed_documents([d.page_content for d in docs])
+        metadatas = [{**d.metadata, "doc_id": m["doc_id"]} for d in docs]
+        corpus.add_document(m["doc_id"], [d.page_content for d in docs], vectors, metadatas, serials=serials)
+        added += 1
+    return added
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from app.config import AppConfig
+    from app.vectorstore import embeddings_from_config
+
+    parser = argparse.ArgumentParser(description="Maintain the shared corpus index")
+    parser.add_argument("command", choices=["backfill"], help="backfill: add indexed documents missing from the corpus")
+    args = parser.parse_args()
+
+    cfg = AppConfig()
+    corpus = CorpusIndex(cfg.corpus_dir, lambda: embeddings_from_config(cfg), n_shards=cfg.corpus_shards)
+    print(f"Added {backfill(cfg.index_dir, corpus)} documents to the corpus")
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.utils import FileLock, ensure_dir
+
+
+# one fixed-size record per cached row: sha256 of the chunk text and the
+# last time the row was used, row i of the vector file belongs to record i
+KEY_DTYPE = np.dtype([("key", "S32"), ("used", "<u8")])
+
+# hits only move "used" in memory; they are written back to keys.bin on the
+# next write, before eviction, on shutdown, or at most this often on reads
+USED_FLUSH_SECONDS = 60
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    def __init__(self, root: Path, model_name: str, max_rows: int = 200_000):
+        self.model_name = model_name
+        self.max_rows = max_rows
+        self.dir = root / re.sub(r"[^a-zA-Z0-9._-]", "_", model_name)
+        ensure_dir(self.dir)
+
+        self._vectors_path = self.dir / "vectors.f32"
+        self._keys_path = self.dir / "keys.bin"
+        self._meta_path = self.dir / "meta.json"
+        self._lock_path = self.dir / ".lock"
+
+        self._lock = threading.Lock()
+        self._rows: Dict[bytes, int] = {}
+        self._used = np.zeros(0, dtype="<u8")
+        self._touched: Dict[bytes, int] = {}
+        self._flushed_at = time.monotonic()
+        self._vectors: Optional[np.memmap] = None
+        self._dim = 0
+        self._loaded_size = 0
+        self._loaded_inode = 0
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[np.ndarray]]:
+        with self._lock:
+            self._refresh()
+            now = int(time.time())
+            out: List[Optional[np.ndarray]] = []
+            for k in keys:
+                row = self._rows.get(k)
+                if row is None:
+                    out.append(None)
+                else:
+                    self._used[row] = now
+                    self._touched[k] = now
+                    out.append(np.array(self._vectors[row]))
+            if self._touched and time.monotonic() - self._flushed_at > USED_FLUSH_SECONDS:
+                with self._file_lock():
+                    self._write_used()
+            return out
+
+    def put_many(self, keys: List[bytes], vectors: List[List[float]]) -> None:
+        if not keys:
+            return
+
+        arr = np.asarray(vectors, dtype="<f4")
+        with self._lock, self._file_lock():
+            self._write_used()
+            if not self._dim:
+                self._dim = arr.shape[1]
+                with open(self._meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"model": self.model_name, "dim": self._dim}, f)
+
+            fresh = [i for i, k in enumerate(keys) if k not in self._rows]
+            if not fresh:
+                return
+
+            records = np.zeros(len(fresh), dtype=KEY_DTYPE)
+            records["key"] = [keys[i] for i in fresh]
+            records["used"] = int(time.time())
+            with open(self._vectors_path, "ab") as f:
+                f.write(arr[fresh].tobytes())
+            with open(self._keys_path, "ab") as f:
+                f.write(records.tobytes())
+
+            self._refresh()
+            if len(self._rows) > self.max_rows:
+                self._compact(int(self.max_rows * 0.8))
+
+    def flush(self) -> None:
+        with self._lock, self._file_lock():
+            self._write_used()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"rows": len(self._rows), "dim": self._dim, "max_rows": self.max_rows}
+
+    def _file_lock(self):
+        # other uvicorn workers may append to the same cache files
+        return FileLock(self._lock_path)
+
+    def _refresh(self) -> None:
+        if not self._keys_path.exists():
+            return
+
+        st = self._keys_path.stat()
+        if st.st_ino == self._loaded_inode and st.st_size == self._loaded_size:
+            return
+
+        if not self._dim and self._meta_path.exists():
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                self._dim = int(json.load(f)["dim"])
+
+        if st.st_ino != self._loaded_inode:
+            # first load, or the files were compacted by another process
+            self._rows = {}
+            self._used = np.zeros(0, dtype="<u8")
+            self._loaded_size = 0
+
+        n_old = self._loaded_size // KEY_DTYPE.itemsize
+        n_new = st.st_size // KEY_DTYPE.itemsize - n_old
+        records = np.fromfile(
+            self._keys_path, dtype=KEY_DTYPE, count=n_new, offset=n_old * KEY_DTYPE.itemsize
+        )
+        for i, k in enumerate(records["key"].tolist(), start=n_old):
+            self._rows[k] = i
+        self._used = np.concatenate([self._used, records["used"]])
+
+        n_rows = n_old + len(records)
+        self._vectors = np.memmap(self._vectors_path, dtype="<f4", mode="r", shape=(n_rows, self._dim)) if n_rows else None
+        self._loaded_inode = st.st_ino
+        self._loaded_size = n_rows * KEY_DTYPE.itemsize
+
+    def _write_used(self) -> None:
+        # caller holds both locks. Rows are looked up by key after the
+        # refresh, since another worker may have compacted the files.
+        self._flushed_at = time.monotonic()
+        self._refresh()
+        touched, self._touched = self._touched, {}
+        pairs = [(self._rows[k], t) for k, t in touched.items() if k in self._rows]
+        if not pairs:
+            return
+
+        rows = np.array([r for r, _ in pairs], dtype=np.int64)
+        used = np.array([t for _, t in pairs], dtype="<u8")
+        records = np.memmap(self._keys_path, dtype=KEY_DTYPE, mode="r+", shape=(len(self._used),))
+        records["used"][rows] = np.maximum(records["used"][rows], used)
+        records.flush()
+        del records
+        self._used[rows] = np.maximum(self._used[rows], used)
+
+    def _compact(self, keep: int) -> None:
+        # keys.bin holds the hits every worker has written back
+        on_disk = np.fromfile(self._keys_path, dtype=KEY_DTYPE, count=len(self._used))
+        self._used = np.maximum(self._used, on_disk["used"])
+        order = np.argsort(self._used)[::-1][:keep]
+        order.sort()
+
+        keys = sorted(self._rows.items(), key=lambda kv: kv[1])
+        records = np.zeros(len(order), dtype=KEY_DTYPE)
+        records["key"] = [keys[i][0] for i in order]
+        records["used"] = self._used[order]
+        vectors = np.asarray(self._vectors[order], dtype="<f4")
+
+        tmp_vectors = self.dir / "vectors.f32.tmp"
+        tmp_keys = self.dir / "keys.bin.tmp"
+        vectors.tofile(tmp_vectors)
+        records.tofile(tmp_keys)
+        self._vectors = None
+        os.replace(tmp_vectors, self._vectors_path)
+        os.replace(tmp_keys, self._keys_path)
+
+        self._loaded_inode = 0
+        self._refresh()
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, base: Embeddings, cache: EmbeddingCache, batch_size: int = 64):
+        self.base = base
+        self.cache = cache
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [text_key(t) for t in texts]
+        found = self.cache.get_many(keys)
+
+        missing: Dict[bytes, str] = {}
+        for k, t, v in zip(keys, texts, found):
+            if v is None:
+                missing.setdefault(k, t)
+
+        computed: Dict[bytes, List[float]] = {}
+        pending = list(missing.items())
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            vectors = self.base.embed_documents([t for _, t in batch])
+            self.cache.put_many([k for k, _ in batch], vectors)
+            computed.update((k, v) for (k, _), v in zip(batch, vectors))
+
+        n_miss = sum(1 for v in found if v is None)
+        self.hits += len(texts) - n_miss
+        self.misses += n_miss
+
+        return [v.tolist() if v is not None else list(computed[k]) for k, v in zip(keys, found)]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.base.embed_query(text)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
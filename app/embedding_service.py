@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+from collections import deque
+from dataclasses import dataclass
+import threading
+import time
+from typing import Deque, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from app.metrics import EMBED_BATCH_SIZE, EMBED_QUEUE_WAIT
+
+# Concurrent embedding calls share one model, and each model call has a
+# fixed cost (tokenizer setup, Python and framework dispatch) on top of the
+# per-text work. BatchingEmbeddings queues the calls of every thread and a
+# single worker runs them as micro-batches of up to max_batch_size texts.
+# Calls that arrive while the model is busy make up the next batch. Under
+# load (the last batch had more than one call) a batch also waits up to
+# max_wait_ms after its first call for more to arrive; a lone call is run
+# at once, so a quiet server adds no latency. Queries go ahead of chunk
+# embedding, and large embed_documents calls are cut into batch-sized
+# slices, so a question waits for at most one ingest batch. A query is
+# embedded as a one-text document, which is the same vector for the
+# sentence-transformers models used here (see app.main).
+
+
+@dataclass(frozen=True)
+class BatchSettings:
+    max_batch_size: int = 32
+    max_wait_ms: float = 5.0
+
+
+class _Request:
+    __slots__ = ("texts", "kind", "vectors", "pending", "error", "done", "enqueued_at")
+
+    def __init__(self, texts: List[str], kind: str):
+        self.texts = texts
+        self.kind = kind
+        self.vectors: List[Optional[List[float]]] = [None] * len(texts)
+        self.pending = len(texts)
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+        self.enqueued_at = time.perf_counter()
+
+
+_Slice = Tuple[_Request, int, int]
+
+
+class BatchingEmbeddings(Embeddings):
+    def __init__(self, base: Embeddings, settings: BatchSettings = BatchSettings()):
+        self.base = base
+        self.settings = settings
+        self.model_name = getattr(base, "model_name", "")
+        self._cond = threading.Condition()
+        self._queries: Deque[_Slice] = deque()
+        self._documents: Deque[_Slice] = deque()
+        self._waiting = 0
+        self._last_calls = 0
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._submit(list(texts), "document")
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._submit([text], "query")[0]
+
+    def close(self) -> None:
+        # calls already queued are still answered
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _submit(self, texts: List[str], kind: str) -> List[List[float]]:
+        if not texts:
+            return []
+        request = _Request(texts, kind)
+        step = max(1, self.settings.max_batch_size)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The embedding service is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="embedding-batcher", daemon=True)
+                self._thread.start()
+            queue = self._queries if kind == "query" else self._documents
+            for start in range(0, len(texts), step):
+                queue.append((request, start, min(start + step, len(texts))))
+            self._waiting += len(texts)
+            self._cond.notify()
+
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.vectors  # type: ignore[return-value]
+
+    def _loop(self) -> None:
+        max_wait = self.settings.max_wait_ms / 1000
+        while True:
+            with self._cond:
+                while not (self._queries or self._documents):
+                    if self._closed:
+                        return
+                    self._cond.wait()
+                oldest = min(q[0][0].enqueued_at for q in (self._queries, self._documents) if q)
+                deadline = oldest + max_wait
+                while self._last_calls > 1 and self._waiting < self.settings.max_batch_size and not self._closed:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take()
+                self._last_calls = len({id(request) for request, _, _ in batch})
+            self._run(batch)
+
+    def _take(self) -> List[_Slice]:
+        # called with the lock held; queries first, at least one slice
+        batch: List[_Slice] = []
+        size = 0
+        for queue in (self._queries, self._documents):
+            while queue:
+                request, start, stop = queue[0]
+                if batch and size + stop - start > self.settings.max_batch_size:
+                    break
+                queue.popleft()
+                batch.append((request, start, stop))
+                size += stop - start
+        self._waiting -= size
+        return batch
+
+    def _run(self, batch: List[_Slice]) -> None:
+        started = time.perf_counter()
+        texts: List[str] = []
+        for request, start, stop in batch:
+            texts.extend(request.texts[start:stop])
+            EMBED_QUEUE_WAIT.observe(started - request.enqueued_at, kind=request.kind)
+        EMBED_BATCH_SIZE.observe(len(texts))
+
+        try:
+            vectors = self.base.embed_documents(texts)
+        except BaseException as e:
+            for request, _, _ in batch:
+                request.error = e
+                request.done.set()
+            return
+
+        offset = 0
+        for request, start, stop in batch:
+            request.vectors[start:stop] = vectors[offset:offset + stop - start]
+            offset += stop - start
+            request.pending -= stop - start
+            if request.pending == 0:
+                request.done.set()
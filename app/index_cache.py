@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.storage import index_files, index_files_dir
+
+
+Signature = Tuple[int, int]
+
+
+def index_signature(index_path: Path) -> Signature:
+    # one stat per lookup. Every change that readers should see (ingest
+    # finishing, an update or compaction switching generation) rewrites the
+    # manifest with os.replace, so its inode changes even when the
+    # filesystem has coarse timestamps.
+    try:
+        st = (index_path / "manifest.json").stat()
+    except FileNotFoundError:
+        return 0, 0
+    return st.st_ino, st.st_mtime_ns
+
+
+def index_nbytes(index_path: Path) -> int:
+    return sum(p.stat().st_size for p in index_files(index_files_dir(index_path)))
+
+
+def entry_nbytes(value: Any, index_path: Path) -> int:
+    # memory held by a loaded index; values that cannot tell are sized by
+    # their files on disk
+    nbytes = getattr(value, "nbytes", None)
+    return int(nbytes()) if callable(nbytes) else index_nbytes(index_path)
+
+
+@dataclass
+class _Entry:
+    value: Any
+    signature: Signature
+    nbytes: int
+
+
+class IndexCache:
+    def __init__(self, max_entries: int = 16, max_bytes: int = 512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, doc_id: str, index_path: Path, loader: Callable[[Path], Any]) -> Any:
+        signature = index_signature(index_path)
+
+        value = self._lookup(doc_id, signature)
+        if value is not None:
+            return value
+
+        # single flight: the first caller loads, the others wait on the same
+        # per-doc lock and then find the entry already cached
+        with self._lock:
+            flight = self._loading.setdefault(doc_id, threading.Lock())
+
+        with flight:
+            value = self._lookup(doc_id, signature)
+            if value is not None:
+                return value
+
+            with self._lock:
+                self.misses += 1
+
+            value = loader(index_path)
+            self._put(doc_id, _Entry(value, signature, entry_nbytes(value, index_path)))
+
+        with self._lock:
+            if self._loading.get(doc_id) is flight and not flight.locked():
+                del self._loading[doc_id]
+        return value
+
+    def invalidate(self, doc_id: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(doc_id, None)
+            if entry is not None:
+                self._bytes -= entry.nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _lookup(self, doc_id: str, signature: Signature) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            if entry is None:
+                return None
+
+            if entry.signature != signature:
+                del self._entries[doc_id]
+                self._bytes -= entry.nbytes
+                return None
+
+            self._entries.move_to_end(doc_id)
+            self.hits += 1
+            return entry.value
+
+    def _put(self, doc_id: str, entry: _Entry) -> None:
+        with self._lock:
+            old = self._entries.pop(doc_id, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+
+            self._entries[doc_id] = entry
+            self._bytes += entry.nbytes
+
+            # always keep the newest entry, even if it alone exceeds max_bytes
+            while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
@@ -1,18 +1,251 @@
 from __future__ import annotations
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import multiprocessing
 from pathlib import Path
-from typing import List
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
 
 from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from pypdf import PdfReader
 
+from app.metrics import record_stage
 
-def load_and_split_pdf(pdf_path: Path, chunk_size: int = 1000, chunk_overlap: int = 150):
-    loader = PyPDFLoader(str(pdf_path))
-    docs = loader.load()
+T = TypeVar("T")
 
-    splitter = RecursiveCharacterTextSplitter(
+# for PDFs of at least parallel_min_pages pages: pages per extraction task,
+# and between reader cache drops when extracting in-process
+_MAX_RANGE_PAGES = 16
+
+_DONE = object()
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+# readers get an open file rather than a path, which pypdf would read into
+# memory whole
+def count_pages(pdf_path: Path) -> int:
+    with open(pdf_path, "rb") as f:
+        return len(PdfReader(f).pages)
+
+
+def _document_metadata(reader: PdfReader, source: str, total: int) -> Dict[str, Any]:
+    # the document-level keys PyPDFLoader puts on every page (the PDF's info
+    # dictionary, normalized the same way, plus source and total_pages), so
+    # chunk metadata does not depend on which path extracted the pages
+    meta: Dict[str, Any] = {}
+    info = {"producer": "PyPDF", "creator": "PyPDF", "creationdate": "", **dict(reader.metadata or {})}
+    for key, value in info.items():
+        key = key.lstrip("/").lower()
+        value = value if type(value) in (str, int) else str(value)
+        if key in ("creationdate", "moddate"):
+            try:
+                value = datetime.strptime(value.replace("'", ""), "D:%Y%m%d%H%M%S%z").isoformat("T")
+            except ValueError:
+                pass
+        elif isinstance(value, str):
+            value = value.strip()
+        meta[key] = value
+    meta.update(source=source, total_pages=total)
+    return meta
+
+
+def _extract_range(pdf_path: str, start: int, stop: int) -> List[Tuple[int, str, str]]:
+    # (page, page label, text)
+    with open(pdf_path, "rb") as f:
+        reader = PdfReader(f)
+        labels = reader.page_labels[start:stop]
+        return [(i, labels[i - start], reader.pages[i].extract_text().strip()) for i in range(start, stop)]
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # spawn, not fork: the API process runs threads (uvicorn, torch)
+            # that must not be duplicated into the children
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _pool_workers = workers
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _iter_pages_serial(pdf_path: Path) -> Iterator[Document]:
+    yield from PyPDFLoader(str(pdf_path)).lazy_load()
+
+
+def _iter_pages_windowed(pdf_path: Path, total: int) -> Iterator[Document]:
+    # a PdfReader keeps every object it has parsed, content streams included,
+    # so its cache is dropped every few pages to keep memory flat
+    with open(pdf_path, "rb") as f:
+        reader = PdfReader(f)
+        meta = _document_metadata(reader, str(pdf_path), total)
+        labels = reader.page_labels
+        for i in range(total):
+            yield Document(
+                page_content=reader.pages[i].extract_text().strip(),
+                metadata={**meta, "page": i, "page_label": labels[i]},
+            )
+            if (i + 1) % _MAX_RANGE_PAGES == 0:
+                reader.resolved_objects.clear()
+
+
+def _iter_pages_parallel(pdf_path: Path, total: int, workers: int) -> Iterator[Document]:
+    # small ranges, at most two per worker in flight, yielded in page order:
+    # progress stays smooth and only a few ranges of text are held at once
+    step = max(1, min(-(-total // (workers * 4)), _MAX_RANGE_PAGES))
+    ranges = deque((start, min(start + step, total)) for start in range(0, total, step))
+
+    pool = _get_pool(workers)
+    in_flight: deque = deque()
+    source = str(pdf_path)
+    with open(pdf_path, "rb") as f:
+        meta = _document_metadata(PdfReader(f), source, total)
+    try:
+        while ranges or in_flight:
+            while ranges and len(in_flight) < workers * 2:
+                a, b = ranges.popleft()
+                in_flight.append(pool.submit(_extract_range, source, a, b))
+            for i, label, text in in_flight.popleft().result():
+                yield Document(page_content=text, metadata={**meta, "page": i, "page_label": label})
+    finally:
+        for fut in in_flight:
+            fut.cancel()
+
+
+def iter_pdf_pages(
+    pdf_path: Path,
+    on_page: Optional[Callable[[int], None]] = None,
+    workers: int = 1,
+    parallel_min_pages: int = 64,
+) -> Iterator[Document]:
+    # pages one at a time, in order; the pdf_parse stage records the time
+    # spent extracting, not the time the consumer holds each page
+    total = count_pages(pdf_path)
+    if total < parallel_min_pages:
+        pages = _iter_pages_serial(pdf_path)
+    elif workers > 1:
+        pages = _iter_pages_parallel(pdf_path, total, workers)
+    else:
+        pages = _iter_pages_windowed(pdf_path, total)
+
+    n, spent = 0, 0.0
+    while True:
+        t0 = time.perf_counter()
+        page = next(pages, None)
+        spent += time.perf_counter() - t0
+        if page is None:
+            break
+        n += 1
+        if on_page:
+            on_page(n)
+        yield page
+    record_stage("pdf_parse", spent)
+
+
+def load_pdf_pages(
+    pdf_path: Path,
+    on_page: Optional[Callable[[int], None]] = None,
+    workers: int = 1,
+    parallel_min_pages: int = 64,
+) -> List:
+    return list(iter_pdf_pages(pdf_path, on_page, workers, parallel_min_pages))
+
+
+def _splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
+        # lets the context packer merge overlapping chunks by position
+        add_start_index=True,
     )
-    return splitter.split_documents(docs)
+
+
+def iter_chunks(pages: Iterable[Document], chunk_size: int = 1000, chunk_overlap: int = 150) -> Iterator[Document]:
+    # the splitter never crosses a page boundary, so splitting page by page
+    # gives the same chunks as splitting the whole list at once
+    splitter = _splitter(chunk_size, chunk_overlap)
+    spent = 0.0
+    for page in pages:
+        t0 = time.perf_counter()
+        chunks = splitter.split_documents([page])
+        spent += time.perf_counter() - t0
+        yield from chunks
+    record_stage("split", spent)
+
+
+def split_pages(pages: List, chunk_size: int = 1000, chunk_overlap: int = 150):
+    return list(iter_chunks(pages, chunk_size, chunk_overlap))
+
+
+def prefetch(items: Iterable[T], max_items: int) -> Iterator[T]:
+    # Runs the producer (PDF extraction and splitting) in its own thread, at
+    # most max_items ahead of the consumer (embedding), so the two overlap
+    # and memory stays bounded however long the document is.
+    q: queue.Queue = queue.Queue(maxsize=max(1, max_items))
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((_DONE, e))
+            return
+        put((_DONE, None))
+
+    thread = threading.Thread(target=produce, name="ingest-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = q.get()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        # the consumer failed or stopped early: let the producer finish
+        stop.set()
+        thread.join()
+
+
+def load_and_split_pdf(
+    pdf_path: Path,
+    chunk_size: int = 1000,
+    chunk_overlap: int = 150,
+    workers: int = 1,
+    parallel_min_pages: int = 64,
+):
+    pages = load_pdf_pages(pdf_path, workers=workers, parallel_min_pages=parallel_min_pages)
+    return split_pages(pages, chunk_size, chunk_overlap)
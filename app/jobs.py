@@ -0,0 +1,448 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import hashlib
+import os
+from pathlib import Path
+import shutil
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from app.storage import doc_lock, generation_dir, read_manifest, write_manifest
+from app.utils import FileLock, ensure_dir
+
+if TYPE_CHECKING:
+    from langchain_core.embeddings import Embeddings
+
+    from app.ann import AnnSettings
+    from app.corpus import CorpusIndex
+
+# the parsing, embedding and FAISS modules are imported by run_ingest, so
+# the API process can import this module without loading them
+
+
+# held by the worker process that has a document's job queued or running
+CLAIM_FILE = ".ingest.lock"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobClaimed(Exception):
+    # another worker process has a job for the document
+    pass
+
+
+def claim_job(index_path: Path) -> Optional[FileLock]:
+    # None when another process holds the claim; the OS drops it when that
+    # process exits, so a crashed worker's jobs can be resumed by the next
+    ensure_dir(index_path)
+    claim = FileLock(index_path / CLAIM_FILE)
+    return claim if claim.acquire(blocking=False) else None
+
+
+@dataclass(frozen=True)
+class IngestSettings:
+    extract_workers: int = 1
+    parallel_min_pages: int = 64
+    # chunks extracted ahead of embedding; bounds memory per ingest
+    prefetch_chunks: int = 256
+    ann: Optional[AnnSettings] = None  # None uses the AnnSettings defaults
+
+
+@dataclass
+class IngestJob:
+    doc_id: str
+    pdf_path: Path
+    index_path: Path
+    manifest: Dict[str, Any]
+    # "ingest" builds the index; "append" and "replace" update a ready
+    # document from pdf_path, see run_update
+    kind: str = "ingest"
+    sha256: str = ""
+    status: str = "queued"
+    stage: str = "queued"
+    pages_total: int = 0
+    pages_parsed: int = 0
+    chunks_total: int = 0
+    chunks_embedded: int = 0
+    error: str = ""
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    stage_started_at: Optional[float] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    # set by IngestQueue.submit, or by the caller that claimed the job first
+    claim: Optional[FileLock] = field(default=None, repr=False, compare=False)
+
+    def enter_stage(self, stage: str) -> None:
+        now = time.time()
+        if self.stage_started_at is not None and self.stage not in {"queued", "done", "failed"}:
+            self.timings[f"{self.stage}_seconds"] = round(now - self.stage_started_at, 3)
+        self.stage = stage
+        self.stage_started_at = now
+
+    def eta_seconds(self) -> Optional[float]:
+        if self.status != "running" or self.stage_started_at is None:
+            return None
+
+        elapsed = time.time() - self.stage_started_at
+        if self.stage == "parsing" and self.pages_parsed and self.pages_total:
+            rate = self.pages_parsed / max(elapsed, 1e-6)
+            return round((self.pages_total - self.pages_parsed) / rate, 1)
+        if self.stage == "embedding" and self.chunks_embedded and self.chunks_total:
+            rate = self.chunks_embedded / max(elapsed, 1e-6)
+            return round((self.chunks_total - self.chunks_embedded) / rate, 1)
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "doc_id": self.doc_id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "pages_total": self.pages_total,
+            "pages_parsed": self.pages_parsed,
+            "chunks_total": self.chunks_total,
+            "chunks_embedded": self.chunks_embedded,
+            "eta_seconds": self.eta_seconds(),
+            "error": self.error,
+            "timings": dict(self.timings),
+        }
+
+
+def run_ingest(
+    job: IngestJob,
+    embeddings: Embeddings,
+    settings: IngestSettings = IngestSettings(),
+    corpus: Optional[CorpusIndex] = None,
+) -> None:
+    from app.ann import AnnSettings
+    from app.embedding_cache import CachedEmbeddings
+    from app.ingestion import count_pages, iter_chunks, iter_pdf_pages, prefetch
+    from app.vectorstore import build_faiss_index
+
+    t0 = time.time()
+    job.status = "running"
+    job.started_at = t0
+    job.manifest["status"] = "running"
+    write_manifest(job.index_path, job.manifest)
+
+    writer = None
+    try:
+        job.enter_stage("parsing")
+        job.pages_total = count_pages(job.pdf_path)
+
+        def on_page(n: int) -> None:
+            job.pages_parsed = n
+
+        def on_chunks(n: int) -> None:
+            job.chunks_embedded = n
+
+        def chunks():
+            # runs in the prefetch thread, ahead of embedding
+            pages = iter_pdf_pages(
+                job.pdf_path,
+                on_page=on_page,
+                workers=settings.extract_workers,
+                parallel_min_pages=settings.parallel_min_pages,
+            )
+            for chunk in iter_chunks(pages):
+                job.chunks_total += 1
+                yield chunk
+            # every page is split; what is left is embedding the queued chunks
+            job.enter_stage("embedding")
+
+        writer = corpus.writer(job.doc_id) if corpus is not None else None
+        job.manifest["index"] = build_faiss_index(
+            prefetch(chunks(), settings.prefetch_chunks),
+            job.index_path,
+            embeddings,
+            on_progress=on_chunks,
+            on_batch=writer.add if writer is not None else None,
+            ann=settings.ann or AnnSettings(),
+        )
+
+        if writer is not None:
+            job.enter_stage("corpus")
+            writer.commit()
+        job.enter_stage("done")
+        job.status = "ready"
+    except Exception as e:
+        if writer is not None:
+            writer.discard()
+        job.enter_stage("failed")
+        job.status = "failed"
+        job.error = str(e) or e.__class__.__name__
+
+    job.finished_at = time.time()
+    job.manifest.update(
+        {
+            "status": job.status,
+            "chunks": job.chunks_total,
+            "pages": job.pages_total,
+            "ingest_seconds": round(job.finished_at - t0, 3),
+            "queue_seconds": round(t0 - job.created_at, 3),
+            "timings": dict(job.timings),
+        }
+    )
+    if isinstance(embeddings, CachedEmbeddings):
+        job.manifest["embedding_cache"] = embeddings.stats()
+    if job.error:
+        job.manifest["error"] = job.error
+    write_manifest(job.index_path, job.manifest)
+
+
+def _page_key(doc) -> int:
+    return int(doc.metadata.get("page", 0) or 0)
+
+
+def _page_digest(texts: Iterable[str]) -> str:
+    h = hashlib.sha256()
+    for text in texts:
+        h.update(text.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _live_pages(store, deleted: Set[int]) -> Dict[int, List[int]]:
+    # live rows of each page, in row order; rows of a page keep their
+    # chunk order across updates because new rows are always appended
+    pages: Dict[int, List[int]] = {}
+    for row in range(len(store)):
+        if row not in deleted:
+            pages.setdefault(_page_key(store.get(row)), []).append(row)
+    return pages
+
+
+def _by_page(chunks: Iterable) -> Iterator[List]:
+    page: List = []
+    for chunk in chunks:
+        if page and _page_key(chunk) != _page_key(page[0]):
+            yield page
+            page = []
+        page.append(chunk)
+    if page:
+        yield page
+
+
+def run_update(
+    job: IngestJob,
+    embeddings: Embeddings,
+    settings: IngestSettings = IngestSettings(),
+    corpus: Optional[CorpusIndex] = None,
+) -> None:
+    # Adds the pages of job.pdf_path to a ready document as a new index
+    # generation. "append" adds them after the existing pages; "replace"
+    # treats the file as a new revision of the document and embeds only the
+    # pages whose chunks changed, tombstoning the old rows of changed and
+    # removed pages. Readers keep the previous generation until the
+    # manifest points at the new one; the document stays "ready" throughout.
+    from app.compact_store import CompactDocstore, is_compact, migrate, read_rowids, read_tombstones
+    from app.embedding_cache import CachedEmbeddings
+    from app.ingestion import count_pages, iter_chunks, iter_pdf_pages, prefetch
+    from app.vectorstore import update_faiss_index
+
+    t0 = time.time()
+    job.status = "running"
+    job.started_at = t0
+    new_dir: Optional[Path] = None
+    writer = None
+    stats: Dict[str, Any] = {"mode": job.kind}
+
+    with doc_lock(job.index_path):
+        manifest = read_manifest(job.index_path)
+        try:
+            generation = int(manifest.get("generation", 0) or 0)
+            base = generation_dir(job.index_path, generation)
+            if not is_compact(base):
+                migrate(base, embeddings)
+
+            job.enter_stage("parsing")
+            store = CompactDocstore(base)
+            deleted = set(read_tombstones(base).tolist())
+            old_pages = _live_pages(store, deleted)
+            rowids = read_rowids(base, len(store))
+            first_serial = int(manifest.get("next_chunk_id") or (int(rowids.max()) + 1 if len(rowids) else 0))
+            page_offset = int(manifest.get("pages", 0) or 0) if job.kind == "append" else 0
+            source = str(job.pdf_path) if job.kind == "append" else manifest["stored_path"]
+            job.pages_total = count_pages(job.pdf_path)
+
+            remove_rows: Set[int] = set()
+            changed: Set[int] = set()
+
+            def on_page(n: int) -> None:
+                job.pages_parsed = n
+
+            def on_chunks(n: int) -> None:
+                job.chunks_embedded = n
+
+            def chunks():
+                pages = iter_pdf_pages(
+                    job.pdf_path,
+                    on_page=on_page,
+                    workers=settings.extract_workers,
+                    parallel_min_pages=settings.parallel_min_pages,
+                )
+                seen: Set[int] = set()
+                for page in _by_page(iter_chunks(pages)):
+                    number = _page_key(page[0]) + page_offset
+                    seen.add(number)
+                    old_rows = old_pages.get(number, [])
+                    if job.kind == "replace" and old_rows:
+                        new_digest = _page_digest(c.page_content for c in page)
+                        if new_digest == _page_digest(store.get(r).page_content for r in old_rows):
+                            continue
+                        remove_rows.update(old_rows)
+                    changed.add(number)
+                    for chunk in page:
+                        chunk.metadata.update(source=source, page=number)
+                        job.chunks_total += 1
+                        yield chunk
+                if job.kind == "replace":
+                    # pages the new revision no longer has
+                    for number, rows in old_pages.items():
+                        if number not in seen:
+                            changed.add(number)
+                            remove_rows.update(rows)
+                job.enter_stage("embedding")
+
+            writer = corpus.writer(job.doc_id, first_serial) if corpus is not None else None
+            new_dir = generation_dir(job.index_path, generation + 1)
+            # only safe because this job holds the document's claim: every
+            # other writer of a next generation (updates and compaction in
+            # any worker process) takes it first, see claim_job
+            shutil.rmtree(new_dir, ignore_errors=True)
+            index_params = update_faiss_index(
+                base,
+                new_dir,
+                prefetch(chunks(), settings.prefetch_chunks),
+                remove_rows,
+                manifest.get("index") or {},
+                first_serial,
+                embeddings,
+                on_progress=on_chunks,
+                on_batch=writer.add if writer is not None else None,
+            )
+            stats.update(pages_changed=len(changed), chunks_added=job.chunks_total, chunks_removed=len(remove_rows))
+
+            if not changed:
+                # an identical revision: nothing to commit
+                shutil.rmtree(new_dir, ignore_errors=True)
+                job.pdf_path.unlink(missing_ok=True)
+                if writer is not None:
+                    writer.discard()
+                stats["status"] = "unchanged"
+            else:
+                if writer is not None:
+                    job.enter_stage("corpus")
+                    writer.removed = [int(rowids[r]) for r in remove_rows]
+                    writer.commit()
+
+                if job.kind == "replace":
+                    os.replace(job.pdf_path, manifest["stored_path"])
+                    # a revision covers the whole document, appended parts
+                    # included; their files are left to compaction
+                    manifest.pop("parts", None)
+                    manifest.update(sha256=job.sha256 or None, pages=job.pages_total)
+                else:
+                    # the document is no longer one file with one hash
+                    manifest["parts"] = manifest.get("parts", []) + [str(job.pdf_path)]
+                    manifest.update(sha256=None, pages=page_offset + job.pages_total)
+                manifest.update(
+                    {
+                        "generation": generation + 1,
+                        "generation_at": time.time(),
+                        "index": index_params,
+                        "chunks": int(index_params["ntotal"]) - len(deleted | remove_rows),
+                        "deleted_chunks": len(deleted | remove_rows),
+                        "next_chunk_id": first_serial + job.chunks_total,
+                    }
+                )
+                stats["status"] = "ready"
+            job.enter_stage("done")
+            job.status = "ready"
+        except Exception as e:
+            if new_dir is not None:
+                shutil.rmtree(new_dir, ignore_errors=True)
+            if writer is not None:
+                writer.discard()
+            job.pdf_path.unlink(missing_ok=True)
+            job.enter_stage("failed")
+            job.status = "failed"
+            job.error = str(e) or e.__class__.__name__
+            stats.update(status="failed", error=job.error)
+
+        job.finished_at = time.time()
+        stats["seconds"] = round(job.finished_at - t0, 3)
+        stats["timings"] = dict(job.timings)
+        if isinstance(embeddings, CachedEmbeddings):
+            stats["embedding_cache"] = embeddings.stats()
+        manifest["last_update"] = stats
+        write_manifest(job.index_path, manifest)
+
+
+class IngestQueue:
+    def __init__(self, run: Callable[[IngestJob], None], workers: int = 1, max_queue: int = 8, keep_finished: int = 1000):
+        self._run = run
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ingest")
+        self._slots = threading.BoundedSemaphore(max(1, workers) + max(0, max_queue))
+        self._jobs: Dict[str, IngestJob] = {}
+        self._lock = threading.Lock()
+        self.keep_finished = keep_finished
+
+    def submit(self, job: IngestJob) -> None:
+        if job.claim is None:
+            job.claim = claim_job(job.index_path)
+            if job.claim is None:
+                raise JobClaimed(f"Another worker has a job for {job.doc_id}")
+        if not self._slots.acquire(blocking=False):
+            job.claim.release()
+            raise QueueFull("Ingestion queue is full")
+
+        with self._lock:
+            self._jobs[job.doc_id] = job
+            self._prune()
+
+        self._executor.submit(self._work, job)
+
+    def get(self, doc_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(doc_id)
+
+    def active(self, doc_id: str) -> bool:
+        job = self.get(doc_id)
+        return job is not None and job.status in {"queued", "running"}
+
+    def discard(self, doc_id: str) -> None:
+        # forgets a finished job, e.g. of a deleted document
+        with self._lock:
+            job = self._jobs.get(doc_id)
+            if job is not None and job.finished_at is not None:
+                del self._jobs[doc_id]
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j.status in {"queued", "running"})
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _work(self, job: IngestJob) -> None:
+        try:
+            self._run(job)
+        finally:
+            if job.claim is not None:
+                job.claim.release()
+            self._slots.release()
+
+    def _prune(self) -> None:
+        finished = [j for j in self._jobs.values() if j.finished_at is not None]
+        if len(finished) <= self.keep_finished:
+            return
+        finished.sort(key=lambda j: j.finished_at)
+        for j in finished[: len(finished) - self.keep_finished]:
+            del self._jobs[j.doc_id]
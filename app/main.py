@@ -1,17 +1,48 @@
 from __future__ import annotations
 from app.postprocess import clean_repetition
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Set
+import asyncio
+import json
+import os
+import shutil
+import sys
+import threading
 import time
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Match
 
 from app.config import load_config
 from app.logging_conf import setup_logging
-from app.utils import new_doc_id, safe_filename, ensure_dir
-from app.ingestion import load_and_split_pdf
-from app.vectorstore import build_faiss_index, load_faiss_index
-from app.rag_chain import build_rag_chain, format_context, docs_to_sources, RAGSettings
-from app.schemas import UploadResponse, AskRequest, AskResponse
-from app.storage import write_manifest, read_manifest
+from app.utils import new_doc_id, safe_filename, ensure_dir, estimate_tokens
+from app.uploads import receive_pdf_upload
+from app.schemas import UploadResponse, AskRequest, AskResponse, JobStatus, AskBatchRequest, AskBatchResponse, BatchAnswer
+from app.storage import write_manifest, read_manifest, get_catalog, doc_lock, ContentHashIndex
+from app.catalog import import_manifests
+from app.compaction import TRASH_PREFIX, CompactionSettings, Compactor, remove_path, run_compaction
+from app.index_cache import IndexCache, index_signature
+from app.query_cache import QueryCache, normalize_question
+from app.jobs import IngestJob, IngestQueue, IngestSettings, JobClaimed, QueueFull, claim_job, run_ingest, run_update
+from app.metrics import (
+    CACHE_REQUESTS,
+    CHUNKS_PER_DOC,
+    IN_FLIGHT,
+    PROMPT_TOKENS,
+    REGISTRY,
+    REQUEST_LATENCY,
+    REQUESTS,
+    format_timings,
+    monitor_event_loop,
+    record_stage,
+    resident_memory_bytes,
+    stage_timer,
+    start_request_timings,
+)
 
 cfg = load_config()
 logger = setup_logging()
@@ -19,7 +50,54 @@ logger = setup_logging()
 ensure_dir(cfg.upload_dir)
 ensure_dir(cfg.index_dir)
 
-app = FastAPI(title="PDF Insight Assistant Pro")
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # startup and shutdown of the background work; the steps are defined
+    # further down, next to the preload hook
+    start_preload()
+    import_catalog()
+    remove_stale_uploads()
+    resume_ingest_jobs()
+    monitor = asyncio.create_task(monitor_event_loop())
+    if cfg.compaction_interval_seconds > 0:
+        compactor.start()
+    try:
+        yield
+    finally:
+        monitor.cancel()
+        await run_in_threadpool(stop_background_work)
+
+app = FastAPI(title="PDF Insight Assistant Pro", lifespan=lifespan)
+
+def _route_template(request: Request) -> str:
+    # metrics are labelled by route template so /jobs/<id> is one series;
+    # the middleware runs before routing, so match the routes here
+    for route in app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "unmatched")
+    return "unmatched"
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    # streamed responses are timed up to their first byte; the stages after
+    # that are still recorded in the stage histogram
+    timings = start_request_timings() if request.headers.get("x-debug-timings") else None
+    endpoint = _route_template(request)
+    IN_FLIGHT.inc(endpoint=endpoint)
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        IN_FLIGHT.dec(endpoint=endpoint)
+        REQUESTS.inc(method=request.method, endpoint=endpoint, status=str(status))
+        REQUEST_LATENCY.observe(time.perf_counter() - t0, method=request.method, endpoint=endpoint)
+    if timings is not None:
+        timings["total"] = time.perf_counter() - t0
+        response.headers["X-Debug-Timings"] = format_timings(timings)
+    return response
 
 app.add_middleware(
     CORSMiddleware,
@@ -29,15 +107,260 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-rag = build_rag_chain(
-    RAGSettings(
+index_cache = IndexCache(
+    max_entries=cfg.index_cache_max_entries,
+    max_bytes=cfg.index_cache_max_mb * 1024 * 1024,
+)
+
+query_cache = QueryCache(
+    max_entries=cfg.query_cache_max_entries,
+    ttl_seconds=cfg.query_cache_ttl_seconds,
+    answers_enabled=cfg.answer_cache_enabled,
+)
+
+catalog = get_catalog(cfg.index_dir)
+content_hashes = ContentHashIndex(catalog)
+
+CORPUS_SCOPE = "corpus"
+PROMPT_VERSION = "v2"
+
+# LangChain, FAISS, the embedding model and the Groq client are imported and
+# built on first use, or by the preload hook when PRELOAD=eager, so importing
+# this module and answering /health never wait for them.
+
+def _lazy(build):
+    lock = threading.Lock()
+    box: list = []
+
+    def get():
+        if not box:
+            with lock:
+                if not box:
+                    box.append(build())
+        return box[0]
+
+    # the value if it was built already, without building it
+    get.peek = lambda: box[0] if box else None
+    return get
+
+def _embeddings():
+    from app import vectorstore
+
+    embeddings = vectorstore.embeddings_from_config(cfg, warmup=cfg.embedding_warmup)
+    # whichever of the preload hook or the first request loaded the model
+    if readiness["model_seconds"] is None:
+        readiness["model_seconds"] = vectorstore.load_seconds
+    return embeddings
+
+@_lazy
+def get_embedding_cache():
+    if not cfg.embedding_cache_enabled:
+        return None
+    from app.embedding_cache import EmbeddingCache
+
+    return EmbeddingCache(cfg.embedding_cache_dir, cfg.embedding_cache_key, max_rows=cfg.embedding_cache_max_rows)
+
+@_lazy
+def get_corpus():
+    if not cfg.corpus_enabled:
+        return None
+    from app.corpus import CorpusIndex
+
+    return CorpusIndex(cfg.corpus_dir, _embeddings, n_shards=cfg.corpus_shards)
+
+@_lazy
+def get_ingest_settings():
+    from app.ann import settings_from_config
+
+    return IngestSettings(
+        extract_workers=cfg.pdf_extract_workers,
+        parallel_min_pages=cfg.pdf_parallel_min_pages,
+        prefetch_chunks=cfg.ingest_prefetch_chunks,
+        ann=settings_from_config(cfg),
+    )
+
+@_lazy
+def get_history_store():
+    from app.memory import HistoryStore, set_history_store
+
+    store = HistoryStore(
+        cfg.history_db,
+        max_sessions=cfg.history_max_sessions,
+        ttl_seconds=cfg.history_ttl_seconds,
+        max_tokens=cfg.history_max_tokens,
+    )
+    set_history_store(store)
+    return store
+
+def _rag_settings():
+    from app.rag_chain import RAGSettings, RouterSettings
+
+    return RAGSettings(
         model=cfg.default_model,
         fallback_model=cfg.fallback_model,
-        prompt_version="v2",
+        prompt_version=PROMPT_VERSION,
         temperature=0.0,
+        base_url=cfg.groq_base_url,
+        router=RouterSettings(
+            hedge=cfg.llm_hedge_enabled,
+            hedge_min_ms=cfg.llm_hedge_min_ms,
+            hedge_default_ms=cfg.llm_hedge_default_ms,
+            breaker_error_percent=cfg.llm_breaker_error_percent,
+            breaker_cooldown_seconds=cfg.llm_breaker_cooldown_seconds,
+        ),
+    )
+
+@_lazy
+def get_llm():
+    from app.rag_chain import build_llm
+
+    return build_llm(_rag_settings())
+
+@_lazy
+def get_answer_chain():
+    from app.rag_chain import build_answer_chain
+
+    return build_answer_chain(_rag_settings(), llm=get_llm())
+
+@_lazy
+def get_rag():
+    from app.rag_chain import with_message_history
+
+    return with_message_history(get_answer_chain())
+
+def _ingest_embeddings():
+    embeddings = _embeddings()
+    embedding_cache = get_embedding_cache()
+    if embedding_cache is None:
+        return embeddings
+    from app.embedding_cache import CachedEmbeddings
+
+    # a fresh wrapper per job so the manifest gets that job's hit rate
+    return CachedEmbeddings(embeddings, embedding_cache)
+
+def _run_ingest(job: IngestJob) -> None:
+    # the same queue runs first ingests and page updates of ready documents
+    run = run_ingest if job.kind == "ingest" else run_update
+    run(job, _ingest_embeddings(), get_ingest_settings(), corpus=get_corpus())
+    index_cache.invalidate(job.doc_id)
+    query_cache.invalidate_doc(job.doc_id)
+    if job.status == "ready" and job.kind == "ingest":
+        CHUNKS_PER_DOC.observe(job.chunks_total)
+    logger.info(
+        f"{'Upload indexed' if job.kind == 'ingest' else 'Document updated'} | doc_id={job.doc_id} "
+        f"kind={job.kind} status={job.status} chunks={job.chunks_total} timings={job.timings}"
     )
+
+ingest_queue = IngestQueue(
+    _run_ingest,
+    workers=cfg.ingest_workers,
+    max_queue=cfg.ingest_queue_depth,
 )
 
+def _compaction_pass() -> dict:
+    settings = CompactionSettings(
+        min_deleted_percent=cfg.compaction_min_deleted_percent,
+        grace_seconds=cfg.compaction_grace_seconds,
+        ann=get_ingest_settings().ann,
+    )
+    return run_compaction(
+        cfg.index_dir,
+        cfg.upload_dir,
+        catalog,
+        _embeddings,
+        settings,
+        busy=ingest_queue.active,
+        on_change=index_cache.invalidate,
+        corpus=get_corpus(),
+    )
+
+compactor = Compactor(cfg.compaction_interval_seconds, _compaction_pass)
+
+readiness = {"status": "starting", "preload": cfg.preload, "seconds": None, "model_seconds": None, "error": ""}
+
+def _preload() -> None:
+    t0 = time.time()
+    try:
+        _embeddings()
+        get_rag()
+        get_history_store()
+        get_embedding_cache()
+        get_corpus()
+        get_ingest_settings()
+        # modules the first upload and the first question would import
+        import app.ingestion
+        import app.retrieval
+    except Exception as e:
+        logger.exception("Preload failed")
+        readiness.update(status="failed", error=str(e) or e.__class__.__name__)
+        return
+
+    readiness.update(status="ready", seconds=round(time.time() - t0, 3))
+    logger.info(f"Preload finished | seconds={readiness['seconds']}")
+
+def start_preload() -> None:
+    # runs in the background so /health answers while the models load;
+    # /ready reports when they are done
+    if cfg.preload == "lazy":
+        readiness["status"] = "ready"
+        return
+    readiness["status"] = "loading"
+    threading.Thread(target=_preload, name="preload", daemon=True).start()
+
+def import_catalog() -> None:
+    # one-time import for data directories created before the catalog
+    if catalog.count() == 0:
+        n = import_manifests(catalog, cfg.index_dir)
+        if n:
+            logger.info(f"Imported manifests into the catalog | count={n}")
+
+def remove_stale_uploads() -> None:
+    # temp files of uploads cut off by a crash; other workers may be
+    # receiving uploads right now, so only old ones are removed
+    for p in cfg.upload_dir.glob(".upload.*.part"):
+        if time.time() - p.stat().st_mtime > 3600:
+            p.unlink(missing_ok=True)
+
+def resume_ingest_jobs() -> None:
+    # jobs that were queued or running when the previous process stopped.
+    # Every worker runs this; a job is resumed only by the one that claims
+    # it, and not at all while the worker that queued it is still alive.
+    for p in cfg.index_dir.glob("*"):
+        m = read_manifest(p) if p.is_dir() else {}
+        if m.get("status") not in {"queued", "running"}:
+            continue
+        claim = claim_job(p)
+        if claim is None:
+            continue
+        # the job may have finished before the claim was taken
+        m = read_manifest(p)
+        if m.get("status") not in {"queued", "running"}:
+            claim.release()
+            continue
+        m["status"] = "queued"
+        job = IngestJob(doc_id=m["doc_id"], pdf_path=Path(m["stored_path"]), index_path=p, manifest=m, claim=claim)
+        try:
+            ingest_queue.submit(job)
+        except QueueFull:
+            logger.warning(f"Ingest queue full, not resuming | doc_id={job.doc_id}")
+            break
+        logger.info(f"Resumed ingest job | doc_id={job.doc_id}")
+
+def stop_background_work() -> None:
+    # the compactor first: a pass in progress may be rewriting an index
+    # the ingest queue is about to update, so it is waited for (up to a
+    # limit) before queued jobs are cancelled; the embedding cache is
+    # flushed once no more jobs are started
+    compactor.stop(timeout=30)
+    ingest_queue.shutdown()
+    cache = get_embedding_cache.peek()
+    if cache is not None:
+        cache.flush()
+    if "app.ingestion" in sys.modules:
+        from app.ingestion import shutdown_pool
+
+        shutdown_pool()
+
 @app.get("/")
 def root():
     return {"message": "PDF Insight Assistant Pro running. Open /docs for Swagger UI."}
@@ -46,66 +369,346 @@ def root():
 def health():
     return {"status": "ok", "env": cfg.app_env}
 
+@app.get("/ready")
+def ready():
+    return JSONResponse(readiness, status_code=200 if readiness["status"] == "ready" else 503)
+
+@app.get("/cache/stats")
+def cache_stats():
+    # stats of what has not been built yet are None rather than built here
+    embedding_cache = get_embedding_cache.peek()
+    history_store = get_history_store.peek()
+    return {
+        "index_cache": index_cache.stats(),
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "query_cache": query_cache.stats(),
+        "history": history_store.stats() if history_store else None,
+        "dedup_hits": content_hashes.hits,
+    }
+
+def _cache_metrics() -> list:
+    # cache stats are kept by the caches themselves; export them at scrape time
+    rows = [("index", index_cache.stats())]
+    rows += [(f"query_{name}", stats) for name, stats in query_cache.stats().items() if stats]
+
+    lines = []
+    for metric, key, help in (
+        ("pdf_insight_cache_hits_total", "hits", "Cache hits"),
+        ("pdf_insight_cache_misses_total", "misses", "Cache misses"),
+        ("pdf_insight_cache_evictions_total", "evictions", "Cache evictions"),
+    ):
+        lines += [f"# HELP {metric} {help}", f"# TYPE {metric} counter"]
+        lines += [f'{metric}{{cache="{name}"}} {stats[key]}' for name, stats in rows if key in stats]
+    lines += [
+        "# HELP pdf_insight_dedup_hits_total Uploads answered by an existing document",
+        "# TYPE pdf_insight_dedup_hits_total counter",
+        f"pdf_insight_dedup_hits_total {content_hashes.hits}",
+        "# HELP pdf_insight_ingest_queue_pending Ingest jobs waiting or running",
+        "# TYPE pdf_insight_ingest_queue_pending gauge",
+        f"pdf_insight_ingest_queue_pending {ingest_queue.pending()}",
+    ]
+    embedding_cache = get_embedding_cache.peek()
+    if embedding_cache is not None:
+        lines += [
+            "# HELP pdf_insight_embedding_cache_rows Chunk vectors held in the embedding cache",
+            "# TYPE pdf_insight_embedding_cache_rows gauge",
+            f"pdf_insight_embedding_cache_rows {embedding_cache.stats()['rows']}",
+        ]
+    return lines
+
+REGISTRY.add_collector(_cache_metrics)
+
+def _process_metrics() -> list:
+    rss = resident_memory_bytes()
+    if rss is None:
+        return []
+    return [
+        "# HELP process_resident_memory_bytes Resident memory size in bytes",
+        "# TYPE process_resident_memory_bytes gauge",
+        f"process_resident_memory_bytes {rss}",
+    ]
+
+REGISTRY.add_collector(_process_metrics)
+
+def _llm_metrics() -> list:
+    llm = get_llm.peek()
+    if llm is None:
+        return []
+    stats = llm.stats()
+    lines = [
+        "# HELP pdf_insight_llm_circuit_open Whether the circuit breaker of a model is open (1) or half open (0.5)",
+        "# TYPE pdf_insight_llm_circuit_open gauge",
+    ]
+    state_value = {"closed": 0, "half_open": 0.5, "open": 1}
+    lines += [f'pdf_insight_llm_circuit_open{{model="{name}"}} {state_value[s["state"]]}' for name, s in stats.items()]
+    lines += [
+        "# HELP pdf_insight_llm_hedge_deadline_seconds First-token wait before a call is hedged",
+        "# TYPE pdf_insight_llm_hedge_deadline_seconds gauge",
+    ]
+    lines += [f'pdf_insight_llm_hedge_deadline_seconds{{model="{name}"}} {s["hedge_deadline_seconds"]}' for name, s in stats.items()]
+    return lines
+
+REGISTRY.add_collector(_llm_metrics)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/documents")
-def list_documents():
-    docs = []
-    for p in cfg.index_dir.glob("*"):
-        if p.is_dir():
-            m = read_manifest(p)
-            if m:
-                docs.append(m)
-
-    docs.sort(key=lambda x: x.get("created_at", ""), reverse=True)
-    return {"docs": docs}
-
-@app.post("/upload", response_model=UploadResponse)
-async def upload_pdf(file: UploadFile = File(...)):
-    if not file.filename:
-        raise HTTPException(status_code=400, detail="Missing filename")
-
-    if not file.filename.lower().endswith(".pdf"):
-        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
-
-    max_bytes = cfg.max_upload_mb * 1024 * 1024
-    raw = await file.read()
-    if len(raw) > max_bytes:
-        raise HTTPException(
-            status_code=413,
-            detail=f"File too large. Max {cfg.max_upload_mb} MB"
-        )
+def list_documents(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    filename: Optional[str] = None,
+    status: Optional[str] = None,
+):
+    if limit < 1 or limit > 500:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 500")
+
+    try:
+        docs, next_cursor = catalog.list(limit=limit, cursor=cursor, filename=filename, status=status)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"docs": docs, "next_cursor": next_cursor}
 
+# the upload endpoints read the multipart body themselves, so describe it
+PDF_UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"],
+                }
+            }
+        },
+    }
+}
+
+@app.post("/upload", response_model=UploadResponse, openapi_extra=PDF_UPLOAD_BODY)
+async def upload_pdf(request: Request):
+    # the body is streamed to disk rather than parsed into an UploadFile,
+    # so a large upload never sits in memory and a bad one is cut off early
+    upload = await receive_pdf_upload(request, cfg.upload_dir, cfg.max_upload_mb)
+    sha256 = upload.sha256
     doc_id = new_doc_id()
-    clean_name = safe_filename(file.filename)
-    pdf_path = cfg.upload_dir / f"{doc_id}_{clean_name}"
+    existing = content_hashes.find(sha256)
+    if existing is not None:
+        existing_id = existing["doc_id"]
+        if read_manifest(cfg.index_dir / existing_id):
+            upload.tmp_path.unlink(missing_ok=True)
+            logger.info(f"Upload deduplicated | doc_id={existing_id} sha256={sha256[:12]}")
+            return UploadResponse(
+                status="duplicate" if existing.get("status", "ready") == "ready" else existing["status"],
+                doc_id=existing_id,
+                filename=existing.get("filename", ""),
+                chunks=existing.get("chunks", 0),
+            )
+        # the earlier copy is gone from disk, index this one instead
+        catalog.delete(existing_id)
 
-    with open(pdf_path, "wb") as f:
-        f.write(raw)
+    clean_name = safe_filename(upload.filename)
+    pdf_path = cfg.upload_dir / f"{doc_id}_{clean_name}"
+    os.replace(upload.tmp_path, pdf_path)
 
-    t0 = time.time()
-    docs = load_and_split_pdf(pdf_path)
     index_path = cfg.index_dir / doc_id
-    build_faiss_index(docs, index_path)
-
     manifest = {
         "doc_id": doc_id,
         "filename": clean_name,
         "stored_path": str(pdf_path),
-        "chunks": len(docs),
+        "chunks": 0,
         "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
         "index_path": str(index_path),
-        "ingest_seconds": round(time.time() - t0, 3),
+        "status": "queued",
+        "sha256": sha256,
     }
     write_manifest(index_path, manifest)
 
-    logger.info(f"Upload indexed | doc_id={doc_id} chunks={len(docs)}")
-    return UploadResponse(status="ok", doc_id=doc_id, filename=clean_name, chunks=len(docs))
+    try:
+        ingest_queue.submit(
+            IngestJob(doc_id=doc_id, pdf_path=pdf_path, index_path=index_path, manifest=manifest)
+        )
+    except QueueFull:
+        catalog.delete(doc_id)
+        shutil.rmtree(index_path, ignore_errors=True)
+        pdf_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=503, detail="Indexing queue is full, try again later")
 
-@app.post("/ask", response_model=AskResponse)
-async def ask(req: AskRequest):
-    index_path = cfg.index_dir / req.doc_id
-    if not index_path.exists():
+    logger.info(f"Upload queued | doc_id={doc_id} pending={ingest_queue.pending()}")
+    return UploadResponse(status="queued", doc_id=doc_id, filename=clean_name, chunks=0)
+
+@app.get("/jobs/{doc_id}", response_model=JobStatus)
+def job_status(doc_id: str):
+    job = ingest_queue.get(doc_id)
+    if job is not None:
+        return JobStatus(**job.to_dict())
+
+    m = read_manifest(cfg.index_dir / doc_id)
+    if not m:
+        raise HTTPException(status_code=404, detail="Unknown doc_id")
+
+    return JobStatus(
+        doc_id=doc_id,
+        status=m.get("status", "ready"),
+        stage="done" if m.get("status", "ready") == "ready" else m.get("status", ""),
+        pages_total=m.get("pages", 0),
+        pages_parsed=m.get("pages", 0),
+        chunks_total=m.get("chunks", 0),
+        chunks_embedded=m.get("chunks", 0),
+        error=m.get("error", ""),
+        timings=m.get("timings", {}),
+    )
+
+def _known_manifest(doc_id: str) -> dict:
+    m = read_manifest(cfg.index_dir / doc_id) if doc_id and not doc_id.startswith(".") else {}
+    if not m:
+        raise HTTPException(status_code=404, detail="Unknown doc_id")
+    return m
+
+@app.post("/documents/{doc_id}/pages", response_model=UploadResponse, openapi_extra=PDF_UPLOAD_BODY)
+async def update_pages(doc_id: str, request: Request, mode: str = "append"):
+    # append: the PDF's pages are added after the document's pages.
+    # replace: the PDF is a new revision of the document; only pages whose
+    # text changed are embedded again. Either way the document keeps
+    # answering from its current index until the update is committed.
+    if mode not in {"append", "replace"}:
+        raise HTTPException(status_code=400, detail="mode must be append or replace")
+    m = _known_manifest(doc_id)
+    if m.get("status", "ready") != "ready" or ingest_queue.active(doc_id):
+        raise HTTPException(status_code=409, detail="Document is being indexed or updated, try again later")
+
+    upload = await receive_pdf_upload(request, cfg.upload_dir, cfg.max_upload_mb)
+    filename = m.get("filename", "")
+    if mode == "replace" and upload.sha256 == m.get("sha256"):
+        upload.tmp_path.unlink(missing_ok=True)
+        return UploadResponse(status="unchanged", doc_id=doc_id, filename=filename, chunks=m.get("chunks", 0))
+
+    clean_name = safe_filename(upload.filename)
+    if mode == "replace":
+        pdf_path = cfg.upload_dir / f"{doc_id}_revision_{clean_name}"
+    else:
+        pdf_path = cfg.upload_dir / f"{doc_id}_part{len(m.get('parts', [])) + 2}_{clean_name}"
+    os.replace(upload.tmp_path, pdf_path)
+
+    index_path = cfg.index_dir / doc_id
+    job = IngestJob(doc_id=doc_id, pdf_path=pdf_path, index_path=index_path, manifest=m, kind=mode, sha256=upload.sha256)
+    try:
+        ingest_queue.submit(job)
+    except QueueFull:
+        pdf_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=503, detail="Indexing queue is full, try again later")
+    except JobClaimed:
+        pdf_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=409, detail="Document is being indexed or updated, try again later")
+
+    logger.info(f"Update queued | doc_id={doc_id} mode={mode} pending={ingest_queue.pending()}")
+    return UploadResponse(status="queued", doc_id=doc_id, filename=filename, chunks=m.get("chunks", 0))
+
+@app.delete("/documents/{doc_id}")
+def delete_document(doc_id: str):
+    m = _known_manifest(doc_id)
+    if m.get("status") in {"queued", "running"} or ingest_queue.active(doc_id):
+        raise HTTPException(status_code=409, detail="Document is being indexed or updated, try again later")
+
+    index_path = cfg.index_dir / doc_id
+    # an update may be running in another worker
+    claim = claim_job(index_path)
+    if claim is None:
+        raise HTTPException(status_code=409, detail="Document is being indexed or updated, try again later")
+    try:
+        with doc_lock(index_path):
+            catalog.delete(doc_id)
+            corpus = get_corpus()
+            if corpus is not None:
+                corpus.remove_document(doc_id)
+            index_cache.invalidate(doc_id)
+            query_cache.invalidate_doc(doc_id)
+            get_history_store().delete_document(doc_id)
+            # out of the way in one rename; a crash while removing it leaves a
+            # directory the compactor knows to remove
+            trash = cfg.index_dir / f"{TRASH_PREFIX}{doc_id}-{time.time_ns()}"
+            os.replace(index_path, trash)
+    finally:
+        claim.release()
+
+    bytes_freed = remove_path(trash)
+    for path in [m.get("stored_path", "")] + m.get("parts", []):
+        if path:
+            bytes_freed += remove_path(Path(path))
+    ingest_queue.discard(doc_id)
+    logger.info(f"Document deleted | doc_id={doc_id} bytes_freed={bytes_freed}")
+    return {"status": "deleted", "doc_id": doc_id, "bytes_freed": bytes_freed}
+
+def _load_index(index_path):
+    from app.retrieval import load_doc_index
+
+    return load_doc_index(index_path, _embeddings())
+
+@dataclass
+class _AskPlan:
+    doc_id: str
+    session_id: str
+    question: str
+    docs: list
+    inputs: dict
+    config: dict
+    cache: str = "miss"
+    answer_key: Optional[tuple] = None
+    answer: Optional[str] = None
+    sources: Optional[list] = None
+    prompt_tokens: int = 0
+    language: str = "bn"
+    top_k: int = 5
+    norm_q: str = ""
+    scope: Optional["_Scope"] = None
+
+def _ready_index_path(doc_id: str) -> Path:
+    index_path = cfg.index_dir / doc_id
+    if not doc_id or not index_path.exists():
         raise HTTPException(status_code=400, detail="Unknown doc_id. Upload a PDF first.")
 
+    status = read_manifest(index_path).get("status", "ready")
+    if status == "failed":
+        raise HTTPException(status_code=400, detail="Indexing failed for this document. Upload it again.")
+    if status != "ready":
+        raise HTTPException(status_code=409, detail=f"Document is still being indexed ({status})")
+    return index_path
+
+def _corpus_scope(req: AskRequest) -> Optional[Set[str]]:
+    if not cfg.corpus_enabled:
+        raise HTTPException(status_code=400, detail="Corpus search is disabled")
+
+    if req.doc_ids == "all":
+        return None
+    if isinstance(req.doc_ids, str) or not req.doc_ids:
+        raise HTTPException(status_code=400, detail='doc_ids must be a non-empty list or "all"')
+
+    for doc_id in req.doc_ids:
+        _ready_index_path(doc_id)
+    return set(req.doc_ids)
+
+@dataclass
+class _Scope:
+    name: str
+    signature: tuple
+    index_path: Optional[Path] = None
+    wanted: Optional[Set[str]] = None
+
+    @property
+    def corpus_mode(self) -> bool:
+        return self.index_path is None
+
+def _resolve_scope(req: AskRequest) -> _Scope:
+    if req.doc_ids is not None:
+        wanted = _corpus_scope(req)
+        signature = (get_corpus().signature(), tuple(sorted(wanted)) if wanted is not None else "all")
+        return _Scope(name=CORPUS_SCOPE, signature=signature, wanted=wanted)
+
+    index_path = _ready_index_path(req.doc_id)
+    return _Scope(name=req.doc_id, signature=index_signature(index_path), index_path=index_path)
+
+def _validate_question(req: AskRequest) -> str:
     if not req.question or not req.question.strip():
         raise HTTPException(status_code=400, detail="Empty question")
 
@@ -115,26 +718,325 @@ async def ask(req: AskRequest):
     lang = (getattr(req, "language", "bn") or "bn").strip().lower()
     if lang not in {"bn", "en"}:
         raise HTTPException(status_code=400, detail="language must be bn or en")
+    return lang
 
-    reply_language_instruction = "Bengali using Bengali script" if lang == "bn" else "English"
+def _new_plan(req: AskRequest, scope: _Scope, lang: str) -> _AskPlan:
+    return _AskPlan(
+        doc_id=scope.name,
+        session_id=req.session_id,
+        question=req.question.strip(),
+        docs=[],
+        inputs={},
+        config={"configurable": {"session_id": f"{scope.name}::{req.session_id}"}},
+        language=lang,
+        top_k=req.top_k,
+        norm_q=normalize_question(req.question),
+        scope=scope,
+    )
 
-    vs = load_faiss_index(index_path)
-    retriever = vs.as_retriever(search_kwargs={"k": req.top_k})
+def _check_caches(plan: _AskPlan, use_answer_cache: bool) -> Optional[list]:
+    # answers are only reusable when no earlier turn could change them
+    scope = plan.scope
+    if query_cache.answers is not None and use_answer_cache:
+        plan.answer_key = (scope.name, scope.signature, plan.norm_q, plan.top_k, plan.language, PROMPT_VERSION)
+        cached = query_cache.answers.get(plan.answer_key)
+        if cached is not None:
+            plan.answer, plan.sources = cached
+            plan.cache = "answer"
+            return None
 
-    docs = await retriever.ainvoke(req.question.strip())
-    context = format_context(docs)
-    session_key = f"{req.doc_id}::{req.session_id}"
+    docs = query_cache.retrievals.get(_retrieval_key(plan))
+    if docs is not None:
+        plan.cache = "retrieval"
+    return docs
 
-    answer = rag.invoke(
-        {
-            "context": context,
-            "question": req.question.strip(),
-            "reply_language_instruction": reply_language_instruction,
-        },
-        config={"configurable": {"session_id": session_key}},
+def _retrieval_key(plan: _AskPlan) -> tuple:
+    return (plan.scope.name, plan.scope.signature, plan.norm_q, plan.top_k)
+
+def _finish_plan(plan: _AskPlan, docs: list, history_messages: list) -> None:
+    from app.prompts import get_prompt
+    from app.rag_chain import docs_to_sources, pack_context
+
+    context, packing = pack_context(docs, max_tokens=cfg.context_max_tokens)
+    logger.info(
+        f"Context packed | doc_id={plan.doc_id} chunks={packing['chunks']} blocks={packing['blocks']} "
+        f"dropped={packing['dropped']} tokens={packing['tokens_packed']} saved={packing['tokens_saved']}"
     )
-    answer = clean_repetition(answer)
 
+    plan.docs = docs
+    plan.sources = docs_to_sources(docs)
+    plan.inputs = {
+        "context": context,
+        "question": plan.question,
+        "reply_language_instruction": "Bengali using Bengali script" if plan.language == "bn" else "English",
+    }
+    prompt = get_prompt(PROMPT_VERSION).format_messages(history=history_messages, **plan.inputs)
+    plan.prompt_tokens = sum(estimate_tokens(str(m.content)) for m in prompt)
+
+async def _prepare_ask(req: AskRequest) -> _AskPlan:
+    # reads manifests, so it is kept off the event loop
+    scope = await run_in_threadpool(_resolve_scope, req)
+    plan = _new_plan(req, scope, _validate_question(req))
 
-    sources = docs_to_sources(docs)
-    return AskResponse(answer=answer, sources=sources)
+    history_messages = await run_in_threadpool(lambda: get_history_store().messages(scope.name, req.session_id))
+    docs = _check_caches(plan, use_answer_cache=not history_messages)
+    if plan.cache == "answer":
+        return plan
+
+    if docs is None:
+        vector = query_cache.vectors.get(plan.norm_q)
+        if vector is None:
+            with stage_timer("embed_query"):
+                vector = await run_in_threadpool(lambda: _embeddings().embed_query(plan.question))
+            query_cache.vectors.put(plan.norm_q, vector)
+        else:
+            plan.cache = "vector"
+
+        if scope.corpus_mode:
+            with stage_timer("retrieval"):
+                hits = await run_in_threadpool(get_corpus().search, vector, req.top_k, scope.wanted)
+            docs = [d for d, _ in hits]
+        else:
+            with stage_timer("index_get"):
+                doc_index = await run_in_threadpool(index_cache.get, req.doc_id, scope.index_path, _load_index)
+            with stage_timer("retrieval"):
+                docs = await run_in_threadpool(
+                    doc_index.search,
+                    vector,
+                    plan.question,
+                    req.top_k,
+                    cfg.hybrid_enabled,
+                    cfg.hybrid_fetch_k,
+                    cfg.hybrid_rrf_k,
+                )
+        query_cache.retrievals.put(_retrieval_key(plan), docs)
+
+    _finish_plan(plan, docs, history_messages)
+    return plan
+
+def _count_ask(plan: _AskPlan, endpoint: str) -> None:
+    CACHE_REQUESTS.inc(cache=plan.cache)
+    if plan.cache != "answer":
+        PROMPT_TOKENS.observe(plan.prompt_tokens, endpoint=endpoint)
+
+def _serve_cached_answer(plan: _AskPlan) -> None:
+    # keep the session consistent with what the user was shown
+    from app.memory import get_history
+
+    history = get_history(plan.doc_id, plan.session_id)
+    history.add_user_message(plan.question)
+    history.add_ai_message(plan.answer)
+
+@app.post("/ask", response_model=AskResponse)
+async def ask(req: AskRequest, response: Response):
+    plan = await _prepare_ask(req)
+    _count_ask(plan, "/ask")
+    response.headers["X-Cache"] = plan.cache
+
+    if plan.cache == "answer":
+        await run_in_threadpool(_serve_cached_answer, plan)
+        return AskResponse(answer=plan.answer, sources=plan.sources)
+
+    with stage_timer("llm"):
+        answer = await get_rag().ainvoke(plan.inputs, config=plan.config)
+    with stage_timer("postprocess"):
+        answer = clean_repetition(answer)
+    await run_in_threadpool(get_history_store().record_prompt_tokens, plan.doc_id, plan.session_id, plan.prompt_tokens)
+
+    if plan.answer_key is not None:
+        query_cache.answers.put(plan.answer_key, (answer, plan.sources))
+    return AskResponse(answer=answer, sources=plan.sources, prompt_tokens=plan.prompt_tokens)
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/ask/stream")
+async def ask_stream(req: AskRequest, request: Request):
+    plan = await _prepare_ask(req)
+    _count_ask(plan, "/ask/stream")
+
+    async def events():
+        yield _sse("sources", {"sources": plan.sources})
+
+        if plan.cache == "answer":
+            await run_in_threadpool(_serve_cached_answer, plan)
+            yield _sse("token", {"text": plan.answer})
+            yield _sse("done", {"answer": plan.answer})
+            return
+
+        # the history wrapper commits the question and the full answer once,
+        # when the stream completes
+        stream = get_rag().astream(plan.inputs, config=plan.config)
+        parts = []
+        t0 = time.perf_counter()
+        try:
+            async for token in stream:
+                if await request.is_disconnected():
+                    logger.info(f"Client disconnected, stopping generation | doc_id={req.doc_id}")
+                    return
+                if token:
+                    if not parts:
+                        record_stage("llm_first_token", time.perf_counter() - t0)
+                    parts.append(token)
+                    yield _sse("token", {"text": token})
+            record_stage("llm", time.perf_counter() - t0)
+
+            with stage_timer("postprocess"):
+                answer = clean_repetition("".join(parts))
+            await run_in_threadpool(get_history_store().record_prompt_tokens, plan.doc_id, plan.session_id, plan.prompt_tokens)
+            if plan.answer_key is not None:
+                query_cache.answers.put(plan.answer_key, (answer, plan.sources))
+            yield _sse("done", {"answer": answer, "prompt_tokens": plan.prompt_tokens})
+        except Exception as e:
+            logger.exception(f"Streaming answer failed | doc_id={req.doc_id}")
+            yield _sse("error", {"detail": str(e)})
+        finally:
+            # closing the generator cancels the upstream completion request
+            await stream.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Cache": plan.cache},
+    )
+
+def _search_group(scope: _Scope, plans: List[_AskPlan], vectors: List[List[float]]) -> List[list]:
+    top_k = max(p.top_k for p in plans)
+    if scope.corpus_mode:
+        return [[d for d, _ in hits] for hits in get_corpus().search_many(vectors, top_k, scope.wanted)]
+
+    doc_index = index_cache.get(scope.name, scope.index_path, _load_index)
+    return doc_index.search_many(
+        vectors,
+        [p.question for p in plans],
+        top_k,
+        cfg.hybrid_enabled,
+        cfg.hybrid_fetch_k,
+        cfg.hybrid_rrf_k,
+    )
+
+@app.post("/ask/batch", response_model=AskBatchResponse)
+async def ask_batch(req: AskBatchRequest):
+    # Stateless: batch questions neither read nor write session history.
+    # Query vectors are embedded in one call, each index is searched once
+    # for all of its questions, and answers are generated concurrently.
+    if not req.questions:
+        raise HTTPException(status_code=400, detail="No questions")
+    if len(req.questions) > cfg.ask_batch_max_questions:
+        raise HTTPException(status_code=400, detail=f"At most {cfg.ask_batch_max_questions} questions per batch")
+
+    results: List[Optional[BatchAnswer]] = [None] * len(req.questions)
+    plans: List[Optional[_AskPlan]] = [None] * len(req.questions)
+    groups: Dict[tuple, List[int]] = {}
+    for i, item in enumerate(req.questions):
+        sub = AskRequest(
+            doc_id=item.doc_id or req.doc_id,
+            doc_ids=item.doc_ids if item.doc_ids is not None else req.doc_ids,
+            session_id="batch",
+            question=item.question,
+            top_k=req.top_k,
+            language=req.language,
+        )
+        try:
+            scope = await run_in_threadpool(_resolve_scope, sub)
+            plan = _new_plan(sub, scope, _validate_question(sub))
+        except HTTPException as e:
+            results[i] = BatchAnswer(index=i, status="error", error=str(e.detail))
+            continue
+
+        plans[i] = plan
+        docs = _check_caches(plan, use_answer_cache=True)
+        if plan.cache == "answer":
+            results[i] = BatchAnswer(index=i, status="ok", answer=plan.answer, sources=plan.sources, cache="answer")
+        elif docs is not None:
+            _finish_plan(plan, docs, [])
+        else:
+            groups.setdefault((scope.name, scope.signature), []).append(i)
+            # counted once it is known whether the vector was cached
+            continue
+        CACHE_REQUESTS.inc(cache=plan.cache)
+
+    vectors: Dict[str, List[float]] = {}
+    missing: Dict[str, str] = {}
+    for members in groups.values():
+        for i in members:
+            vector = query_cache.vectors.get(plans[i].norm_q)
+            if vector is None:
+                missing[plans[i].norm_q] = plans[i].question
+            else:
+                vectors[plans[i].norm_q] = vector
+                plans[i].cache = "vector"
+            CACHE_REQUESTS.inc(cache=plans[i].cache)
+    if missing:
+        # embed_query of the local sentence-transformers model is
+        # embed_documents of one text, so one batch call gives the same vectors
+        embeddings = _embeddings()
+        with stage_timer("embed_query"):
+            embedded = await run_in_threadpool(embeddings.embed_documents, list(missing.values()))
+        for norm_q, vector in zip(missing, embedded):
+            vectors[norm_q] = vector
+            query_cache.vectors.put(norm_q, vector)
+
+    for members in groups.values():
+        group_plans = [plans[i] for i in members]
+        try:
+            with stage_timer("retrieval"):
+                found = await run_in_threadpool(
+                    _search_group,
+                    group_plans[0].scope,
+                    group_plans,
+                    [vectors[p.norm_q] for p in group_plans],
+                )
+        except Exception as e:
+            logger.exception(f"Batch retrieval failed | doc_id={group_plans[0].doc_id}")
+            for i in members:
+                results[i] = BatchAnswer(index=i, status="error", error=f"Retrieval failed: {e}")
+            continue
+        for plan, docs in zip(group_plans, found):
+            query_cache.retrievals.put(_retrieval_key(plan), docs)
+            _finish_plan(plan, docs, [])
+
+    semaphore = asyncio.Semaphore(max(1, cfg.ask_batch_concurrency))
+
+    async def generate(i: int, plan: _AskPlan) -> None:
+        async with semaphore:
+            PROMPT_TOKENS.observe(plan.prompt_tokens, endpoint="/ask/batch")
+            try:
+                with stage_timer("llm"):
+                    answer = await get_answer_chain().ainvoke({**plan.inputs, "history": []})
+                with stage_timer("postprocess"):
+                    answer = clean_repetition(answer)
+            except Exception as e:
+                logger.exception(f"Batch answer failed | doc_id={plan.doc_id} index={i}")
+                results[i] = BatchAnswer(index=i, status="error", sources=plan.sources, error=str(e))
+                return
+        if plan.answer_key is not None:
+            query_cache.answers.put(plan.answer_key, (answer, plan.sources))
+        results[i] = BatchAnswer(
+            index=i,
+            status="ok",
+            answer=answer,
+            sources=plan.sources,
+            cache=plan.cache,
+            prompt_tokens=plan.prompt_tokens,
+        )
+
+    await asyncio.gather(*(generate(i, p) for i, p in enumerate(plans) if p is not None and results[i] is None))
+    logger.info(
+        f"Batch answered | questions={len(results)} "
+        f"errors={sum(r.status != 'ok' for r in results)} indexes={len(groups)}"
+    )
+    return AskBatchResponse(results=results)
+
+@app.get("/history/{session_id}")
+def session_history(session_id: str, doc_id: str):
+    # doc_id is a document id, or "corpus" for questions asked with doc_ids
+    history_store = get_history_store()
+    turns = history_store.turns(doc_id, session_id)
+    return {
+        "doc_id": doc_id,
+        "session_id": session_id,
+        "turns": turns,
+        "history_tokens": sum(t["question_tokens"] + t["answer_tokens"] for t in turns),
+        "max_tokens": history_store.max_tokens,
+    }
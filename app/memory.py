@@ -1,15 +1,242 @@
 from __future__ import annotations
 
-from typing import Dict, Tuple
+from contextlib import contextmanager
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence
 
-from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
 
+from app.utils import ensure_dir, estimate_tokens
 
-_store: Dict[Tuple[str, str], ChatMessageHistory] = {}
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    doc_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (doc_id, session_id)
+);
+CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    doc_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    prompt_tokens INTEGER,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_session ON messages (doc_id, session_id, id);
+"""
 
+# idle-session eviction runs every this many writes in each process
+_EVICT_EVERY = 64
 
-def get_history(doc_id: str, session_id: str) -> ChatMessageHistory:
-    key = (doc_id, session_id)
-    if key not in _store:
-        _store[key] = ChatMessageHistory()
-    return _store[key]
+
+class HistoryStore:
+    # Chat history in SQLite, so it survives restarts and every uvicorn
+    # worker sees the same sessions. Each session keeps at most max_tokens
+    # of messages (oldest turns are dropped first), sessions idle for
+    # ttl_seconds are removed, and beyond max_sessions the least recently
+    # used go first.
+    def __init__(self, db_path: Path, max_sessions: int = 10_000, ttl_seconds: int = 7 * 24 * 3600, max_tokens: int = 2000):
+        self.db_path = db_path
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_tokens = max_tokens
+        self._writes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.trimmed_messages = 0
+
+        ensure_dir(db_path.parent)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+        self.evict()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def messages(self, doc_id: str, session_id: str) -> List[BaseMessage]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT role, content FROM messages WHERE doc_id = ? AND session_id = ? ORDER BY id",
+                (doc_id, session_id),
+            ).fetchall()
+        return [HumanMessage(content=c) if role == "human" else AIMessage(content=c) for role, c in rows]
+
+    def add(self, doc_id: str, session_id: str, messages: Sequence[BaseMessage]) -> None:
+        now = time.time()
+        rows = [
+            (doc_id, session_id, "human" if m.type == "human" else "ai", str(m.content), estimate_tokens(str(m.content)), now)
+            for m in messages
+        ]
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO messages (doc_id, session_id, role, content, tokens, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.execute(
+                "INSERT INTO sessions (doc_id, session_id, last_used) VALUES (?, ?, ?) "
+                "ON CONFLICT (doc_id, session_id) DO UPDATE SET last_used = excluded.last_used",
+                (doc_id, session_id, now),
+            )
+            self._trim(conn, doc_id, session_id)
+
+        with self._lock:
+            self._writes += 1
+            due = self._writes % _EVICT_EVERY == 0
+        if due:
+            self.evict()
+
+    def _trim(self, conn: sqlite3.Connection, doc_id: str, session_id: str) -> None:
+        # walk back from the newest message until the budget is spent, always
+        # keeping the latest exchange, then cut so history starts on a question
+        rows = conn.execute(
+            "SELECT id, role, tokens FROM messages WHERE doc_id = ? AND session_id = ? ORDER BY id DESC",
+            (doc_id, session_id),
+        ).fetchall()
+        total, keep_from = 0, None
+        for i, (row_id, role, tokens) in enumerate(rows):
+            if total + tokens > self.max_tokens and i >= 2:
+                break
+            total += tokens
+            keep_from = row_id
+        kept = [r for r in rows if r[0] >= keep_from] if keep_from is not None else []
+        while kept and kept[-1][1] != "human":
+            kept.pop()
+        if len(kept) == len(rows):
+            return
+
+        cutoff = kept[-1][0] if kept else rows[0][0] + 1
+        cur = conn.execute(
+            "DELETE FROM messages WHERE doc_id = ? AND session_id = ? AND id < ?",
+            (doc_id, session_id, cutoff),
+        )
+        self.trimmed_messages += cur.rowcount
+
+    def record_prompt_tokens(self, doc_id: str, session_id: str, prompt_tokens: int) -> None:
+        # attached to the latest question of the session, i.e. this turn
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE messages SET prompt_tokens = ? WHERE id = ("
+                "SELECT MAX(id) FROM messages WHERE doc_id = ? AND session_id = ? AND role = 'human')",
+                (prompt_tokens, doc_id, session_id),
+            )
+
+    def turns(self, doc_id: str, session_id: str) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT role, content, tokens, prompt_tokens, created_at FROM messages "
+                "WHERE doc_id = ? AND session_id = ? ORDER BY id",
+                (doc_id, session_id),
+            ).fetchall()
+        turns: List[Dict[str, Any]] = []
+        for role, content, tokens, prompt_tokens, created_at in rows:
+            if role == "human":
+                turns.append({
+                    "question": content,
+                    "answer": None,
+                    "question_tokens": tokens,
+                    "answer_tokens": 0,
+                    "prompt_tokens": prompt_tokens,
+                    "created_at": created_at,
+                })
+            elif turns:
+                turns[-1]["answer"] = content
+                turns[-1]["answer_tokens"] = tokens
+        return turns
+
+    def clear(self, doc_id: str, session_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM messages WHERE doc_id = ? AND session_id = ?", (doc_id, session_id))
+            conn.execute("DELETE FROM sessions WHERE doc_id = ? AND session_id = ?", (doc_id, session_id))
+
+    def delete_document(self, doc_id: str) -> int:
+        # every session of a deleted document
+        with self._connect() as conn:
+            conn.execute("DELETE FROM messages WHERE doc_id = ?", (doc_id,))
+            return conn.execute("DELETE FROM sessions WHERE doc_id = ?", (doc_id,)).rowcount
+
+    def evict(self) -> int:
+        cutoff = time.time() - self.ttl_seconds
+        with self._connect() as conn:
+            expired = conn.execute(
+                "SELECT doc_id, session_id FROM sessions WHERE last_used < ?", (cutoff,)
+            ).fetchall()
+            excess = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] - len(expired) - self.max_sessions
+            if excess > 0:
+                expired += conn.execute(
+                    "SELECT doc_id, session_id FROM sessions WHERE last_used >= ? ORDER BY last_used LIMIT ?",
+                    (cutoff, excess),
+                ).fetchall()
+            conn.executemany("DELETE FROM messages WHERE doc_id = ? AND session_id = ?", expired)
+            conn.executemany("DELETE FROM sessions WHERE doc_id = ? AND session_id = ?", expired)
+        self.evictions += len(expired)
+        return len(expired)
+
+    def stats(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            sessions = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            messages = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        return {
+            "sessions": sessions,
+            "messages": messages,
+            "evictions": self.evictions,
+            "trimmed_messages": self.trimmed_messages,
+        }
+
+
+class SQLiteChatHistory(BaseChatMessageHistory):
+    def __init__(self, store: HistoryStore, doc_id: str, session_id: str):
+        self.store = store
+        self.doc_id = doc_id
+        self.session_id = session_id
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return self.store.messages(self.doc_id, self.session_id)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.store.add(self.doc_id, self.session_id, messages)
+
+    def clear(self) -> None:
+        self.store.clear(self.doc_id, self.session_id)
+
+
+_store: Optional[HistoryStore] = None
+
+
+def set_history_store(store: HistoryStore) -> None:
+    global _store
+    _store = store
+
+
+def get_history_store() -> HistoryStore:
+    global _store
+    if _store is None:
+        from app.config import AppConfig
+
+        cfg = AppConfig()
+        _store = HistoryStore(
+            cfg.history_db,
+            max_sessions=cfg.history_max_sessions,
+            ttl_seconds=cfg.history_ttl_seconds,
+            max_tokens=cfg.history_max_tokens,
+        )
+    return _store
+
+
+def get_history(doc_id: str, session_id: str) -> SQLiteChatHistory:
+    return SQLiteChatHistory(get_history_store(), doc_id, session_id)
@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import asyncio
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# A small Prometheus registry (text exposition format 0.0.4), enough for
+# counters, gauges and histograms without another dependency.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 16000)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+WAIT_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {_fmt(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[i] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(c), self._sums[k]) for k, c in self._counts.items())
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets + (math.inf,), counts):
+                cumulative += c
+                le = f'le="{_fmt(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], List[str]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[str]]) -> None:
+        # collectors render values kept elsewhere (e.g. cache stats) at scrape time
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.render())
+        for collect in collectors:
+            lines.extend(collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "pdf_insight_http_requests_total", "HTTP requests by endpoint and status", ("method", "endpoint", "status")
+))
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    "pdf_insight_http_request_duration_seconds", "HTTP request latency by endpoint", ("method", "endpoint")
+))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "pdf_insight_http_requests_in_flight", "HTTP requests being served", ("endpoint",)
+))
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    "pdf_insight_stage_duration_seconds", "Latency of ingest and query stages", ("stage",)
+))
+CHUNKS_PER_DOC = REGISTRY.register(Histogram(
+    "pdf_insight_chunks_per_document", "Chunks per indexed document", buckets=COUNT_BUCKETS
+))
+PROMPT_TOKENS = REGISTRY.register(Histogram(
+    "pdf_insight_prompt_tokens", "Estimated prompt tokens per LLM call", ("endpoint",), buckets=TOKEN_BUCKETS
+))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "pdf_insight_ask_cache_total", "Ask requests by the cache level that served them", ("cache",)
+))
+LLM_CALLS = REGISTRY.register(Counter(
+    "pdf_insight_llm_calls_total", "LLM calls by model and outcome (ok, error, cancelled)", ("model", "outcome")
+))
+LLM_FIRST_TOKEN = REGISTRY.register(Histogram(
+    "pdf_insight_llm_first_token_seconds", "Time to first token of the model that answered", ("model",)
+))
+LLM_HEDGES = REGISTRY.register(Counter(
+    "pdf_insight_llm_hedges_total", "Hedged LLM calls by the model that answered first", ("winner",)
+))
+EMBED_BATCH_SIZE = REGISTRY.register(Histogram(
+    "pdf_insight_embedding_batch_size", "Texts per embedding model call of the batching service", buckets=BATCH_BUCKETS
+))
+EMBED_QUEUE_WAIT = REGISTRY.register(Histogram(
+    "pdf_insight_embedding_queue_wait_seconds", "Time embedding calls wait for their batch (query, document)", ("kind",),
+    buckets=WAIT_BUCKETS,
+))
+EVENT_LOOP_LAG = REGISTRY.register(Histogram(
+    "pdf_insight_event_loop_lag_seconds", "How late the event loop ran a timer, sampled every 100 ms", buckets=LAG_BUCKETS
+))
+
+# per-request stage breakdown, set only when X-Debug-Timings is asked for
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def start_request_timings() -> Dict[str, float]:
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    STAGE_LATENCY.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - t0)
+
+
+def format_timings(timings: Dict[str, float]) -> str:
+    # Server-Timing style: "retrieval;dur=3.1, llm;dur=812.4" (milliseconds)
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+async def monitor_event_loop(interval: float = 0.1) -> None:
+    # blocking work on the event loop (rather than in the thread pool)
+    # shows up as timers firing late
+    loop = asyncio.get_running_loop()
+    while True:
+        t0 = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - t0 - interval))
+
+
+def resident_memory_bytes() -> Optional[int]:
+    # current RSS; None where /proc is not available
+    try:
+        with open("/proc/self/statm", "r", encoding="ascii") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
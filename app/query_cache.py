@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+import re
+import threading
+import time
+import unicodedata
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+def normalize_question(question: str) -> str:
+    text = unicodedata.normalize("NFC", question or "")
+    text = re.sub(r"\s+", " ", text).strip().casefold()
+    return text.rstrip("?।!. ")
+
+
+class TTLCache:
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, match: Callable[[Hashable], bool]) -> int:
+        with self._lock:
+            keys = [k for k in self._entries if match(k)]
+            for k in keys:
+                del self._entries[k]
+            return len(keys)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class QueryCache:
+    # level 1: question -> query vector, and (doc, question, k) -> retrieved
+    # chunks; level 2: full answers for sessions that have no history yet.
+    # Keys carry the index signature, so a re-indexed document never serves
+    # stale entries even before invalidate_doc is called.
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 3600, answers_enabled: bool = True):
+        self.vectors = TTLCache(max_entries, ttl_seconds)
+        self.retrievals = TTLCache(max_entries, ttl_seconds)
+        self.answers = TTLCache(max_entries, ttl_seconds) if answers_enabled else None
+
+    def invalidate_doc(self, doc_id: str) -> None:
+        self.retrievals.invalidate(lambda k: k[0] == doc_id)
+        if self.answers is not None:
+            self.answers.invalidate(lambda k: k[0] == doc_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "vectors": self.vectors.stats(),
+            "retrievals": self.retrievals.stats(),
+            "answers": self.answers.stats() if self.answers is not None else None,
+        }
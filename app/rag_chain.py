@@ -1,14 +1,43 @@
 from __future__ import annotations
 
+import asyncio
+from collections import deque
 from dataclasses import dataclass
-from typing import List, Dict, Any
+import logging
+import os
+import re
+import threading
+import time
+from typing import List, Dict, Any, Iterator, AsyncIterator, Optional, Tuple
 
+from langchain_core.language_models.chat_models import BaseChatModel, agenerate_from_stream
+from langchain_core.messages import BaseMessage, BaseMessageChunk
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_groq import ChatGroq
+from pydantic import PrivateAttr
 
 from app.prompts import get_prompt
 from app.memory import get_history
+from app.metrics import LLM_CALLS, LLM_FIRST_TOKEN, LLM_HEDGES, stage_timer
+from app.utils import estimate_tokens
+
+logger = logging.getLogger("pdf_insight_assistant")
+
+
+@dataclass(frozen=True)
+class RouterSettings:
+    hedge: bool = True
+    hedge_quantile: float = 0.95
+    hedge_min_ms: int = 300
+    # deadline used until a model has min_samples first-token latencies
+    hedge_default_ms: int = 2000
+    latency_window: int = 100
+    min_samples: int = 20
+    breaker_window: int = 20
+    breaker_min_calls: int = 5
+    breaker_error_percent: int = 50
+    breaker_cooldown_seconds: float = 30.0
 
 
 @dataclass(frozen=True)
@@ -17,34 +46,350 @@ class RAGSettings:
     fallback_model: str
     prompt_version: str = "v1"
     temperature: float = 0.2
+    base_url: str = ""
+    router: Optional[RouterSettings] = None
 
 
-def _history_factory(doc_id: str, session_id: str):
-    return get_history(doc_id, session_id)
+class ModelUnavailable(RuntimeError):
+    pass
 
 
-def build_rag_chain(settings: RAGSettings):
-    prompt = get_prompt(settings.prompt_version)
-    parser = StrOutputParser()
+class EmptyResponse(RuntimeError):
+    # the model's stream ended without a single chunk
+    pass
+
+
+class ModelHealth:
+    # Rolling first-token latency and error rate of one model, and its
+    # circuit breaker. The breaker opens when at least breaker_error_percent
+    # of the last breaker_window calls failed, rejects calls for the
+    # cooldown, then lets one trial call through: success closes it, failure
+    # opens it for another cooldown.
+    def __init__(self, name: str, settings: RouterSettings):
+        self.name = name
+        self.settings = settings
+        self._lock = threading.Lock()
+        self._latencies: deque = deque(maxlen=settings.latency_window)
+        self._outcomes: deque = deque(maxlen=settings.breaker_window)
+        self._opened_at: Optional[float] = None
+        self._trial = False
+
+    def _state(self, now: float) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if now - self._opened_at < self.settings.breaker_cooldown_seconds:
+            return "open"
+        return "half_open"
+
+    def state(self) -> str:
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._state(time.monotonic())
+            if state == "closed":
+                return True
+            if state == "open" or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self, first_token_seconds: Optional[float]) -> None:
+        with self._lock:
+            if first_token_seconds is not None:
+                self._latencies.append(first_token_seconds)
+            self._outcomes.append(True)
+            if self._trial:
+                self._trial = False
+                self._opened_at = None
+                self._outcomes.clear()
+                logger.info(f"LLM circuit closed | model={self.name}")
+
+    def record_failure(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._outcomes.append(False)
+            if self._trial:
+                self._trial = False
+                self._opened_at = now
+                logger.warning(f"LLM circuit reopened | model={self.name}")
+                return
+            if self._opened_at is not None:
+                return
+            calls = len(self._outcomes)
+            errors = calls - sum(self._outcomes)
+            if calls >= self.settings.breaker_min_calls and errors * 100 >= self.settings.breaker_error_percent * calls:
+                self._opened_at = now
+                logger.warning(f"LLM circuit opened | model={self.name} errors={errors}/{calls}")
+
+    def release(self, waited_seconds: Optional[float] = None) -> None:
+        # the call was cancelled before it had an outcome. Cancelled before
+        # its first token, it took at least waited_seconds to answer: kept as
+        # a (censored) sample so the p95 is not set by the calls fast enough
+        # to win alone
+        with self._lock:
+            self._trial = False
+            if waited_seconds is not None:
+                self._latencies.append(waited_seconds)
+
+    def latency_quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self._latencies) < self.settings.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def hedge_deadline(self) -> float:
+        p = self.latency_quantile(self.settings.hedge_quantile)
+        if p is None:
+            return self.settings.hedge_default_ms / 1000
+        return max(self.settings.hedge_min_ms / 1000, p)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = len(self._outcomes)
+            errors = calls - sum(self._outcomes)
+            state = self._state(time.monotonic())
+        return {
+            "state": state,
+            "recent_calls": calls,
+            "error_rate": round(errors / calls, 3) if calls else 0.0,
+            "first_token_p95_seconds": self.latency_quantile(0.95),
+            "hedge_deadline_seconds": round(self.hedge_deadline(), 3),
+        }
 
-    def _make_llm(model_name: str):
-        return ChatGroq(model=model_name, temperature=settings.temperature)
 
-    llm = None
+def _has_token(chunk: BaseMessageChunk) -> bool:
+    # OpenAI-compatible streams, Groq's included, open with a role-only
+    # chunk of empty content; that is not a first token
+    if chunk.content:
+        return True
+    return bool(getattr(chunk, "tool_call_chunks", None) or chunk.additional_kwargs.get("tool_calls"))
+
+
+class _Attempt:
+    # one streaming call to one model; task resolves to the chunks up to and
+    # including the first one with content or tool-call data
+    def __init__(self, name: str, model: BaseChatModel, health: ModelHealth, messages, stop, kwargs):
+        self.name = name
+        self.health = health
+        self.t0 = time.perf_counter()
+        self.stream = model.astream(messages, stop=stop, **kwargs).__aiter__()
+        self.task = asyncio.ensure_future(self._first_token())
+
+    async def _first_token(self) -> List[BaseMessageChunk]:
+        chunks: List[BaseMessageChunk] = []
+        while True:
+            try:
+                chunk = await self.stream.__anext__()
+            except StopAsyncIteration:
+                raise EmptyResponse(f"{self.name} returned no output") from None
+            chunks.append(chunk)
+            if _has_token(chunk):
+                return chunks
+
+    def failed(self) -> Optional[BaseException]:
+        if self.task.cancelled():
+            return asyncio.CancelledError()
+        return self.task.exception()
+
+    def waited(self) -> Optional[float]:
+        # time so far without a first token; None once the first chunk is in
+        return None if self.task.done() else time.perf_counter() - self.t0
+
+
+# cancelled attempts are closed in the background; keep them referenced
+_discarding: set = set()
+
+
+async def _discard(attempt: _Attempt) -> None:
+    attempt.task.cancel()
+    try:
+        await attempt.task
+    except BaseException:
+        pass
     try:
-        llm = _make_llm(settings.model)
+        await attempt.stream.aclose()
     except Exception:
-        llm = _make_llm(settings.fallback_model)
+        pass
+
+
+class ModelRouter(BaseChatModel):
+    # Chat model that routes each call over several models in preference
+    # order. A model whose circuit is open is skipped, and a call that fails
+    # before its first token moves on to the next model. With hedging, a
+    # call that has no first token within the primary's p95 first-token
+    # latency is also sent to the next model; whichever streams a token
+    # first answers and the other call is cancelled.
+    names: List[str]
+    models: List[Any]
+    settings: RouterSettings = RouterSettings()
+
+    _health: List[ModelHealth] = PrivateAttr(default_factory=list)
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._health = [ModelHealth(name, self.settings) for name in self.names]
+
+    @property
+    def _llm_type(self) -> str:
+        return "model_router"
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {h.name: h.stats() for h in self._health}
+
+    def _admitted(self) -> Iterator[Tuple[str, BaseChatModel, ModelHealth]]:
+        # breakers are asked lazily, so a half-open trial is only taken by
+        # the call that will use it
+        for name, model, health in zip(self.names, self.models, self._health):
+            if health.allow():
+                yield name, model, health
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        # blocking calls are not hedged, only failed over
+        error: Optional[BaseException] = None
+        for name, model, health in self._admitted():
+            try:
+                message = model.invoke(messages, stop=stop, **kwargs)
+            except Exception as e:
+                health.record_failure()
+                LLM_CALLS.inc(model=name, outcome="error")
+                error = e
+                continue
+            health.record_success(None)
+            LLM_CALLS.inc(model=name, outcome="ok")
+            return ChatResult(generations=[ChatGeneration(message=message)])
+        raise error or ModelUnavailable("Every model's circuit is open")
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        return await agenerate_from_stream(self._astream(messages, stop=stop, run_manager=run_manager, **kwargs))
 
-    base = prompt | llm | parser
+    async def _astream(
+        self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        admitted = self._admitted()
+        racing: List[_Attempt] = []
+        hedged = False
+        error: Optional[BaseException] = None
+        winner: Optional[_Attempt] = None
+        try:
+            while winner is None:
+                if not racing:
+                    nxt = next(admitted, None)
+                    if nxt is None:
+                        raise error or ModelUnavailable("Every model's circuit is open")
+                    racing.append(_Attempt(*nxt, messages, stop, kwargs))
 
-    chain = RunnableWithMessageHistory(
+                timeout = None
+                if self.settings.hedge and not hedged and len(racing) == 1:
+                    first = racing[0]
+                    timeout = max(0.0, first.t0 + first.health.hedge_deadline() - time.perf_counter())
+                done, _ = await asyncio.wait({a.task for a in racing}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # no first token by the deadline: hedge with the next model
+                    hedged = True
+                    nxt = next(admitted, None)
+                    if nxt is not None:
+                        racing.append(_Attempt(*nxt, messages, stop, kwargs))
+                    continue
+
+                for attempt in list(racing):
+                    if not attempt.task.done():
+                        continue
+                    exc = attempt.failed()
+                    if exc is None:
+                        winner = attempt
+                        break
+                    racing.remove(attempt)
+                    attempt.health.record_failure()
+                    LLM_CALLS.inc(model=attempt.name, outcome="error")
+                    error = exc
+
+            first_token = time.perf_counter() - winner.t0
+            LLM_FIRST_TOKEN.observe(first_token, model=winner.name)
+            if len(racing) > 1:
+                LLM_HEDGES.inc(winner=winner.name)
+            for attempt in racing:
+                if attempt is not winner:
+                    attempt.health.release(attempt.waited())
+                    LLM_CALLS.inc(model=attempt.name, outcome="cancelled")
+                    task = asyncio.ensure_future(_discard(attempt))
+                    _discarding.add(task)
+                    task.add_done_callback(_discarding.discard)
+            racing = [winner]
+
+            for chunk in winner.task.result():
+                yield ChatGenerationChunk(message=chunk)
+            try:
+                async for chunk in winner.stream:
+                    yield ChatGenerationChunk(message=chunk)
+            except Exception:
+                winner.health.record_failure()
+                LLM_CALLS.inc(model=winner.name, outcome="error")
+                racing = []
+                raise
+            winner.health.record_success(first_token)
+            LLM_CALLS.inc(model=winner.name, outcome="ok")
+            racing = []
+        finally:
+            # the caller stopped early or was cancelled
+            for attempt in racing:
+                attempt.health.release(attempt.waited())
+                LLM_CALLS.inc(model=attempt.name, outcome="cancelled")
+                await _discard(attempt)
+
+
+def _history_factory(doc_id: str, session_id: str):
+    return get_history(doc_id, session_id)
+
+
+def build_llm(settings: RAGSettings) -> ModelRouter:
+    from langchain_groq import ChatGroq
+
+    names = [settings.model]
+    if settings.fallback_model and settings.fallback_model != settings.model:
+        names.append(settings.fallback_model)
+
+    options: Dict[str, Any] = {"temperature": settings.temperature}
+    if settings.base_url:
+        options["base_url"] = settings.base_url
+    if len(names) > 1:
+        # the router moves on to the other model instead of retrying
+        options["max_retries"] = 0
+
+    kept, models = [], []
+    error: Optional[Exception] = None
+    for name in names:
+        try:
+            models.append(ChatGroq(model=name, **options))
+            kept.append(name)
+        except Exception as e:
+            error = e
+    if not models:
+        raise error
+
+    return ModelRouter(names=kept, models=models, settings=settings.router or RouterSettings())
+
+
+def build_answer_chain(settings: RAGSettings, llm=None):
+    # prompt -> LLM -> text, without session history
+    prompt = get_prompt(settings.prompt_version)
+    parser = StrOutputParser()
+    return prompt | (llm or build_llm(settings)) | parser
+
+
+def with_message_history(base):
+    return RunnableWithMessageHistory(
         base,
         lambda session_id: _history_factory(session_id.split("::")[0], session_id.split("::")[1]),
         input_messages_key="question",
         history_messages_key="history",
     )
-    return chain
+
+
+def build_rag_chain(settings: RAGSettings):
+    return with_message_history(build_answer_chain(settings))
 
 
 def format_context(docs) -> str:
@@ -57,6 +402,110 @@ def format_context(docs) -> str:
     return "\n\n".join(blocks)
 
 
+# stored uploads are named "<doc_id>_<filename>"
+_STORED_PREFIX_RE = re.compile(r"^[0-9a-f]{32}_")
+
+
+def _short_source(src: str) -> str:
+    return _STORED_PREFIX_RE.sub("", os.path.basename(src or ""))
+
+
+def _merge_spans(
+    a: str,
+    a_start: Optional[int],
+    b: str,
+    b_start: Optional[int],
+    min_overlap: int = 50,
+    max_overlap: int = 400,
+) -> Optional[Tuple[str, Optional[int]]]:
+    # a and b are chunks of the same page; splitting repeats up to
+    # chunk_overlap characters between neighbours
+    if a_start is not None and b_start is not None:
+        (left, left_start), (right, right_start) = sorted([(a, a_start), (b, b_start)], key=lambda x: x[1])
+        gap = right_start - (left_start + len(left))
+        if gap > 1:
+            return None
+        return left + (" " if gap == 1 else "") + right[max(0, -gap):], left_start
+
+    # chunks indexed without start_index: match the repeated text itself
+    if b in a:
+        return a, None
+    if a in b:
+        return b, None
+    for first, second in ((a, b), (b, a)):
+        for k in range(min(len(first), len(second), max_overlap), min_overlap - 1, -1):
+            if first.endswith(second[:k]):
+                return first + second[k:], None
+    return None
+
+
+def pack_context(docs, max_tokens: int = 3000) -> Tuple[str, Dict[str, int]]:
+    with stage_timer("context_pack"):
+        return _pack_context(docs, max_tokens)
+
+
+def _pack_context(docs, max_tokens: int) -> Tuple[str, Dict[str, int]]:
+    # docs arrive best first. Chunks of the same page that overlap are merged
+    # into one block, duplicates are dropped, and blocks are added in score
+    # order until the token budget is spent (the best chunk always goes in).
+    blocks: List[Dict[str, Any]] = []
+    used = 0
+    dropped = 0
+    for d in docs:
+        text = d.page_content or ""
+        if not text.strip():
+            continue
+        key = (d.metadata.get("doc_id") or d.metadata.get("source", ""), d.metadata.get("page", None))
+        start = d.metadata.get("start_index", None)
+
+        merged = False
+        for block in blocks:
+            if text in block["text"]:
+                merged = True
+                break
+            if block["key"] != key:
+                continue
+            combined = _merge_spans(block["text"], block["start"], text, start)
+            if combined is None:
+                continue
+            extra = estimate_tokens(combined[0]) - block["tokens"]
+            if used + extra > max_tokens:
+                break
+            block["text"], block["start"] = combined
+            block["tokens"] += extra
+            used += extra
+            merged = True
+            break
+        if merged:
+            continue
+
+        tokens = estimate_tokens(text)
+        if blocks and used + tokens > max_tokens:
+            dropped += 1
+            continue
+        blocks.append({"key": key, "text": text, "start": start, "tokens": tokens, "source": d.metadata.get("source", "")})
+        used += tokens
+
+    # name the file in tags only when the context spans several documents
+    multi = len({b["key"][0] for b in blocks}) > 1
+    parts = []
+    for i, b in enumerate(blocks, start=1):
+        tag = f"{i} {_short_source(b['source'])} p={b['key'][1]}" if multi else f"{i} p={b['key'][1]}"
+        parts.append(f"<<{tag}>>\n{b['text']}")
+    context = "\n\n".join(parts)
+
+    verbatim = estimate_tokens(format_context(docs))
+    packed = estimate_tokens(context)
+    return context, {
+        "chunks": len(docs),
+        "blocks": len(blocks),
+        "dropped": dropped,
+        "tokens_verbatim": verbatim,
+        "tokens_packed": packed,
+        "tokens_saved": verbatim - packed,
+    }
+
+
 def docs_to_sources(docs, max_chars: int = 220):
     sources = []
     for d in docs:
@@ -64,11 +513,12 @@ def docs_to_sources(docs, max_chars: int = 220):
         snippet = (d.page_content or "").strip().replace("\n", " ")
         if len(snippet) > max_chars:
             snippet = snippet[:max_chars] + "..."
-        sources.append(
-            {
-                "page": page,
-                "source": d.metadata.get("source", None),
-                "snippet": snippet,
-            }
-        )
+        source = {
+            "page": page,
+            "source": d.metadata.get("source", None),
+            "snippet": snippet,
+        }
+        if "doc_id" in d.metadata:
+            source["doc_id"] = d.metadata["doc_id"]
+        sources.append(source)
     return sources
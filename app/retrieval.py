@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app.ann import search_parameters
+from app.compact_store import memory_nbytes, read_tombstones
+from app.sparse import SparseIndex, reciprocal_rank_fusion
+from app.storage import index_files_dir, read_manifest
+from app.vectorstore import load_faiss_index
+
+
+@dataclass
+class DocIndex:
+    vs: FAISS
+    sparse: Optional[SparseIndex] = None
+    # rows deleted by an update but still in the FAISS index; BM25 has no
+    # postings for them
+    deleted: Optional[np.ndarray] = None
+    params: Optional[Dict[str, Any]] = None
+
+    def __post_init__(self):
+        self._search_params = None
+        if self.deleted is not None and len(self.deleted):
+            self._search_params = search_parameters(self.params, self.deleted)
+
+    def nbytes(self) -> int:
+        # memory held while cached, see app.index_cache
+        sparse = self.sparse.nbytes() if self.sparse is not None else 0
+        deleted = self.deleted.nbytes if self.deleted is not None else 0
+        return memory_nbytes(self.vs) + sparse + deleted
+
+    def dense_rows(self, vector: List[float], k: int) -> List[int]:
+        return self.dense_rows_many([vector], k)[0]
+
+    def dense_rows_many(self, vectors: List[List[float]], k: int) -> List[List[int]]:
+        queries = np.asarray(vectors, dtype=np.float32)
+        if self._search_params is None:
+            _, rows = self.vs.index.search(queries, k)
+        else:
+            _, rows = self.vs.index.search(queries, k, params=self._search_params)
+        return [[int(r) for r in q if r >= 0] for q in rows]
+
+    def documents(self, rows: List[int]) -> List[Document]:
+        return [self.vs.docstore.search(self.vs.index_to_docstore_id[r]) for r in rows]
+
+    def search(
+        self,
+        vector: List[float],
+        question: str,
+        k: int,
+        hybrid: bool = True,
+        fetch_k: int = 20,
+        rrf_k: int = 60,
+    ) -> List[Document]:
+        return self.search_many([vector], [question], k, hybrid, fetch_k, rrf_k)[0]
+
+    def search_many(
+        self,
+        vectors: List[List[float]],
+        questions: List[str],
+        k: int,
+        hybrid: bool = True,
+        fetch_k: int = 20,
+        rrf_k: int = 60,
+    ) -> List[List[Document]]:
+        # one FAISS search for all queries; BM25 is scored per question
+        if not hybrid or self.sparse is None:
+            return [self.documents(rows) for rows in self.dense_rows_many(vectors, k)]
+
+        # fuse by rank, not score: BM25 and L2 distances are not comparable
+        fetch_k = max(fetch_k, k)
+        dense = self.dense_rows_many(vectors, fetch_k)
+        out = []
+        for rows, question in zip(dense, questions):
+            sparse = self.sparse.search(question, fetch_k)
+            out.append(self.documents(reciprocal_rank_fusion([rows, sparse], k=rrf_k)[:k]))
+        return out
+
+
+def load_doc_index(index_path: Path, embeddings: Embeddings) -> DocIndex:
+    # one manifest read, so every file comes from the same generation
+    manifest = read_manifest(index_path)
+    files_path = index_files_dir(index_path, manifest)
+    vs = load_faiss_index(index_path, embeddings, manifest=manifest)
+    sparse = SparseIndex.load(files_path) if SparseIndex.exists(files_path) else None
+    return DocIndex(vs=vs, sparse=sparse, deleted=read_tombstones(files_path), params=manifest.get("index"))
@@ -1,4 +1,6 @@
 from __future__ import annotations
+from typing import Dict, List, Optional, Union
+
 from pydantic import BaseModel, Field
 
 class UploadResponse(BaseModel):
@@ -7,8 +9,24 @@ class UploadResponse(BaseModel):
     filename: str
     chunks: int
 
-class AskRequest(BaseModel):
+class JobStatus(BaseModel):
     doc_id: str
+    kind: str = "ingest"
+    status: str
+    stage: str = ""
+    pages_total: int = 0
+    pages_parsed: int = 0
+    chunks_total: int = 0
+    chunks_embedded: int = 0
+    eta_seconds: Optional[float] = None
+    error: str = ""
+    timings: Dict[str, float] = Field(default_factory=dict)
+
+class AskRequest(BaseModel):
+    doc_id: str = ""
+    doc_ids: Optional[Union[List[str], str]] = Field(
+        None, description='Search several documents: a list of doc_ids or "all"'
+    )
     session_id: str = "default"
     question: str
     top_k: int = 5
@@ -17,3 +35,32 @@ class AskRequest(BaseModel):
 class AskResponse(BaseModel):
     answer: str
     sources: list
+    prompt_tokens: int = 0
+
+class BatchQuestion(BaseModel):
+    question: str
+    doc_id: str = Field("", description="Overrides the batch doc_id for this question")
+    doc_ids: Optional[Union[List[str], str]] = Field(
+        None, description="Overrides the batch doc_ids for this question"
+    )
+
+class AskBatchRequest(BaseModel):
+    doc_id: str = ""
+    doc_ids: Optional[Union[List[str], str]] = Field(
+        None, description='Search several documents: a list of doc_ids or "all"'
+    )
+    questions: List[BatchQuestion]
+    top_k: int = 5
+    language: str = Field("bn", description="bn or en")
+
+class BatchAnswer(BaseModel):
+    index: int
+    status: str
+    answer: str = ""
+    sources: list = Field(default_factory=list)
+    error: str = ""
+    cache: str = "miss"
+    prompt_tokens: int = 0
+
+class AskBatchResponse(BaseModel):
+    results: List[BatchAnswer]
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+from array import array
+from collections import Counter
+import json
+from pathlib import Path
+import re
+import unicodedata
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+SPARSE_FILE = "sparse.npz"
+VOCAB_FILE = "sparse_vocab.json"
+
+# \w alone splits Bengali words at vowel signs and virama (they are marks,
+# not letters), so the whole Bengali block counts as word characters
+_TOKEN_RE = re.compile(r"[\w\u0980-\u09FF]+")
+
+
+def tokenize(text: str) -> List[str]:
+    text = unicodedata.normalize("NFC", text or "").casefold()
+    return [t for t in _TOKEN_RE.findall(text) if t.strip("_")]
+
+
+class SparseIndex:
+    # BM25 over a CSR postings layout: the postings of term t are
+    # doc_ids[indptr[t]:indptr[t + 1]] with matching term frequencies in tfs.
+    # Rows are chunk rows, so they line up with the FAISS index.
+    def __init__(
+        self,
+        vocab: Dict[str, int],
+        indptr: np.ndarray,
+        doc_ids: np.ndarray,
+        tfs: np.ndarray,
+        doc_len: np.ndarray,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+
+        n = len(doc_len)
+        df = np.diff(indptr).astype(np.float32)
+        self.idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        self.avgdl = float(doc_len.mean()) if n else 0.0
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.doc_len)
+
+    def nbytes(self) -> int:
+        arrays = sum(a.nbytes for a in (self.indptr, self.doc_ids, self.tfs, self.doc_len, self.idf))
+        # the vocabulary dict: key strings plus about 100 bytes of entry overhead
+        return arrays + sum(len(t) + 100 for t in self.vocab)
+
+    @classmethod
+    def build(cls, texts: Sequence[str]) -> "SparseIndex":
+        builder = SparseIndexBuilder()
+        builder.add(texts)
+        return builder.build()
+
+    def save(self, index_path: Path) -> None:
+        with open(index_path / SPARSE_FILE, "wb") as f:
+            np.savez(f, indptr=self.indptr, doc_ids=self.doc_ids, tfs=self.tfs, doc_len=self.doc_len)
+        with open(index_path / VOCAB_FILE, "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, index_path: Path) -> "SparseIndex":
+        with np.load(index_path / SPARSE_FILE) as data:
+            arrays = {k: data[k] for k in ("indptr", "doc_ids", "tfs", "doc_len")}
+        with open(index_path / VOCAB_FILE, "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        return cls(vocab, **arrays)
+
+    @staticmethod
+    def exists(index_path: Path) -> bool:
+        return (index_path / SPARSE_FILE).exists() and (index_path / VOCAB_FILE).exists()
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        tids = np.unique([self.vocab[t] for t in tokenize(query) if t in self.vocab]).astype(np.int64)
+        if not len(tids) or not self.n_docs:
+            return scores
+
+        # gather every matching posting at once: position j of the output
+        # walks term i's slice, i.e. starts[i] + (j - first output slot of i)
+        starts = self.indptr[tids]
+        lens = self.indptr[tids + 1] - starts
+        total = int(lens.sum())
+        slot0 = np.repeat(np.cumsum(lens) - lens, lens)
+        pos = np.repeat(starts, lens) + (np.arange(total) - slot0)
+
+        rows = self.doc_ids[pos]
+        tf = self.tfs[pos].astype(np.float32)
+        idf = np.repeat(self.idf[tids], lens)
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len[rows] / max(self.avgdl, 1e-6))
+        contrib = idf * tf * (self.k1 + 1) / (tf + norm)
+        return np.bincount(rows, weights=contrib, minlength=self.n_docs).astype(np.float32)
+
+    def search(self, query: str, k: int) -> List[int]:
+        scores = self.scores(query)
+        hits = np.flatnonzero(scores > 0)
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        return hits[np.argsort(-scores[hits], kind="stable")].tolist()
+
+
+class SparseIndexBuilder:
+    # Collects postings batch by batch as flat (term, row, tf) arrays, a few
+    # bytes per posting, and sorts them into the CSR layout in build().
+    def __init__(self):
+        self.vocab: Dict[str, int] = {}
+        self._terms = array("i")
+        self._rows = array("i")
+        self._tfs = array("H")
+        self._doc_len = array("i")
+
+    def add(self, texts: Sequence[str]) -> None:
+        for text in texts:
+            row = len(self._doc_len)
+            counts = Counter(tokenize(text))
+            self._doc_len.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self._terms.append(self.vocab.setdefault(term, len(self.vocab)))
+                self._rows.append(row)
+                self._tfs.append(min(tf, 65535))
+
+    def build(self) -> SparseIndex:
+        terms = np.frombuffer(self._terms, dtype=np.int32)
+        # stable, so each term's postings stay in row order
+        order = np.argsort(terms, kind="stable")
+        indptr = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(terms, minlength=len(self.vocab)))
+        doc_ids = np.frombuffer(self._rows, dtype=np.int32)[order]
+        tfs = np.frombuffer(self._tfs, dtype=np.uint16)[order]
+        doc_len = np.frombuffer(self._doc_len, dtype=np.int32).copy()
+        return SparseIndex(self.vocab, indptr, doc_ids, tfs, doc_len)
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60) -> List[int]:
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused, key=lambda r: -fused[r])
@@ -2,16 +2,45 @@ from __future__ import annotations
 
 from pathlib import Path
 import json
-from typing import Dict, Any
+import os
+import threading
+from typing import Dict, Any, List, Optional
 
+from app.catalog import CATALOG_FILE, Catalog
 from app.utils import ensure_dir
 
+_catalogs: Dict[Path, Catalog] = {}
+_catalogs_lock = threading.Lock()
+_doc_locks: Dict[Path, threading.Lock] = {}
+
+# Generation 0 of a document is its directory itself, as written by the
+# first ingest. Updates and compaction write a complete new set of index
+# files into gen-<n> and then point the manifest at it, so a reader that
+# resolved the old generation keeps a consistent set of files.
+GENERATION_PREFIX = "gen-"
+
+
+def get_catalog(index_root: Path) -> Catalog:
+    # one catalog per index root, kept next to the document directories
+    key = index_root.resolve()
+    with _catalogs_lock:
+        if key not in _catalogs:
+            ensure_dir(index_root)
+            _catalogs[key] = Catalog(index_root / CATALOG_FILE)
+        return _catalogs[key]
+
 
 def write_manifest(index_dir: Path, manifest: Dict[str, Any]) -> None:
     ensure_dir(index_dir)
     path = index_dir / "manifest.json"
-    with open(path, "w", encoding="utf-8") as f:
+    tmp = index_dir / f".manifest.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(manifest, f, ensure_ascii=False, indent=2)
+    # manifests are rewritten by background ingest workers while /documents
+    # reads them, so replace the file atomically
+    os.replace(tmp, path)
+    if manifest.get("doc_id"):
+        get_catalog(index_dir.parent).upsert(manifest)
 
 
 def read_manifest(index_dir: Path) -> Dict[str, Any]:
@@ -20,3 +49,43 @@ def read_manifest(index_dir: Path) -> Dict[str, Any]:
         return {}
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
+
+
+def generation_dir(index_dir: Path, generation: int) -> Path:
+    return index_dir if generation <= 0 else index_dir / f"{GENERATION_PREFIX}{generation}"
+
+
+def index_files_dir(index_dir: Path, manifest: Optional[Dict[str, Any]] = None) -> Path:
+    # where the index files of the current generation are
+    if manifest is None:
+        manifest = read_manifest(index_dir)
+    return generation_dir(index_dir, int(manifest.get("generation", 0) or 0))
+
+
+def index_files(files_dir: Path) -> List[Path]:
+    # the files of one generation; manifest.json and reports are not among them
+    patterns = ("index.*", "chunks.*", "sparse*", "tombstones.*", "rowids.*")
+    return [p for pattern in patterns for p in files_dir.glob(pattern) if p.is_file()]
+
+
+def doc_lock(index_dir: Path) -> threading.Lock:
+    # serializes the writers of one document (update, compaction, delete)
+    # within this process
+    key = index_dir.resolve()
+    with _catalogs_lock:
+        return _doc_locks.setdefault(key, threading.Lock())
+
+
+class ContentHashIndex:
+    # sha256 lookups go to the catalog's hash index instead of a dict
+    # rebuilt from every manifest at startup. Failed documents never match,
+    # so a re-upload after a failure is indexed again.
+    def __init__(self, catalog: Catalog):
+        self.catalog = catalog
+        self.hits = 0
+
+    def find(self, sha256: str) -> Optional[Dict[str, Any]]:
+        existing = self.catalog.find_by_hash(sha256)
+        if existing is not None:
+            self.hits += 1
+        return existing
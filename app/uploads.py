@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+import hashlib
+import os
+from pathlib import Path
+import tempfile
+from typing import List, Optional
+
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
+
+CHUNK_SIZE = 1024 * 1024
+# the PDF header may follow a little junk, readers look at the first 1 KB
+MAGIC_WINDOW = 1024
+# boundaries and part headers on top of the file itself
+MULTIPART_SLACK = 64 * 1024
+
+
+@dataclass
+class ReceivedUpload:
+    filename: str
+    tmp_path: Path
+    size: int
+    sha256: str
+
+
+@dataclass
+class _PartState:
+    field_name: str
+    headers: dict = field(default_factory=dict)
+    header_field: bytes = b""
+    header_value: bytes = b""
+    name: Optional[str] = None
+    filename: Optional[str] = None
+    in_file: bool = False
+    done: bool = False
+    pending: List[bytes] = field(default_factory=list)
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self.header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field, self.header_value = b"", b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self.headers.get(b"content-disposition", b""))
+        self.name = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename")
+        self.in_file = not self.done and self.name == self.field_name and filename is not None
+        if self.in_file:
+            self.filename = filename.decode("utf-8", "replace")
+        self.headers = {}
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self.in_file:
+            self.pending.append(data[start:end])
+
+    def on_part_end(self) -> None:
+        if self.in_file:
+            self.in_file = False
+            self.done = True
+
+
+def _too_large(max_upload_mb: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"File too large. Max {max_upload_mb} MB")
+
+
+async def receive_pdf_upload(request: Request, tmp_dir: Path, max_upload_mb: int, field_name: str = "file") -> ReceivedUpload:
+    # Streams a multipart/form-data body to a temp file in tmp_dir, hashing
+    # as it goes, so memory per upload stays at about CHUNK_SIZE whatever the
+    # file size. Oversized or non-PDF uploads are refused as soon as that is
+    # known, without reading the rest of the body.
+    max_bytes = max_upload_mb * 1024 * 1024
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes + MULTIPART_SLACK:
+        raise _too_large(max_upload_mb)
+
+    state = _PartState(field_name=field_name)
+    parser = MultipartParser(
+        boundary,
+        {
+            "on_header_field": state.on_header_field,
+            "on_header_value": state.on_header_value,
+            "on_header_end": state.on_header_end,
+            "on_headers_finished": state.on_headers_finished,
+            "on_part_data": state.on_part_data,
+            "on_part_end": state.on_part_end,
+        },
+    )
+
+    digest = hashlib.sha256()
+    fd, tmp_name = tempfile.mkstemp(dir=tmp_dir, prefix=".upload.", suffix=".part")
+    tmp_path = Path(tmp_name)
+    size = 0
+    head = b""
+    buffered: List[bytes] = []
+    buffered_bytes = 0
+
+    def flush(parts: List[bytes]) -> None:
+        for p in parts:
+            digest.update(p)
+            os.write(fd, p)
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if state.filename is not None and not state.filename.lower().endswith(".pdf"):
+                raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+            if not state.pending:
+                continue
+
+            for data in state.pending:
+                size += len(data)
+                if len(head) < MAGIC_WINDOW:
+                    head += data[:MAGIC_WINDOW - len(head)]
+            buffered += state.pending
+            buffered_bytes += sum(len(d) for d in state.pending)
+            state.pending = []
+
+            if size > max_bytes:
+                raise _too_large(max_upload_mb)
+            if len(head) >= MAGIC_WINDOW and b"%PDF-" not in head:
+                raise HTTPException(status_code=400, detail="File is not a PDF")
+            if buffered_bytes >= CHUNK_SIZE:
+                await run_in_threadpool(flush, buffered)
+                buffered, buffered_bytes = [], 0
+
+        parser.finalize()
+        if state.filename is None:
+            raise HTTPException(status_code=400, detail="Missing file")
+        if b"%PDF-" not in head:
+            raise HTTPException(status_code=400, detail="File is not a PDF")
+        await run_in_threadpool(flush, buffered)
+        os.close(fd)
+        fd = -1
+    except BaseException:
+        if fd != -1:
+            os.close(fd)
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    return ReceivedUpload(filename=state.filename, tmp_path=tmp_path, size=size, sha256=digest.hexdigest())
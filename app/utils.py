@@ -1,6 +1,8 @@
 from __future__ import annotations
 
+import fcntl
 from pathlib import Path
+import math
 import re
 import uuid
 
@@ -18,3 +20,48 @@ def safe_filename(name: str) -> str:
 
 def ensure_dir(p: Path) -> None:
     p.mkdir(parents=True, exist_ok=True)
+
+
+class FileLock:
+    # exclusive flock on path, for files that several uvicorn workers write.
+    # Locks taken through separate FileLocks exclude each other in the same
+    # process too, and are dropped by the OS if the process dies.
+    def __init__(self, path: Path):
+        self.path = path
+        self._f = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        f = open(self.path, "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return False
+        self._f = f
+        return True
+
+    def release(self) -> None:
+        if self._f is not None:
+            fcntl.flock(self._f, fcntl.LOCK_UN)
+            self._f.close()
+            self._f = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+_BENGALI_RE = re.compile(r"[\u0980-\u09FF]")
+
+
+def estimate_tokens(text: str) -> int:
+    # rough count without the model tokenizer: about 4 characters per token
+    # for Latin text, while Bengali script splits into far more pieces
+    if not text:
+        return 0
+    bengali = len(_BENGALI_RE.findall(text))
+    other = len(text) - bengali
+    return math.ceil(other / 4 + bengali / 2)
@@ -1,8 +1,34 @@
 from __future__ import annotations
 
+import logging
 from pathlib import Path
+import threading
+import time
+from typing import Any, Callable, Collection, Dict, Iterable, Iterator, List, Optional
 
+import faiss
 from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+import numpy as np
+
+from app.ann import AnnSettings, apply_search_params, build_index, finish_index, live_vectors, recall_report
+from app.compact_store import (
+    INDEX_FILE,
+    ChunkWriter,
+    CompactDocstore,
+    is_compact,
+    load_compact,
+    load_legacy,
+    read_rowids,
+    read_tombstones,
+    write_faiss_index,
+    write_rowids,
+    write_tombstones,
+)
+from app.embedding_service import BatchingEmbeddings, BatchSettings
+from app.metrics import stage_timer
+from app.sparse import SparseIndexBuilder
+from app.storage import index_files_dir, read_manifest
 
 try:
     from langchain_huggingface import HuggingFaceEmbeddings
@@ -10,16 +36,292 @@ except Exception:
     from langchain_community.embeddings import HuggingFaceEmbeddings
 
 
-def build_embeddings() -> HuggingFaceEmbeddings:
-    return HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+_shared: Optional[Embeddings] = None
+_shared_lock = threading.Lock()
+# seconds the shared model took to load, once it has
+load_seconds: Optional[float] = None
+
+logger = logging.getLogger("pdf_insight_assistant")
+
+
+class SharedEmbeddings(Embeddings):
+    # HF fast tokenizers raise "Already borrowed" when one instance is used
+    # from several threads at once, so calls into the model are serialized.
+    def __init__(self, base: Embeddings, model_name: str):
+        self.base = base
+        self.model_name = model_name
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            return self.base.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._lock:
+            return self.base.embed_query(text)
+
+
+EMBEDDING_BACKENDS = ("torch", "int8", "onnx")
+
+
+def _quantize_int8(embeddings: HuggingFaceEmbeddings) -> None:
+    # dynamic int8 quantization of the Linear layers: weights are stored as
+    # int8 and activations quantized per call. Needs nothing beyond torch.
+    import torch
+
+    attr = "_client" if hasattr(embeddings, "_client") else "client"
+    model = getattr(embeddings, attr)
+    torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def build_embeddings(model_name: str = DEFAULT_EMBEDDING_MODEL, backend: str = "torch", onnx_file: str = "") -> HuggingFaceEmbeddings:
+    # backend: "torch" (fp32), "int8" (torch dynamic quantization) or "onnx"
+    # (ONNX Runtime through sentence-transformers; onnx_file picks an export
+    # in the model repo, e.g. a quantized onnx/model_qint8_avx512_vnni.onnx).
+    # Compare a backend against fp32 with benchmarks/embedding_parity.py.
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+    if backend != "onnx":
+        embeddings = HuggingFaceEmbeddings(model_name=model_name)
+        if backend == "int8":
+            _quantize_int8(embeddings)
+        return embeddings
+
+    import importlib.util
+
+    if importlib.util.find_spec("onnxruntime") is None or importlib.util.find_spec("optimum") is None:
+        raise RuntimeError('The onnx embedding backend needs optimum and onnxruntime: pip install "optimum[onnxruntime]"')
+    model_kwargs: Dict[str, Any] = {"backend": "onnx"}
+    if onnx_file:
+        model_kwargs["model_kwargs"] = {"file_name": onnx_file}
+    return HuggingFaceEmbeddings(model_name=model_name, model_kwargs=model_kwargs)
+
+
+def get_embeddings(
+    model_name: str = DEFAULT_EMBEDDING_MODEL,
+    warmup: bool = False,
+    backend: str = "torch",
+    onnx_file: str = "",
+    batching: Optional[BatchSettings] = None,
+) -> Embeddings:
+    # one model per process; the first call decides how it is built. With
+    # batching, calls from all threads are run as micro-batches, see
+    # app.embedding_service.
+    global _shared, load_seconds
+    if _shared is not None:
+        return _shared
+
+    with _shared_lock:
+        if _shared is None:
+            t0 = time.perf_counter()
+            shared: Embeddings = SharedEmbeddings(build_embeddings(model_name, backend, onnx_file), model_name)
+            if warmup:
+                shared.embed_query("warmup")
+            if batching is not None:
+                shared = BatchingEmbeddings(shared, batching)
+            load_seconds = round(time.perf_counter() - t0, 3)
+            logger.info(
+                f"Embedding model loaded | model={model_name} backend={backend} warmup={warmup} seconds={load_seconds}"
+            )
+            _shared = shared
+    return _shared
+
+
+def embeddings_from_config(cfg, warmup: bool = False) -> Embeddings:
+    batching = None
+    if cfg.embedding_batching:
+        batching = BatchSettings(max_batch_size=cfg.embedding_batch_max_size, max_wait_ms=cfg.embedding_batch_max_wait_ms)
+    return get_embeddings(
+        cfg.embedding_model,
+        warmup=warmup,
+        backend=cfg.embedding_backend,
+        onnx_file=cfg.embedding_onnx_file,
+        batching=batching,
+    )
+
+
+def _batched(docs: Iterable, batch_size: int) -> Iterator[list]:
+    batch = []
+    for d in docs:
+        batch.append(d)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def build_faiss_index(
+    docs: Iterable,
+    index_path: Path,
+    embeddings: Optional[Embeddings] = None,
+    batch_size: int = 64,
+    on_progress: Optional[Callable[[int], None]] = None,
+    on_batch: Optional[Callable[[list, List[List[float]]], None]] = None,
+    ann: AnnSettings = AnnSettings(),
+) -> Dict[str, Any]:
+    # docs may be a generator: each batch is embedded, added to a flat index
+    # and written to the chunk store and BM25 postings as it arrives, so only
+    # the float32 vectors are held for the whole document
+    embeddings = embeddings or get_embeddings()
+    chunks = ChunkWriter(index_path)
+    sparse = SparseIndexBuilder()
+    flat = None
+    try:
+        for batch in _batched(docs, batch_size):
+            with stage_timer("embed_batch"):
+                batch_vectors = embeddings.embed_documents([d.page_content for d in batch])
+            vectors = np.asarray(batch_vectors, dtype=np.float32)
+            if flat is None:
+                flat = faiss.IndexFlatL2(vectors.shape[1])
+            flat.add(vectors)
+            chunks.add(batch)
+            sparse.add([d.page_content for d in batch])
+
+            if on_batch:
+                on_batch(batch, batch_vectors)
+            if on_progress:
+                on_progress(len(chunks))
+
+        if flat is None:
+            raise ValueError("No text could be extracted from the PDF")
+
+        # the index type is picked from the chunk count, see app.ann
+        with stage_timer("index_build"):
+            index, params = finish_index(flat, ann)
+            if params["type"] != "flat":
+                params.update(recall_report(index, flat.reconstruct_n(0, flat.ntotal), seed=ann.seed))
+    except BaseException:
+        chunks.abort()
+        raise
+
+    with stage_timer("index_write"):
+        chunks.close()
+        write_faiss_index(index_path, index)
+        # BM25 postings over the same rows, for hybrid retrieval
+        sparse.build().save(index_path)
+    return params
+
+
+def _write_sparse(store_path: Path, deleted: Collection[int]) -> None:
+    # BM25 is rebuilt from the chunk store, tombstoned rows as empty text so
+    # rows stay aligned with the FAISS index; no embedding is needed
+    store = CompactDocstore(store_path)
+    sparse = SparseIndexBuilder()
+    for row in range(len(store)):
+        sparse.add(["" if row in deleted else store.get(row).page_content])
+    sparse.build().save(store_path)
+
+
+def update_faiss_index(
+    base_path: Path,
+    index_path: Path,
+    docs: Iterable,
+    remove_rows: Collection[int],
+    params: Dict[str, Any],
+    first_serial: int,
+    embeddings: Optional[Embeddings] = None,
+    batch_size: int = 64,
+    on_progress: Optional[Callable[[int], None]] = None,
+    on_batch: Optional[Callable[[list, List[List[float]]], None]] = None,
+) -> Dict[str, Any]:
+    # Writes a new generation into index_path: the index and chunks of
+    # base_path, plus docs embedded and added as rows at the end (numbered
+    # from first_serial), with remove_rows tombstoned. Only docs are
+    # embedded. remove_rows is read once docs is exhausted, so a docs
+    # generator may still fill it.
+    embeddings = embeddings or get_embeddings()
+    index = faiss.read_index(str(base_path / INDEX_FILE))
+    n_base = index.ntotal
+    chunks = ChunkWriter(index_path)
+    added = 0
+    try:
+        with stage_timer("index_update"):
+            chunks.copy_from(base_path)
+            for batch in _batched(docs, batch_size):
+                with stage_timer("embed_batch"):
+                    batch_vectors = embeddings.embed_documents([d.page_content for d in batch])
+                index.add(np.asarray(batch_vectors, dtype=np.float32))
+                chunks.add(batch)
+                added += len(batch)
+
+                if on_batch:
+                    on_batch(batch, batch_vectors)
+                if on_progress:
+                    on_progress(added)
+    except BaseException:
+        chunks.abort()
+        raise
+
+    deleted = np.union1d(read_tombstones(base_path), np.fromiter(remove_rows, dtype=np.int64))
+    rowids = np.concatenate([read_rowids(base_path, n_base), np.arange(first_serial, first_serial + added, dtype=np.int64)])
+    with stage_timer("index_write"):
+        chunks.close()
+        write_faiss_index(index_path, index)
+        write_rowids(index_path, rowids)
+        if len(deleted):
+            write_tombstones(index_path, deleted)
+        _write_sparse(index_path, set(deleted.tolist()))
+    return {**params, "ntotal": int(index.ntotal), "dim": int(index.d)}
+
+
+def compact_faiss_index(
+    base_path: Path,
+    index_path: Path,
+    params: Dict[str, Any],
+    embeddings: Optional[Embeddings] = None,
+    ann: AnnSettings = AnnSettings(),
+) -> Dict[str, Any]:
+    # Writes a new generation into index_path with the tombstoned rows of
+    # base_path dropped. Stored vectors are reused where the index keeps
+    # them; IVF-PQ chunks are embedded again. The index type is picked again
+    # for the new size. Row serials are kept, so corpus ids stay valid.
+    index = faiss.read_index(str(base_path / INDEX_FILE))
+    live = np.setdiff1d(np.arange(index.ntotal, dtype=np.int64), read_tombstones(base_path))
+    if not len(live):
+        raise ValueError("Every chunk of this document is deleted")
 
+    with stage_timer("compaction"):
+        vectors = live_vectors(index, params, live)
+        if vectors is None:
+            store = CompactDocstore(base_path)
+            embeddings = embeddings or get_embeddings()
+            vectors = np.asarray(embeddings.embed_documents([store.get(int(r)).page_content for r in live]), dtype=np.float32)
+        new_index, new_params = build_index(vectors, ann)
+        if new_params["type"] != "flat":
+            new_params.update(recall_report(new_index, vectors, seed=ann.seed))
 
-def build_faiss_index(docs, index_path: Path) -> None:
-    embeddings = build_embeddings()
-    vs = FAISS.from_documents(docs, embeddings)
-    vs.save_local(str(index_path))
+    chunks = ChunkWriter(index_path)
+    try:
+        chunks.copy_from(base_path, live)
+    except BaseException:
+        chunks.abort()
+        raise
+    with stage_timer("index_write"):
+        chunks.close()
+        write_faiss_index(index_path, new_index)
+        write_rowids(index_path, read_rowids(base_path, index.ntotal)[live])
+        _write_sparse(index_path, ())
+    return new_params
 
 
-def load_faiss_index(index_path: Path) -> FAISS:
-    embeddings = build_embeddings()
-    return FAISS.load_local(str(index_path), embeddings, allow_dangerous_deserialization=True)
+def load_faiss_index(
+    index_path: Path,
+    embeddings: Optional[Embeddings] = None,
+    mutable: bool = False,
+    manifest: Optional[Dict[str, Any]] = None,
+) -> FAISS:
+    # index_path is the document directory; the files are read from its
+    # current generation
+    embeddings = embeddings or get_embeddings()
+    manifest = read_manifest(index_path) if manifest is None else manifest
+    files_path = index_files_dir(index_path, manifest)
+    with stage_timer("index_load"):
+        if is_compact(files_path):
+            vs = load_compact(files_path, embeddings, mutable=mutable)
+            apply_search_params(vs.index, manifest.get("index"))
+            return vs
+        # pickle-based index from before the compact format, see app.compact_store
+        return load_legacy(files_path, embeddings)
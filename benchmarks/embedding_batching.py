@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+# Query embedding under concurrent load, with and without micro-batching.
+#
+#   python -m benchmarks.embedding_batching
+#   python -m benchmarks.embedding_batching --concurrency 1,8,32 --max-wait-ms 2
+#   python -m benchmarks.embedding_batching --model sentence-transformers/all-MiniLM-L6-v2 --backend int8
+#
+# Threads call embed_query the way /ask request threads do. Without --model
+# a fake model stands in whose calls cost --call-ms plus --text-ms per text,
+# like a small transformer on CPU. Reports queries per second, latency and
+# texts per model call, and exits non-zero when batching is slower than
+# direct calls at the highest concurrency.
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.embedding_service import BatchingEmbeddings, BatchSettings
+from app.vectorstore import SharedEmbeddings, build_embeddings
+from benchmarks.fakes import CountingEmbeddings, FakeEmbeddings
+from benchmarks.run import make_questions
+
+
+def _run(embeddings: Embeddings, questions: List[str], concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+
+    def one(q: str) -> None:
+        t0 = time.perf_counter()
+        embeddings.embed_query(q)
+        latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, questions))
+    seconds = time.perf_counter() - t0
+    ms = np.asarray(latencies) * 1000
+    return {
+        "qps": round(len(questions) / seconds, 1),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Query embedding throughput with and without micro-batching")
+    parser.add_argument("--model", default="", help="a sentence-transformers model instead of the fake one")
+    parser.add_argument("--backend", default="torch", choices=["torch", "int8", "onnx"])
+    parser.add_argument("--call-ms", type=float, default=4.0, help="fixed cost per call of the fake model")
+    parser.add_argument("--text-ms", type=float, default=0.3, help="cost per text of the fake model")
+    parser.add_argument("--concurrency", default="1,4,16,64")
+    parser.add_argument("--queries", type=int, default=400)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    if args.model:
+        model = CountingEmbeddings(build_embeddings(args.model, args.backend))
+    else:
+        model = CountingEmbeddings(FakeEmbeddings(), args.call_ms, args.text_ms)
+    questions = make_questions(args.queries, 1234)
+    settings = BatchSettings(max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+
+    rows = []
+    for concurrency in (int(c) for c in args.concurrency.split(",")):
+        for mode in ("direct", "batched"):
+            shared = SharedEmbeddings(model, args.model or "fake")
+            embeddings = BatchingEmbeddings(shared, settings) if mode == "batched" else shared
+            calls, texts = model.calls, model.texts
+            row = {"concurrency": concurrency, "mode": mode, **_run(embeddings, questions, concurrency)}
+            row["texts_per_call"] = round((model.texts - texts) / max(1, model.calls - calls), 2)
+            if isinstance(embeddings, BatchingEmbeddings):
+                embeddings.close()
+            rows.append(row)
+
+    cols = list(rows[0])
+    print("  ".join(f"{c:>14s}" for c in cols))
+    for row in rows:
+        print("  ".join(f"{str(row[c]):>14s}" for c in cols))
+
+    top = [r for r in rows if r["concurrency"] == rows[-1]["concurrency"]]
+    direct, batched = (next(r for r in top if r["mode"] == m) for m in ("direct", "batched"))
+    if batched["qps"] < direct["qps"]:
+        raise SystemExit(f"Batching check failed: {batched['qps']} qps batched, {direct['qps']} qps direct")
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
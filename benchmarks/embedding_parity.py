@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+# Parity of a CPU embedding backend with the fp32 PyTorch model.
+#
+#   python -m benchmarks.embedding_parity --backend int8
+#   python -m benchmarks.embedding_parity --backend onnx
+#   python -m benchmarks.embedding_parity --backend onnx --onnx-file onnx/model_qint8_avx512_vnni.onnx
+#
+# Embeds the same English and Bengali chunks and questions with both models
+# and reports the cosine similarity of each pair of vectors, whether
+# questions still retrieve the same chunks (top-k overlap against fp32) and
+# the throughput of each backend. Exits non-zero below --min-cosine or
+# --min-overlap. Needs the model (downloaded on first use) and, for onnx,
+# optimum[onnxruntime]. tests/test_embedding_parity.py runs a smaller
+# version when the model is already downloaded.
+
+import argparse
+import random
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from app.vectorstore import DEFAULT_EMBEDDING_MODEL, build_embeddings
+from benchmarks.run import make_questions
+from benchmarks.synthetic_pdf import page_lines
+
+
+def _texts(n_chunks: int, seed: int) -> List[str]:
+    # chunk-sized texts: a few synthetic lines each, half Bengali
+    rng = random.Random(seed)
+    chunks = []
+    for page in range(n_chunks):
+        lines = page_lines(page, 0.5, rng)
+        chunks.append(" ".join(lines[: rng.randint(4, 12)]))
+    return chunks
+
+
+def _embed(embeddings, texts: List[str], batch_size: int) -> tuple:
+    embeddings.embed_documents(texts[:batch_size])  # warm up
+    t0 = time.perf_counter()
+    vectors = []
+    for i in range(0, len(texts), batch_size):
+        vectors.extend(embeddings.embed_documents(texts[i:i + batch_size]))
+    seconds = time.perf_counter() - t0
+    return np.asarray(vectors, dtype=np.float32), len(texts) / seconds
+
+
+def _normalize(v: np.ndarray) -> np.ndarray:
+    return v / np.maximum(np.linalg.norm(v, axis=1, keepdims=True), 1e-12)
+
+
+def _top_k(queries: np.ndarray, chunks: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(-_normalize(queries) @ _normalize(chunks).T, axis=1)[:, :k]
+
+
+def compare_backends(
+    model: str,
+    backend: str,
+    onnx_file: str = "",
+    n_chunks: int = 500,
+    n_questions: int = 100,
+    batch_size: int = 32,
+    k: int = 10,
+    seed: int = 1234,
+) -> Dict[str, Dict[str, float]]:
+    # throughput of both models and, for the candidate, cosine and top-k overlap
+    chunks = _texts(n_chunks, seed)
+    questions = make_questions(n_questions, seed)
+
+    report: Dict[str, Dict[str, float]] = {}
+    vectors: Dict[str, tuple] = {}
+    for name, kind in (("fp32", "torch"), (backend, backend)):
+        embeddings = build_embeddings(model, kind, onnx_file if kind == "onnx" else "")
+        chunk_vectors, chunks_per_s = _embed(embeddings, chunks, batch_size)
+        question_vectors, _ = _embed(embeddings, questions, batch_size)
+        vectors[name] = (chunk_vectors, question_vectors)
+        report[name] = {"chunks_per_s": round(chunks_per_s, 1)}
+
+    base_chunks, base_questions = vectors["fp32"]
+    cand_chunks, cand_questions = vectors[backend]
+    cosine = np.sum(
+        _normalize(np.vstack([base_chunks, base_questions])) * _normalize(np.vstack([cand_chunks, cand_questions])),
+        axis=1,
+    )
+    truth = _top_k(base_questions, base_chunks, k)
+    # questions embedded by the candidate against chunks embedded by fp32:
+    # an index built before switching backends keeps working
+    mixed = _top_k(cand_questions, base_chunks, k)
+    found = _top_k(cand_questions, cand_chunks, k)
+
+    def overlap(a: np.ndarray, b: np.ndarray) -> float:
+        return float(np.mean([len(set(x) & set(y)) / k for x, y in zip(a, b)]))
+
+    report[backend].update(
+        cosine_min=round(float(cosine.min()), 5),
+        cosine_mean=round(float(cosine.mean()), 5),
+        overlap_at_k=round(overlap(truth, found), 4),
+        overlap_at_k_mixed=round(overlap(truth, mixed), 4),
+        speedup=round(report[backend]["chunks_per_s"] / report["fp32"]["chunks_per_s"], 2),
+    )
+    return report
+
+
+def parity_failures(row: Dict[str, float], min_cosine: float, min_overlap: float, k: int) -> List[str]:
+    failures = []
+    if row["cosine_min"] < min_cosine:
+        failures.append(f"lowest cosine {row['cosine_min']} is below {min_cosine}")
+    if min(row["overlap_at_k"], row["overlap_at_k_mixed"]) < min_overlap:
+        failures.append(f"top-{k} overlap is below {min_overlap}")
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare an embedding backend with the fp32 model")
+    parser.add_argument("--model", default=DEFAULT_EMBEDDING_MODEL)
+    parser.add_argument("--backend", choices=["int8", "onnx"], default="int8")
+    parser.add_argument("--onnx-file", default="", help="ONNX export in the model repo, e.g. a quantized one")
+    parser.add_argument("--chunks", type=int, default=500)
+    parser.add_argument("--questions", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--min-cosine", type=float, default=0.98, help="lowest cosine allowed for any text")
+    parser.add_argument("--min-overlap", type=float, default=0.9, help="lowest mean top-k overlap with fp32")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    report = compare_backends(
+        args.model, args.backend, args.onnx_file, args.chunks, args.questions, args.batch_size, args.k, args.seed
+    )
+    for name, row in report.items():
+        print(f"{name:6s} " + " ".join(f"{k}={v}" for k, v in row.items()))
+
+    failures = parity_failures(report[args.backend], args.min_cosine, args.min_overlap, args.k)
+    if failures:
+        raise SystemExit("Parity check failed: " + "; ".join(failures))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
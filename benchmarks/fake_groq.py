@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+# A local stand-in for the Groq (OpenAI compatible) chat completions API.
+#
+#   python -m benchmarks.fake_groq --port 8901
+#   python -m benchmarks.fake_groq --model llama-3.1-8b-instant:first_token_ms=1500
+#   python -m benchmarks.fake_groq --model llama-3.1-8b-instant:error_rate=1
+#
+# Point the app at it with GROQ_BASE_URL=http://127.0.0.1:8901. Every model
+# answers with the same canned text (repeated to answer_words if set),
+# streamed a word every token_ms after an injectable first-token delay; a
+# share of calls can fail with an HTTP error instead. Behaviour can be changed while running:
+#
+#   curl -X POST localhost:8901/control -d '{"model":"*","first_token_ms":50}'
+#   curl localhost:8901/stats
+#
+# Calls whose client hung up before the answer finished (a cancelled hedge,
+# for example) are counted as "disconnected" in the stats.
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+ANSWER = (
+    "The report covers quarterly revenue, costs and audit results. "
+    "Revenue grew by 12 percent while operating costs fell. "
+    "The audit found only minor issues."
+)
+
+
+@dataclass(frozen=True)
+class Behaviour:
+    first_token_ms: float = 50.0
+    token_ms: float = 2.0
+    # uniform jitter added to the first-token delay, in ms
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 500
+    # answer length in words; 0 is the canned answer as is
+    answer_words: int = 0
+
+
+class FakeGroq:
+    def __init__(self, default: Optional[Behaviour] = None, seed: int = 0):
+        self.default = default or Behaviour()
+        self.models: Dict[str, Behaviour] = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def behaviour(self, model: str) -> Behaviour:
+        with self._lock:
+            return self.models.get(model, self.default)
+
+    def configure(self, model: str = "*", **changes: Any) -> None:
+        with self._lock:
+            if model == "*":
+                self.default = replace(self.default, **changes)
+                self.models = {name: replace(b, **changes) for name, b in self.models.items()}
+            else:
+                self.models[model] = replace(self.models.get(model, self.default), **changes)
+
+    def count(self, model: str, key: str) -> None:
+        with self._lock:
+            row = self.stats.setdefault(model, {"requests": 0, "ok": 0, "errors": 0, "disconnected": 0})
+            row[key] += 1
+
+    def roll(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+
+def _chunk(cid: str, model: str, delta: Dict[str, Any], finish: Optional[str] = None) -> bytes:
+    body = {
+        "id": cid,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish, "logprobs": None}],
+    }
+    return f"data: {json.dumps(body)}\n\n".encode("utf-8")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake: FakeGroq
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _json(self, status: int, body: Any) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self) -> None:
+        if self.path == "/stats":
+            with self.fake._lock:
+                self._json(200, {"stats": self.fake.stats, "default": asdict(self.fake.default),
+                                 "models": {k: asdict(v) for k, v in self.fake.models.items()}})
+        else:
+            self._json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self) -> None:
+        if self.path == "/control":
+            body = self._body()
+            self.fake.configure(body.pop("model", "*"), **body)
+            self._json(200, {"ok": True})
+        elif self.path.rstrip("/").endswith("/chat/completions"):
+            self._completion(self._body())
+        else:
+            self._json(404, {"error": {"message": "not found"}})
+
+    def _completion(self, request: Dict[str, Any]) -> None:
+        model = request.get("model", "")
+        b = self.fake.behaviour(model)
+        self.fake.count(model, "requests")
+
+        delay = b.first_token_ms + (self.fake.roll() * b.jitter_ms if b.jitter_ms else 0.0)
+        if b.error_rate and self.fake.roll() < b.error_rate:
+            time.sleep(delay / 1000)
+            self.fake.count(model, "errors")
+            self._json(b.error_status, {"error": {"message": "injected failure", "type": "internal_server_error"}})
+            return
+
+        cid = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        words = ANSWER.split(" ")
+        if b.answer_words:
+            words = (words * (b.answer_words // len(words) + 1))[: b.answer_words]
+        if not request.get("stream"):
+            time.sleep((delay + b.token_ms * len(words)) / 1000)
+            self.fake.count(model, "ok")
+            self._json(200, {
+                "id": cid,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)},
+                             "finish_reason": "stop", "logprobs": None}],
+                "usage": {"prompt_tokens": 100, "completion_tokens": len(words), "total_tokens": 100 + len(words)},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            # like Groq, the role-only chunk comes right away and the first
+            # word after first_token_ms
+            self.wfile.write(_chunk(cid, model, {"role": "assistant", "content": ""}))
+            self.wfile.flush()
+            time.sleep(delay / 1000)
+            for i, word in enumerate(words):
+                if i:
+                    time.sleep(b.token_ms / 1000)
+                self.wfile.write(_chunk(cid, model, {"content": word if i == 0 else " " + word}))
+                self.wfile.flush()
+            self.wfile.write(_chunk(cid, model, {}, finish="stop"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self.fake.count(model, "disconnected")
+            return
+        self.fake.count(model, "ok")
+
+
+class FakeGroqServer:
+    # runs the fake API on a background thread; port 0 picks a free port
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, fake: Optional[FakeGroq] = None):
+        self.fake = fake or FakeGroq()
+        handler = type("Handler", (_Handler,), {"fake": self.fake})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeGroqServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-groq", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "FakeGroqServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+
+def _parse_model(spec: str) -> tuple:
+    # "name:first_token_ms=800,error_rate=0.2"
+    name, _, opts = spec.partition(":")
+    changes = {}
+    for item in filter(None, opts.split(",")):
+        key, _, value = item.partition("=")
+        changes[key.strip()] = int(value) if key.strip() in {"error_status", "answer_words"} else float(value)
+    return name, changes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake Groq chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--first-token-ms", type=float, default=50.0)
+    parser.add_argument("--token-ms", type=float, default=2.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--answer-words", type=int, default=0, help="answer length (default: the canned answer)")
+    parser.add_argument("--model", action="append", default=[], help="NAME:key=value,... per model override")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    behaviour = Behaviour(args.first_token_ms, args.token_ms, args.jitter_ms, args.error_rate, answer_words=args.answer_words)
+    fake = FakeGroq(behaviour, seed=args.seed)
+    for spec in args.model:
+        name, changes = _parse_model(spec)
+        fake.configure(name, **changes)
+
+    server = FakeGroqServer(args.host, args.port, fake)
+    print(f"Fake Groq API at {server.url}", flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
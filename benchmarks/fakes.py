@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+
+class FakeEmbeddings(Embeddings):
+    # Deterministic unit vectors seeded by the text hash, so identical text
+    # always gets the same vector and runs are repeatable without a model
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        v = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return (v / np.linalg.norm(v)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+
+class CountingEmbeddings(Embeddings):
+    # counts model calls; with call_ms / text_ms it also costs what a
+    # model call would (sleep releases the GIL, as torch inference does)
+    def __init__(self, base: Embeddings, call_ms: float = 0.0, text_ms: float = 0.0):
+        self.base = base
+        self.call_ms = call_ms
+        self.text_ms = text_ms
+        self.calls = 0
+        self.texts = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            self.calls += 1
+            self.texts += len(texts)
+        if self.call_ms or self.text_ms:
+            time.sleep((self.call_ms + self.text_ms * len(texts)) / 1000)
+        return self.base.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+# a typical model answer, including the repeated lines and extra bullets
+# clean_repetition exists to remove
+FAKE_ANSWER = (
+    "The report covers quarterly revenue, costs and audit results.\n"
+    "Revenue grew while operating costs fell.\n"
+    "- Revenue grew by 12 percent.\n"
+    "- Revenue grew by 12 percent.\n"
+    "- The board approved a new distribution centre.\n"
+    "- Customer satisfaction improved.\n"
+    "- The audit found only minor issues.\n"
+    "- Server migration reduced costs.\n"
+    "- Sales rose in Dhaka and Chattogram.\n"
+    "- Invoices were settled within thirty days.\n"
+    "Revenue grew while operating costs fell.\n"
+)
+
+
+def fake_llm(responses: Optional[List[str]] = None, **kwargs: Any) -> FakeListChatModel:
+    return FakeListChatModel(responses=responses or [FAKE_ANSWER], **kwargs)
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+# Import-time budget for the API module.
+#
+#   python -m benchmarks.import_time
+#   python -m benchmarks.import_time --budget-ms 600 --repeat 5
+#
+# Imports app.main in a fresh interpreter with -X importtime and fails when
+# the import takes longer than the budget, or when it loads a module that
+# should only be imported on first use (LangChain, FAISS, the embedding
+# model, the Groq client). The module check is exact; the time check takes
+# the best of several runs to keep noise down.
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+
+DEFERRED = (
+    "faiss",
+    "langchain_community",
+    "langchain_core",
+    "langchain_groq",
+    "langchain_huggingface",
+    "langchain_text_splitters",
+    "numpy",
+    "pypdf",
+    "sentence_transformers",
+    "torch",
+)
+
+_PROBE = (
+    "import sys, app.main; "
+    "print(','.join(sorted({m.split('.')[0] for m in sys.modules})))"
+)
+
+
+def measure() -> Tuple[float, Dict[str, int], List[str]]:
+    # returns app.main's cumulative import time in ms, the self time of each
+    # top-level package in microseconds, and the packages left loaded
+    with tempfile.TemporaryDirectory(prefix="pdf-insight-import-") as tmp:
+        env = {**os.environ, "DATA_DIR": tmp, "GROQ_API_KEY": os.environ.get("GROQ_API_KEY", "import-check")}
+        out = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", _PROBE],
+            cwd=ROOT,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+    if out.returncode != 0:
+        raise SystemExit(f"Importing app.main failed:\n{out.stderr[-2000:]}")
+
+    total_ms, self_us = 0.0, {}
+    for line in out.stderr.splitlines():
+        # "import time: <self us> | <cumulative us> | <indented module>"
+        if not line.startswith("import time:"):
+            continue
+        own, cumulative, name = [p.strip() for p in line[len("import time:"):].split("|")]
+        if not own.isdigit():
+            continue
+        top = name.split(".")[0]
+        self_us[top] = self_us.get(top, 0) + int(own)
+        if name == "app.main":
+            total_ms = int(cumulative) / 1000
+    loaded = out.stdout.strip().splitlines()[-1].split(",") if out.stdout.strip() else []
+    return total_ms, self_us, loaded
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check the import time of app.main")
+    parser.add_argument("--budget-ms", type=float, default=800.0, help="allowed import time of app.main")
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters to take the best of")
+    parser.add_argument("--top", type=int, default=10, help="packages to list by import time")
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(max(1, args.repeat))]
+    best_ms, self_us, loaded = min(runs, key=lambda r: r[0])
+
+    print(f"app.main import: best {best_ms:.1f} ms of {len(runs)} (budget {args.budget_ms:.0f} ms)")
+    for name, us in sorted(self_us.items(), key=lambda x: -x[1])[: args.top]:
+        print(f"  {name:28s} {us / 1000:8.1f} ms")
+
+    failures = []
+    early = sorted(set(loaded) & set(DEFERRED))
+    if early:
+        failures.append(f"imported at module import time: {', '.join(early)}")
+    if best_ms > args.budget_ms:
+        failures.append(f"import took {best_ms:.1f} ms, budget is {args.budget_ms:.0f} ms")
+    if failures:
+        raise SystemExit("Import budget exceeded: " + "; ".join(failures))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
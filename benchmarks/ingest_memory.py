@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+# Peak memory of ingesting one synthetic PDF, per page count.
+#
+#   python -m benchmarks.ingest_memory --pages 250,1000,2000
+#   python -m benchmarks.ingest_memory --pages 250,2000 --mode list
+#
+# Each run is a fresh interpreter, so ru_maxrss is the peak of that ingest
+# alone. "stream" is the ingest worker's pipeline (pages -> chunks ->
+# embedding batches -> index through a bounded queue); "list" builds the
+# page and chunk lists first, as ingest did before. The PDF is written
+# beforehand in a separate process so its bytes are not counted.
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+from benchmarks.synthetic_pdf import write_pdf
+
+
+def _peak_rss_mb() -> float:
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def ingest_once(pdf: Path, out: Path, mode: str, dim: int, prefetch_chunks: int) -> Dict[str, Any]:
+    from app.ingestion import iter_chunks, iter_pdf_pages, load_pdf_pages, prefetch, split_pages
+    from app.vectorstore import build_faiss_index
+    from benchmarks.fakes import FakeEmbeddings
+
+    embeddings = FakeEmbeddings(dim=dim)
+    embeddings.embed_documents(["warmup"])
+    before = _peak_rss_mb()
+
+    t0 = time.perf_counter()
+    if mode == "stream":
+        chunks = prefetch(iter_chunks(iter_pdf_pages(pdf)), prefetch_chunks)
+    else:
+        chunks = split_pages(load_pdf_pages(pdf))
+    params = build_faiss_index(chunks, out, embeddings)
+    return {
+        "seconds": round(time.perf_counter() - t0, 3),
+        "chunks": params["ntotal"],
+        "baseline_rss_mb": round(before, 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "growth_mb": round(_peak_rss_mb() - before, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Peak RSS of one PDF ingest by page count")
+    parser.add_argument("--pages", default="250,1000,2000", help="comma separated page counts")
+    parser.add_argument("--mode", choices=["stream", "list"], default="stream")
+    parser.add_argument("--dim", type=int, default=384, help="fake embedding dimension")
+    parser.add_argument("--prefetch-chunks", type=int, default=256)
+    parser.add_argument("--child", nargs=2, metavar=("PDF", "OUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        pdf, out = (Path(p) for p in args.child)
+        print(json.dumps(ingest_once(pdf, out, args.mode, args.dim, args.prefetch_chunks)))
+        return
+
+    with tempfile.TemporaryDirectory(prefix="pdf-insight-mem-") as tmp:
+        for pages in [int(p) for p in args.pages.split(",") if p.strip()]:
+            pdf = write_pdf(Path(tmp) / f"synthetic_{pages}.pdf", pages)
+            cmd = [
+                sys.executable, "-m", "benchmarks.ingest_memory",
+                "--mode", args.mode,
+                "--dim", str(args.dim),
+                "--prefetch-chunks", str(args.prefetch_chunks),
+                "--child", str(pdf), str(Path(tmp) / f"index_{pages}"),
+            ]
+            row = json.loads(subprocess.run(cmd, capture_output=True, text=True, check=True).stdout.splitlines()[-1])
+            print(
+                f"pages={pages:<6} mode={args.mode:6s} chunks={row['chunks']:<7} "
+                f"peak={row['peak_rss_mb']:8.1f} MB growth={row['growth_mb']:7.1f} MB  {row['seconds']} s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+# Checks the LLM router against the fake Groq server, offline.
+#
+#   python -m benchmarks.llm_routing
+#
+# Scenarios: a healthy primary (no hedges), a slow primary (hedged calls are
+# answered by the fallback and the primary's streams are cancelled), a
+# failing primary (calls fail over, then its circuit opens and it gets no
+# more traffic) and recovery after the breaker cooldown. Exits non-zero when
+# a scenario does not behave as expected.
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from typing import Any, Dict, List
+
+from benchmarks.fake_groq import FakeGroqServer
+
+PRIMARY = "fake-primary"
+FALLBACK = "fake-fallback"
+
+
+def _delta(before: Dict[str, Dict[str, int]], after: Dict[str, Dict[str, int]], model: str, key: str) -> int:
+    return after.get(model, {}).get(key, 0) - before.get(model, {}).get(key, 0)
+
+
+async def _calls(llm, n: int, concurrency: int) -> List[float]:
+    sem = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def one() -> None:
+        async with sem:
+            t0 = time.perf_counter()
+            async for _ in llm.astream("hello"):
+                pass
+            latencies.append(time.perf_counter() - t0)
+
+    await asyncio.gather(*(one() for _ in range(n)))
+    return latencies
+
+
+def _row(name: str, latencies: List[float], server: FakeGroqServer, before: Dict[str, Any], llm) -> Dict[str, Any]:
+    after = {m: dict(s) for m, s in server.fake.stats.items()}
+    ordered = sorted(latencies)
+    return {
+        "scenario": name,
+        "p50_ms": round(statistics.median(ordered) * 1000, 1),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000, 1),
+        "primary_requests": _delta(before, after, PRIMARY, "requests"),
+        "primary_ok": _delta(before, after, PRIMARY, "ok"),
+        "primary_cancelled": _delta(before, after, PRIMARY, "disconnected"),
+        "fallback_requests": _delta(before, after, FALLBACK, "requests"),
+        "fallback_ok": _delta(before, after, FALLBACK, "ok"),
+        "primary_circuit": llm.stats()[PRIMARY]["state"],
+    }
+
+
+async def run(args: argparse.Namespace) -> List[str]:
+    os.environ.setdefault("GROQ_API_KEY", "fake")
+    from app.rag_chain import RAGSettings, RouterSettings, build_llm
+
+    failures: List[str] = []
+    with FakeGroqServer() as server:
+        router = RouterSettings(
+            hedge_min_ms=args.hedge_min_ms,
+            hedge_default_ms=args.hedge_default_ms,
+            min_samples=5,
+            breaker_min_calls=5,
+            breaker_cooldown_seconds=args.cooldown,
+        )
+        llm = build_llm(RAGSettings(model=PRIMARY, fallback_model=FALLBACK, base_url=server.url, router=router))
+        fake = server.fake
+        rows = []
+
+        async def scenario(name: str, n: int, concurrency: int = 4) -> Dict[str, Any]:
+            before = {m: dict(s) for m, s in fake.stats.items()}
+            latencies = await _calls(llm, n, concurrency)
+            # the server only sees a cancelled stream when it next writes,
+            # after the first-token delay
+            await asyncio.sleep(args.slow_ms / 1000 + 0.3)
+            row = _row(name, latencies, server, before, llm)
+            rows.append(row)
+            return row
+
+        fake.configure("*", first_token_ms=30, token_ms=1)
+        row = await scenario("healthy", args.calls)
+        if row["fallback_requests"] or row["primary_ok"] != args.calls:
+            failures.append("healthy: the fallback was called")
+
+        fake.configure(PRIMARY, first_token_ms=args.slow_ms)
+        fake.configure(FALLBACK, first_token_ms=60)
+        row = await scenario("slow primary", args.calls)
+        if row["fallback_ok"] < args.calls * 0.9:
+            failures.append("slow primary: calls were not answered by the fallback")
+        if row["p95_ms"] > args.slow_ms * 0.8:
+            failures.append(f"slow primary: p95 {row['p95_ms']} ms is not below the primary's {args.slow_ms} ms")
+        if row["primary_cancelled"] < row["fallback_ok"] * 0.9:
+            failures.append("slow primary: losing primary streams were not cancelled")
+
+        fake.configure(PRIMARY, first_token_ms=30, error_rate=1.0)
+        row = await scenario("failing primary", args.calls, concurrency=1)
+        if row["fallback_ok"] != args.calls:
+            failures.append("failing primary: some calls failed instead of failing over")
+        if row["primary_requests"] > args.calls // 2 or row["primary_circuit"] == "closed":
+            failures.append("failing primary: the circuit did not open")
+
+        fake.configure(PRIMARY, error_rate=0.0)
+        await asyncio.sleep(args.cooldown)
+        row = await scenario("recovered", args.calls, concurrency=1)
+        if row["primary_circuit"] != "closed" or row["primary_ok"] < args.calls - 1:
+            failures.append("recovered: the circuit did not close after the cooldown")
+
+    cols = list(rows[0])
+    print("  ".join(f"{c:>17s}" if i else f"{c:16s}" for i, c in enumerate(cols)))
+    for row in rows:
+        print("  ".join(f"{str(row[c]):>17s}" if i else f"{row[c]:16s}" for i, c in enumerate(cols)))
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check LLM routing, hedging and circuit breaking offline")
+    parser.add_argument("--calls", type=int, default=40)
+    parser.add_argument("--slow-ms", type=float, default=1500.0, help="first-token delay of the slow primary")
+    parser.add_argument("--hedge-min-ms", type=int, default=100)
+    parser.add_argument("--hedge-default-ms", type=int, default=300)
+    parser.add_argument("--cooldown", type=float, default=1.0, help="breaker cooldown in seconds")
+    args = parser.parse_args()
+
+    failures = asyncio.run(run(args))
+    if failures:
+        raise SystemExit("Routing check failed: " + "; ".join(failures))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,490 @@
+from __future__ import annotations
+
+# End-to-end load test of the API against the fake Groq server, offline.
+#
+#   python -m benchmarks.load_test --rps 20 --duration 60 --out load.json
+#   python -m benchmarks.load_test --baseline load-old.json --out load-new.json
+#   python -m benchmarks.load_test --first-token-ms 400 --token-ms 15 --error-rate 0.05
+#   python -m benchmarks.load_test --url http://127.0.0.1:8000 --docs 0
+#
+# Starts the fake Groq server, runs the app in its own process
+# (benchmarks.serve_app, with fake embeddings unless --real-embeddings) on a
+# fresh DATA_DIR, uploads --docs synthetic PDFs and then sends requests at
+# --rps for --duration seconds. Arrivals are open-loop: a request is sent
+# on schedule whether or not earlier ones have been answered, so a slow
+# server shows up as latency instead of a lower request rate. The mix of
+# asks, streamed asks, document listings and uploads is set with --mix,
+# spread over --sessions chat sessions. Reports throughput, p50/p95/p99
+# latency per operation and, every --sample-seconds, the app's RSS and
+# event-loop lag from /metrics. With --baseline, exits non-zero when p95 or
+# p99 latency is more than --threshold slower, or on errors or a shortfall
+# in throughput.
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+from benchmarks.fake_groq import Behaviour, FakeGroq, FakeGroqServer
+from benchmarks.run import git_commit, make_questions
+from benchmarks.synthetic_pdf import write_pdf
+
+OPERATIONS = ("ask", "ask_stream", "documents", "upload")
+DEFAULT_MIX = "ask=70,ask_stream=10,documents=15,upload=5"
+LAG_METRIC = "pdf_insight_event_loop_lag_seconds"
+_SAMPLE_LINE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{([^}]*)\})?\s+(\S+)$')
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    # "ask=70,upload=5" -> shares summing to 1
+    mix: Dict[str, float] = {}
+    for item in filter(None, spec.split(",")):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise SystemExit(f"Unknown operation in --mix: {name} (use {', '.join(OPERATIONS)})")
+        mix[name] = float(weight)
+    total = sum(mix.values())
+    if total <= 0:
+        raise SystemExit("--mix needs at least one operation with a positive weight")
+    return {name: weight / total for name, weight in mix.items() if weight > 0}
+
+
+def parse_metrics(text: str) -> Dict[Tuple[str, str], float]:
+    # Prometheus text format -> {(name, labels): value}
+    samples = {}
+    for line in text.splitlines():
+        m = _SAMPLE_LINE.match(line)
+        if m:
+            try:
+                samples[(m.group(1), m.group(2) or "")] = float(m.group(3))
+            except ValueError:
+                pass
+    return samples
+
+
+def histogram_quantile(buckets: List[Tuple[float, float]], q: float) -> Optional[float]:
+    # buckets: (upper bound, cumulative count) in increasing order, +Inf last;
+    # linear interpolation within the bucket, as Prometheus does
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    rank = q * buckets[-1][1]
+    lower, below = 0.0, 0.0
+    for upper, count in buckets:
+        if count >= rank:
+            if upper == float("inf"):
+                return lower
+            return lower + (upper - lower) * (rank - below) / max(count - below, 1e-12)
+        lower, below = upper, count
+    return lower
+
+
+def _lag_buckets(samples: Dict[Tuple[str, str], float]) -> Dict[float, float]:
+    out = {}
+    for (name, labels), value in samples.items():
+        if name == f"{LAG_METRIC}_bucket":
+            le = re.search(r'le="([^"]+)"', labels)
+            if le:
+                out[float(le.group(1))] = value
+    return out
+
+
+def summarize(latencies_s: List[float], seconds: float) -> Dict[str, Any]:
+    if not latencies_s:
+        return {"n": 0}
+    ms = np.asarray(latencies_s, dtype=np.float64) * 1000
+    return {
+        "n": len(ms),
+        "rps": round(len(ms) / seconds, 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, args: argparse.Namespace, doc_ids: List[str], uploads: List[Path]):
+        self.client = client
+        self.args = args
+        self.doc_ids = doc_ids
+        self.uploads = uploads
+        self.mix = parse_mix(args.mix)
+        self.questions = make_questions(args.questions, args.seed)
+        self.rng = random.Random(args.seed)
+        self.results: List[Dict[str, Any]] = []
+        self.timeline: List[Dict[str, Any]] = []
+        self.in_flight = 0
+        self.dropped = 0
+
+    async def _post_pdf(self, path: str, pdf: Path) -> httpx.Response:
+        with open(pdf, "rb") as f:
+            return await self.client.post(path, files={"file": (pdf.name, f.read(), "application/pdf")})
+
+    def _ask_body(self) -> Dict[str, Any]:
+        return {
+            "doc_id": self.rng.choice(self.doc_ids),
+            "session_id": f"load-{self.rng.randrange(self.args.sessions)}",
+            "question": self.rng.choice(self.questions),
+            "language": "en",
+        }
+
+    async def _request(self, op: str) -> Tuple[int, Optional[float]]:
+        # status code and, for streams, the time to the first event
+        if op == "ask":
+            return (await self.client.post("/ask", json=self._ask_body())).status_code, None
+        if op == "ask_stream":
+            t0 = time.perf_counter()
+            first = None
+            async with self.client.stream("POST", "/ask/stream", json=self._ask_body()) as r:
+                async for _ in r.aiter_bytes():
+                    if first is None:
+                        first = time.perf_counter() - t0
+            return r.status_code, first
+        if op == "documents":
+            return (await self.client.get("/documents", params={"limit": 50})).status_code, None
+        pdf = self.uploads[self.rng.randrange(len(self.uploads))]
+        return (await self._post_pdf("/upload", pdf)).status_code, None
+
+    async def _one(self, op: str, sent_at: float, measured: bool) -> None:
+        self.in_flight += 1
+        t0 = time.perf_counter()
+        try:
+            status, first = await self._request(op)
+        except httpx.HTTPError as e:
+            status, first = 0, None
+            if measured and self.args.verbose:
+                print(f"{op}: {type(e).__name__}: {e}", file=sys.stderr)
+        finally:
+            self.in_flight -= 1
+        if measured:
+            # latency counts from when the request was due, so a client that
+            # falls behind does not hide server slowness
+            self.results.append({
+                "op": op,
+                "status": status,
+                "latency": time.perf_counter() - min(t0, sent_at),
+                "first_byte": first,
+            })
+
+    async def _sample(self, stop: asyncio.Event, started: float) -> None:
+        previous: Dict[float, float] = {}
+        while not stop.is_set():
+            try:
+                r = await self.client.get("/metrics")
+                samples = parse_metrics(r.text)
+            except httpx.HTTPError:
+                samples = {}
+            buckets = _lag_buckets(samples)
+            delta = sorted((le, count - previous.get(le, 0.0)) for le, count in buckets.items())
+            previous = buckets or previous
+            lag_p99 = histogram_quantile(delta, 0.99)
+            rss = samples.get(("process_resident_memory_bytes", ""))
+            self.timeline.append({
+                "t": round(time.perf_counter() - started, 1),
+                "rss_mb": round(rss / 2**20, 1) if rss is not None else None,
+                "lag_p99_ms": round(lag_p99 * 1000, 2) if lag_p99 is not None else None,
+                "in_flight": self.in_flight,
+            })
+            try:
+                await asyncio.wait_for(stop.wait(), self.args.sample_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self) -> float:
+        # returns the measured seconds (the run without the warm-up)
+        args = self.args
+        ops, weights = zip(*self.mix.items())
+        stop = asyncio.Event()
+        started = time.perf_counter()
+        sampler = asyncio.create_task(self._sample(stop, started))
+        tasks = set()
+
+        end = started + args.warmup + args.duration
+        due = started
+        while due < end:
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.in_flight >= args.max_in_flight:
+                # the client's own limit, not the server's; counted, not hidden
+                self.dropped += 1
+            else:
+                op = self.rng.choices(ops, weights)[0]
+                task = asyncio.create_task(self._one(op, due, due >= started + args.warmup))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            due += self.rng.expovariate(args.rps) if args.arrivals == "poisson" else 1 / args.rps
+
+        if tasks:
+            await asyncio.wait(tasks, timeout=args.drain_seconds)
+        stop.set()
+        await sampler
+        return args.duration
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_app(args: argparse.Namespace, groq_url: str, data_dir: Path, log_path: Path) -> Tuple[subprocess.Popen, str]:
+    port = _free_port()
+    env = {
+        **os.environ,
+        "DATA_DIR": str(data_dir),
+        "GROQ_API_KEY": "fake",
+        "GROQ_BASE_URL": groq_url,
+        "PRELOAD": "eager",
+        "COMPACTION_INTERVAL_SECONDS": "0",
+    }
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    cmd = [sys.executable, "-m", "benchmarks.serve_app", "--port", str(port)]
+    if not args.real_embeddings:
+        cmd += ["--fake-embeddings", "--embed-call-ms", str(args.embed_call_ms), "--embed-text-ms", str(args.embed_text_ms)]
+    log = open(log_path, "wb")
+    proc = subprocess.Popen(cmd, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return proc, f"http://127.0.0.1:{port}"
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float, proc: Optional[subprocess.Popen], log_path: Optional[Path]) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if proc is not None and proc.poll() is not None:
+            break
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    tail = log_path.read_text(errors="replace")[-3000:] if log_path and log_path.exists() else ""
+    raise SystemExit(f"The app did not become ready in {timeout:.0f}s\n{tail}")
+
+
+async def seed_documents(client: httpx.AsyncClient, pdfs: List[Path], timeout: float) -> List[str]:
+    doc_ids = []
+    for pdf in pdfs:
+        with open(pdf, "rb") as f:
+            r = await client.post("/upload", files={"file": (pdf.name, f.read(), "application/pdf")})
+        r.raise_for_status()
+        doc_ids.append(r.json()["doc_id"])
+
+    deadline = time.perf_counter() + timeout
+    pending = set(doc_ids)
+    while pending and time.perf_counter() < deadline:
+        for doc_id in list(pending):
+            status = (await client.get(f"/jobs/{doc_id}")).json().get("status")
+            if status == "ready":
+                pending.discard(doc_id)
+            elif status == "failed":
+                raise SystemExit(f"Seeding failed: {doc_id} could not be indexed")
+        await asyncio.sleep(0.2)
+    if pending:
+        raise SystemExit(f"Seeding timed out: {len(pending)} documents not indexed after {timeout:.0f}s")
+    return doc_ids
+
+
+def report_results(test: LoadTest, seconds: float, target_rps: float) -> Dict[str, Any]:
+    by_op: Dict[str, Dict[str, Any]] = {}
+    for op in test.mix:
+        rows = [r for r in test.results if r["op"] == op]
+        ok = [r["latency"] for r in rows if 200 <= r["status"] < 400]
+        by_op[op] = {**summarize(ok, seconds), "sent": len(rows), "errors": len(rows) - len(ok)}
+        first = [r["first_byte"] for r in rows if r["first_byte"] is not None]
+        if first:
+            by_op[op]["first_byte_p95_ms"] = round(float(np.percentile(first, 95)) * 1000, 2)
+
+    ok_all = [r["latency"] for r in test.results if 200 <= r["status"] < 400]
+    sent = len(test.results)
+    rss = [s["rss_mb"] for s in test.timeline if s["rss_mb"] is not None]
+    lag = [s["lag_p99_ms"] for s in test.timeline if s["lag_p99_ms"] is not None]
+    total = {
+        **summarize(ok_all, seconds),
+        "target_rps": target_rps,
+        "sent": sent,
+        "errors": sent - len(ok_all),
+        "error_rate": round((sent - len(ok_all)) / sent, 4) if sent else 0.0,
+        "dropped": test.dropped,
+        "rss_mb_max": max(rss) if rss else None,
+        "rss_mb_growth": round(rss[-1] - rss[0], 1) if len(rss) > 1 else None,
+        "lag_p99_ms_max": max(lag) if lag else None,
+    }
+    return {"total": total, "operations": by_op, "timeline": test.timeline}
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    print(f"{'operation':12s} {'sent':>6s} {'errors':>6s} {'rps':>7s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'max':>9s}")
+    for name, row in [*result["operations"].items(), ("total", result["total"])]:
+        if not row.get("n"):
+            print(f"{name:12s} {row.get('sent', 0):6d} {row.get('errors', 0):6d}")
+            continue
+        print(
+            f"{name:12s} {row['sent']:6d} {row['errors']:6d} {row['rps']:7.1f} {row['p50_ms']:9.1f} "
+            f"{row['p95_ms']:9.1f} {row['p99_ms']:9.1f} {row['max_ms']:9.1f}"
+        )
+    total = result["total"]
+    print(
+        f"dropped={total['dropped']} rss_mb_max={total['rss_mb_max']} rss_mb_growth={total['rss_mb_growth']} "
+        f"lag_p99_ms_max={total['lag_p99_ms_max']}"
+    )
+    print("  t(s)  rss(MB)  lag p99(ms)  in flight")
+    for s in result["timeline"]:
+        print(f"{s['t']:6.1f} {s['rss_mb'] if s['rss_mb'] is not None else '-':>8} {s['lag_p99_ms'] if s['lag_p99_ms'] is not None else '-':>12} {s['in_flight']:10d}")
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float, min_delta_ms: float) -> List[str]:
+    # p95 and p99 changes per operation; like benchmarks.run, small absolute
+    # changes are ignored since short requests jitter by more than threshold
+    base_ops = {**baseline.get("operations", {}), "total": baseline.get("total", {})}
+    regressions = []
+    for op, row in [*current["operations"].items(), ("total", current["total"])]:
+        for stat in ("p95_ms", "p99_ms"):
+            old, new = base_ops.get(op, {}).get(stat), row.get(stat)
+            if not old or new is None:
+                continue
+            change = new / old - 1
+            flag = "  SLOWER" if change > threshold and new - old > min_delta_ms else ""
+            print(f"{op:12s} {stat:7s} {old:10.1f} -> {new:10.1f} ms ({change:+.1%}){flag}")
+            if flag:
+                regressions.append(f"{op}:{stat}")
+    return regressions
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    fake = FakeGroq(
+        Behaviour(
+            first_token_ms=args.first_token_ms,
+            token_ms=args.token_ms,
+            jitter_ms=args.jitter_ms,
+            error_rate=args.error_rate,
+            answer_words=args.answer_words,
+        ),
+        seed=args.seed,
+    )
+    with tempfile.TemporaryDirectory() as tmp, FakeGroqServer(fake=fake) as groq:
+        work = Path(tmp)
+        proc, log_path = None, None
+        url = args.url
+        if not url:
+            log_path = work / "app.log"
+            proc, url = start_app(args, groq.url, work / "data", log_path)
+
+        try:
+            pdfs = [write_pdf(work / f"seed_{i}.pdf", args.pages, seed=args.seed + i) for i in range(args.docs)]
+            # distinct files, so uploads during the run are indexed rather than deduplicated
+            uploads = [write_pdf(work / f"upload_{i}.pdf", args.pages, seed=args.seed + 10_000 + i) for i in range(args.upload_pool)]
+
+            limits = httpx.Limits(max_connections=args.max_in_flight + 8, max_keepalive_connections=args.max_in_flight + 8)
+            async with httpx.AsyncClient(base_url=url, timeout=args.request_timeout, limits=limits) as client:
+                await wait_ready(client, args.startup_timeout, proc, log_path)
+                doc_ids = await seed_documents(client, pdfs, args.startup_timeout)
+                if not doc_ids:
+                    r = await client.get("/documents", params={"status": "ready", "limit": 500})
+                    doc_ids = [d["doc_id"] for d in r.json().get("docs", [])]
+                if not doc_ids:
+                    raise SystemExit("No documents to ask about: use --docs or a server that has some")
+
+                test = LoadTest(client, args, doc_ids, uploads)
+                seconds = await test.run()
+        finally:
+            if proc is not None:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+        result = report_results(test, seconds, args.rps)
+        result["fake_groq"] = fake.stats
+        return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End-to-end load test against a local fake Groq server")
+    parser.add_argument("--url", default="", help="test a running app instead of starting one")
+    parser.add_argument("--rps", type=float, default=20, help="target request rate")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of load before measuring")
+    parser.add_argument("--arrivals", choices=["poisson", "constant"], default="poisson")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--sessions", type=int, default=200, help="chat sessions the asks are spread over")
+    parser.add_argument("--docs", type=int, default=8, help="documents uploaded before the run")
+    parser.add_argument("--pages", type=int, default=5, help="pages per synthetic PDF")
+    parser.add_argument("--upload-pool", type=int, default=50, help="distinct PDFs uploaded during the run")
+    parser.add_argument("--questions", type=int, default=200, help="distinct questions")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="client limit; arrivals beyond it are dropped")
+    parser.add_argument("--sample-seconds", type=float, default=2.0, help="how often RSS and event-loop lag are read")
+    parser.add_argument("--request-timeout", type=float, default=60.0)
+    parser.add_argument("--drain-seconds", type=float, default=30.0, help="wait for requests still in flight at the end")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    # the fake Groq server
+    parser.add_argument("--first-token-ms", type=float, default=150.0)
+    parser.add_argument("--token-ms", type=float, default=5.0, help="delay between streamed words")
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of LLM calls that fail")
+    parser.add_argument("--answer-words", type=int, default=60)
+    # the app process
+    parser.add_argument("--real-embeddings", action="store_true", help="load the real embedding model")
+    parser.add_argument("--embed-call-ms", type=float, default=4.0, help="fake embedding cost per model call")
+    parser.add_argument("--embed-text-ms", type=float, default=0.3, help="fake embedding cost per text")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra app settings")
+    # results
+    parser.add_argument("--out", type=Path, default=None, help="JSON results file")
+    parser.add_argument("--baseline", type=Path, default=None, help="earlier results to compare p95/p99 with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p95/p99 slowdown that counts as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=20.0, help="ignore slowdowns smaller than this")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--min-rps-ratio", type=float, default=0.9, help="lowest achieved/target request rate")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    if args.upload_pool < 1:
+        parser.error("--upload-pool must be at least 1")
+
+    result = asyncio.run(run(args))
+    result["meta"] = {
+        "commit": git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "args": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+    }
+    print_report(result)
+    if args.out:
+        args.out.write_text(json.dumps(result, indent=2), encoding="utf-8")
+        print(f"Wrote {args.out}")
+
+    failures = []
+    total = result["total"]
+    if total["error_rate"] > args.max_error_rate:
+        failures.append(f"error rate {total['error_rate']:.2%} is above {args.max_error_rate:.2%}")
+    if total.get("rps", 0) < args.min_rps_ratio * args.rps:
+        failures.append(f"served {total.get('rps', 0)} rps of the {args.rps} targeted")
+    if args.baseline:
+        regressions = compare(result, json.loads(args.baseline.read_text(encoding="utf-8")), args.threshold, args.min_delta_ms)
+        if regressions:
+            failures.append(f"slower than the baseline: {', '.join(regressions)}")
+    if failures:
+        raise SystemExit("Load test failed: " + "; ".join(failures))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
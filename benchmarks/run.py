@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+# Offline micro-benchmarks for the ingest and query stages.
+#
+#   python -m benchmarks.run --pages 10,100 --repeat 5 --out bench.json
+#   python -m benchmarks.run --baseline bench-old.json --out bench-new.json
+#
+# Synthetic English/Bengali PDFs, a deterministic fake embedding model and a
+# fake LLM keep the numbers about this code, not a model or network.
+
+import argparse
+import json
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.output_parsers import StrOutputParser
+
+from app.ingestion import load_pdf_pages, split_pages
+from app.postprocess import clean_repetition
+from app.prompts import get_prompt
+from app.rag_chain import format_context, pack_context
+from app.retrieval import load_doc_index
+from app.vectorstore import build_faiss_index
+from benchmarks.fakes import FAKE_ANSWER, FakeEmbeddings, fake_llm
+from benchmarks.synthetic_pdf import BENGALI, ENGLISH, write_pdf
+
+
+class _Precomputed(Embeddings):
+    # hands back vectors computed beforehand, so index build is timed alone
+    def __init__(self, vectors: Dict[str, List[float]]):
+        self.vectors = vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.vectors[t] for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.vectors[text]
+
+
+def summarize(samples_s: Sequence[float], items_per_sample: float) -> Dict[str, float]:
+    ms = np.asarray(samples_s, dtype=np.float64) * 1000
+    total = float(np.sum(samples_s))
+    return {
+        "n": len(ms),
+        "p50_ms": round(float(np.percentile(ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(ms, 95)), 4),
+        "mean_ms": round(float(ms.mean()), 4),
+        "items_per_sample": items_per_sample,
+        "throughput_per_s": round(items_per_sample * len(ms) / total, 2) if total else None,
+    }
+
+
+def timed(fn: Callable[[], Any], repeat: int) -> tuple:
+    samples, result = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - t0)
+    return samples, result
+
+
+def make_questions(n: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    pool = [s.format(n=rng.randint(1, 999)) for s in ENGLISH + BENGALI]
+    return [rng.choice(pool) for _ in range(n)]
+
+
+def bench_document(pages: int, args: argparse.Namespace, work: Path) -> Dict[str, Any]:
+    pdf = write_pdf(work / f"synthetic_{pages}.pdf", pages, args.bengali_ratio, args.seed)
+    stages: Dict[str, Dict[str, float]] = {}
+
+    samples, docs = timed(
+        lambda: load_pdf_pages(pdf, workers=args.extract_workers, parallel_min_pages=args.parallel_min_pages),
+        args.repeat,
+    )
+    stages["parse"] = summarize(samples, pages)
+
+    samples, chunks = timed(lambda: split_pages(docs), args.repeat)
+    stages["split"] = summarize(samples, len(chunks))
+
+    embeddings = FakeEmbeddings(dim=args.dim)
+    texts = [c.page_content for c in chunks]
+    samples, vectors = timed(lambda: embeddings.embed_documents(texts), args.repeat)
+    stages["embed"] = summarize(samples, len(chunks))
+
+    precomputed = _Precomputed(dict(zip(texts, vectors)))
+    index_path = work / f"index_{pages}"
+    samples, params = timed(lambda: build_faiss_index(chunks, index_path, embeddings=precomputed), args.repeat)
+    stages["index_build"] = summarize(samples, len(chunks))
+
+    samples, doc_index = timed(lambda: load_doc_index(index_path, embeddings), args.repeat)
+    stages["index_load"] = summarize(samples, 1)
+
+    questions = make_questions(args.queries, args.seed)
+    query_vectors = [embeddings.embed_query(q) for q in questions]
+
+    dense, hybrid, results = [], [], []
+    for q, v in zip(questions, query_vectors):
+        t0 = time.perf_counter()
+        doc_index.search(v, q, args.top_k, hybrid=False)
+        dense.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        results.append(doc_index.search(v, q, args.top_k, hybrid=True))
+        hybrid.append(time.perf_counter() - t0)
+    stages["search_dense"] = summarize(dense, 1)
+    stages["search_hybrid"] = summarize(hybrid, 1)
+
+    verbatim, packed, saved = [], [], []
+    for found in results:
+        t0 = time.perf_counter()
+        format_context(found)
+        verbatim.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        _, stats = pack_context(found)
+        packed.append(time.perf_counter() - t0)
+        saved.append(stats["tokens_saved"])
+    stages["context_verbatim"] = summarize(verbatim, 1)
+    stages["context_packed"] = summarize(packed, 1)
+    stages["context_packed"]["mean_tokens_saved"] = round(float(np.mean(saved)), 1)
+
+    chain = get_prompt("v2") | fake_llm() | StrOutputParser()
+    generate = []
+    for q, found in zip(questions, results):
+        inputs = {
+            "context": pack_context(found)[0],
+            "question": q,
+            "reply_language_instruction": "English",
+            "history": [],
+        }
+        t0 = time.perf_counter()
+        chain.invoke(inputs)
+        generate.append(time.perf_counter() - t0)
+    stages["generate_fake_llm"] = summarize(generate, 1)
+
+    samples, _ = timed(lambda: clean_repetition(FAKE_ANSWER), args.queries)
+    stages["postprocess"] = summarize(samples, 1)
+
+    return {
+        "pages": pages,
+        "chunks": len(chunks),
+        "index_type": params.get("type"),
+        "stages": stages,
+    }
+
+
+def git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float, min_delta_ms: float) -> List[str]:
+    # p50 changes per stage; returns the stages slower than threshold, ignoring
+    # sub-millisecond stages whose jitter alone exceeds any sensible threshold
+    base_runs = {r["pages"]: r for r in baseline.get("runs", [])}
+    regressions = []
+    for run in current["runs"]:
+        base = base_runs.get(run["pages"])
+        if base is None:
+            continue
+        for stage, row in run["stages"].items():
+            old = base["stages"].get(stage, {}).get("p50_ms")
+            if not old:
+                continue
+            change = row["p50_ms"] / old - 1
+            flag = "  SLOWER" if change > threshold and row["p50_ms"] - old > min_delta_ms else ""
+            print(f"pages={run['pages']:<5} {stage:18s} p50 {old:10.3f} -> {row['p50_ms']:10.3f} ms ({change:+.1%}){flag}")
+            if flag:
+                regressions.append(f"{run['pages']}:{stage}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline ingest and retrieval micro-benchmarks")
+    parser.add_argument("--pages", default="10,100", help="comma separated page counts")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each per-document stage")
+    parser.add_argument("--queries", type=int, default=50, help="queries for the per-query stages")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--dim", type=int, default=384, help="fake embedding dimension")
+    parser.add_argument("--bengali-ratio", type=float, default=0.5)
+    parser.add_argument("--extract-workers", type=int, default=1)
+    parser.add_argument("--parallel-min-pages", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--out", type=Path, default=None, help="JSON results file (default bench-<commit>.json)")
+    parser.add_argument("--baseline", type=Path, default=None, help="earlier results to compare p50s with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p50 slowdown that counts as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5, help="ignore p50 slowdowns smaller than this")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    report: Dict[str, Any] = {
+        "meta": {
+            "commit": commit,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        },
+        "runs": [],
+    }
+
+    with tempfile.TemporaryDirectory(prefix="pdf-insight-bench-") as tmp:
+        for pages in [int(p) for p in args.pages.split(",") if p.strip()]:
+            run = bench_document(pages, args, Path(tmp))
+            report["runs"].append(run)
+            for stage, row in run["stages"].items():
+                print(
+                    f"pages={pages:<5} {stage:18s} p50={row['p50_ms']:10.3f} ms "
+                    f"p95={row['p95_ms']:10.3f} ms  {row['throughput_per_s']}/s"
+                )
+
+    out = args.out or Path(f"bench-{commit or 'local'}.json")
+    out.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"Wrote {out}")
+
+    if args.baseline:
+        regressions = compare(report, json.loads(args.baseline.read_text(encoding="utf-8")), args.threshold, args.min_delta_ms)
+        if regressions:
+            raise SystemExit(f"Slower than baseline: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
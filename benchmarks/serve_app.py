@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+# Runs the API in one uvicorn worker for load tests.
+#
+#   python -m benchmarks.serve_app --port 8000 --fake-embeddings
+#
+# With --fake-embeddings the embedding model is replaced by the fake one
+# from benchmarks.fakes, costing --embed-call-ms per model call plus
+# --embed-text-ms per text, so a run needs no model download and measures
+# the app rather than the model. Everything else is configured through the
+# usual environment variables.
+
+import argparse
+
+from benchmarks.fakes import CountingEmbeddings, FakeEmbeddings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve the API for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--fake-embeddings", action="store_true")
+    parser.add_argument("--embed-call-ms", type=float, default=4.0)
+    parser.add_argument("--embed-text-ms", type=float, default=0.3)
+    parser.add_argument("--dim", type=int, default=384)
+    args = parser.parse_args()
+
+    if args.fake_embeddings:
+        import app.vectorstore
+
+        def build_embeddings(*_, **__):
+            return CountingEmbeddings(FakeEmbeddings(args.dim), args.embed_call_ms, args.embed_text_ms)
+
+        app.vectorstore.build_embeddings = build_embeddings
+
+    import uvicorn
+
+    uvicorn.run("app.main:app", host=args.host, port=args.port, workers=1, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
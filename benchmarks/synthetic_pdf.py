@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+from pathlib import Path
+import random
+from typing import List
+
+# Text is drawn with a Type0 font whose character codes are the Unicode code
+# points themselves, and a ToUnicode CMap maps them back. No font program is
+# embedded, so the pages do not render nicely, but text extraction (all the
+# ingest path needs) returns the original English and Bengali strings.
+
+ENGLISH = [
+    "Revenue for the quarter grew by {n} percent compared with the previous year.",
+    "The board approved a budget of {n} million taka for the new distribution centre.",
+    "Invoice INV-{n} was settled within thirty days of the delivery date.",
+    "Customer satisfaction scores rose to {n} out of one hundred in the latest survey.",
+    "Operating costs fell after the migration of {n} servers to the shared platform.",
+    "The audit found {n} minor issues and no material weaknesses in internal controls.",
+]
+
+BENGALI = [
+    "এই প্রতিবেদনে ত্রৈমাসিক আয়ের বৃদ্ধি {n} শতাংশ দেখানো হয়েছে।",
+    "পরিচালনা পর্ষদ নতুন বিতরণ কেন্দ্রের জন্য {n} কোটি টাকার বাজেট অনুমোদন করেছে।",
+    "গ্রাহক সন্তুষ্টি জরিপে গড় নম্বর {n} এ পৌঁছেছে।",
+    "নিরীক্ষায় {n}টি ছোট সমস্যা পাওয়া গেছে এবং কোনো বড় দুর্বলতা নেই।",
+    "ঢাকা ও চট্টগ্রাম অঞ্চলে বিক্রয় {n} শতাংশ বেড়েছে।",
+]
+
+LINES_PER_PAGE = 40
+
+# CMap ranges may only vary in the last byte, so one range per high byte
+# covers ASCII, Latin-1, Bengali and general punctuation
+_CMAP_HIGH_BYTES = (0x00, 0x09, 0x20)
+
+
+def page_lines(page: int, bengali_ratio: float, rng: random.Random) -> List[str]:
+    lines = []
+    for _ in range(LINES_PER_PAGE):
+        pool = BENGALI if rng.random() < bengali_ratio else ENGLISH
+        lines.append(rng.choice(pool).format(n=rng.randint(1, 999)))
+    lines[0] = f"Section {page + 1}"
+    return lines
+
+
+def _encode(text: str) -> str:
+    return "".join(f"{ord(ch):04X}" for ch in text if ord(ch) >> 8 in _CMAP_HIGH_BYTES)
+
+
+def _to_unicode_cmap() -> bytes:
+    ranges = "\n".join(f"<{hb:02X}00> <{hb:02X}FF> <{hb:02X}00>" for hb in _CMAP_HIGH_BYTES)
+    return (
+        "/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n"
+        "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n"
+        "/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n"
+        "1 begincodespacerange\n<0000> <FFFF>\nendcodespacerange\n"
+        f"{len(_CMAP_HIGH_BYTES)} beginbfrange\n{ranges}\nendbfrange\n"
+        "endcmap\nCMapName currentdict /CMap defineresource pop\nend\nend\n"
+    ).encode("ascii")
+
+
+def _stream(data: bytes) -> bytes:
+    return b"<< /Length %d >>\nstream\n" % len(data) + data + b"\nendstream"
+
+
+def write_pdf(path: Path, pages: int, bengali_ratio: float = 0.5, seed: int = 1234) -> Path:
+    rng = random.Random(seed)
+    objects: List[bytes] = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"",  # page tree, filled in once the page object numbers are known
+        b"<< /Type /Font /Subtype /Type0 /BaseFont /SyntheticUnicode /Encoding /Identity-H "
+        b"/DescendantFonts [4 0 R] /ToUnicode 5 0 R >>",
+        b"<< /Type /Font /Subtype /CIDFontType2 /BaseFont /SyntheticUnicode "
+        b"/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> /DW 500 >>",
+        _stream(_to_unicode_cmap()),
+    ]
+
+    kids = []
+    for p in range(pages):
+        ops = ["BT", "/F1 10 Tf", "12 TL", "40 800 Td"]
+        for line in page_lines(p, bengali_ratio, rng):
+            ops.append(f"<{_encode(line)}> Tj T*")
+        ops.append("ET")
+        content_num = len(objects) + 2
+        page_num = len(objects) + 1
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_num
+        )
+        objects.append(_stream("\n".join(ops).encode("ascii")))
+        kids.append(f"{page_num} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>".encode("ascii")
+
+    out = bytearray(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(bytes(out))
+    return path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write a synthetic English/Bengali PDF")
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--bengali-ratio", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+    write_pdf(args.path, args.pages, args.bengali_ratio, args.seed)
+    print(f"Wrote {args.path}")
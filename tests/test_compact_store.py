@@ -0,0 +1,19 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+from langchain_core.documents import Document
+
+from app.compact_store import CompactDocstore, write_chunks
+
+
+def test_compact_docstore_is_read_only(tmp_path: Path) -> None:
+    write_chunks(tmp_path, [Document(page_content="hello", metadata={"page": 0})])
+    store = CompactDocstore(tmp_path)
+    assert store.get(0).page_content == "hello"
+
+    with pytest.raises(TypeError, match="ChunkWriter"):
+        store.add({"1": Document(page_content="more")})
+    with pytest.raises(TypeError, match="read-only"):
+        store.delete(["0"])
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import multiprocessing
+import time
+from pathlib import Path
+
+from app.compaction import compact_document, remove_stale_generations
+from app.jobs import claim_job
+from app.storage import generation_dir, write_manifest
+
+
+def _hold_claim(index_path: str, claimed, done) -> None:
+    # another worker running an update of the document
+    claim = claim_job(Path(index_path))
+    claimed.set()
+    done.wait(30)
+    claim.release()
+
+
+def _no_embeddings():
+    raise AssertionError("a claimed document was compacted")
+
+
+def test_compaction_skips_a_document_claimed_by_another_worker(tmp_path: Path) -> None:
+    index_path = tmp_path / "doc"
+    write_manifest(
+        index_path,
+        {"status": "ready", "generation": 1, "generation_at": time.time() - 3600, "chunks": 5, "deleted_chunks": 5},
+    )
+    # the previous generation, and the update's half-written next one
+    old = generation_dir(index_path, 0) / "index.faiss"
+    old.write_bytes(b"old")
+    partial = generation_dir(index_path, 2) / "index.faiss"
+    partial.parent.mkdir(parents=True)
+    partial.write_bytes(b"partial")
+
+    ctx = multiprocessing.get_context("fork")
+    claimed, done = ctx.Event(), ctx.Event()
+    other = ctx.Process(target=_hold_claim, args=(str(index_path), claimed, done))
+    other.start()
+    try:
+        assert claimed.wait(30)
+        assert compact_document(index_path, _no_embeddings, force=True) is None
+        assert remove_stale_generations(index_path, grace_seconds=0) == 0
+        assert partial.read_bytes() == b"partial"
+        assert old.exists()
+    finally:
+        done.set()
+        other.join(30)
+
+    assert remove_stale_generations(index_path, grace_seconds=0) > 0
+    assert not old.exists()
+    assert partial.exists()
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import List
+
+from app.corpus import CorpusIndex
+from benchmarks.fakes import FakeEmbeddings
+
+DIM = 8
+
+
+def _corpus(root: Path) -> CorpusIndex:
+    embeddings = FakeEmbeddings(DIM)
+    return CorpusIndex(root, lambda: embeddings, n_shards=1)
+
+
+def _add(corpus: CorpusIndex, doc_id: str, texts: List[str], serials: List[int]) -> None:
+    vectors = corpus.embeddings.embed_documents(texts)
+    corpus.add_document(doc_id, texts, vectors, [{"page": 0}] * len(texts), serials=serials)
+
+
+def _texts(corpus: CorpusIndex, doc_id: str) -> List[str]:
+    shard = corpus.shards[0]
+    shard.load()
+    return sorted(shard.files.get(int(r)).page_content for r in shard.members[doc_id])
+
+
+def test_update_after_reload_replaces_chunks(tmp_path: Path) -> None:
+    _add(_corpus(tmp_path), "docA", [f"old {i}" for i in range(5)], list(range(5)))
+    _add(_corpus(tmp_path), "docB", ["other"], [0])
+
+    # a fresh process, e.g. another worker or after a restart
+    corpus = _corpus(tmp_path)
+    texts = ["new 0", "new 1"]
+    updated = corpus.update_document(
+        "docA", [0, 1], texts, corpus.embeddings.embed_documents(texts), [{"page": 0}] * 2, [5, 6]
+    )
+
+    assert updated
+    shard = corpus.shards[0]
+    shard.load()
+    assert shard.n_rows - shard.dead_rows() == 6
+    assert _texts(corpus, "docA") == ["new 0", "new 1", "old 2", "old 3", "old 4"]
+
+    reloaded = _corpus(tmp_path)
+    shard = reloaded.shards[0]
+    shard.load()
+    assert sorted(shard.files.serials[shard.members["docA"]].tolist()) == [2, 3, 4, 5, 6]
+    assert _texts(reloaded, "docA") == ["new 0", "new 1", "old 2", "old 3", "old 4"]
+    assert _texts(reloaded, "docB") == ["other"]
+
+    hits = reloaded.search(reloaded.embeddings.embed_query("old 0"), k=10, doc_ids={"docA"})
+    assert "old 0" not in [d.page_content for d, _ in hits]
+
+
+def _add_many(root: str, prefix: str) -> None:
+    corpus = _corpus(Path(root))
+    for i in range(5):
+        _add(corpus, f"{prefix}{i}", [f"{prefix}{i} text {j}" for j in range(3)], [0, 1, 2])
+
+
+def test_concurrent_workers_keep_each_others_documents(tmp_path: Path) -> None:
+    import multiprocessing
+
+    ctx = multiprocessing.get_context("fork")
+    workers = [ctx.Process(target=_add_many, args=(str(tmp_path), prefix)) for prefix in ("a", "b")]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join(60)
+        assert w.exitcode == 0
+
+    corpus = _corpus(tmp_path)
+    shard = corpus.shards[0]
+    shard.load()
+    assert sorted(shard.members) == [f"{p}{i}" for p in "ab" for i in range(5)]
+    assert shard.n_rows - shard.dead_rows() == 30
+
+
+def test_writes_append_and_compaction_reclaims(tmp_path: Path) -> None:
+    corpus = _corpus(tmp_path)
+    _add(corpus, "docA", [f"a {i}" for i in range(4)], list(range(4)))
+    shard = corpus.shards[0]
+    shard.load()
+    files = shard.files
+    before = (files.path / "chunks.bin").read_bytes()
+
+    _add(corpus, "docB", ["b 0", "b 1"], [0, 1])
+    assert corpus.remove_document("docA")
+    # docA's rows are dropped in the log, not rewritten
+    assert (files.path / "chunks.bin").read_bytes().startswith(before)
+    shard.load()
+    assert shard.n_rows == 6 and shard.dead_rows() == 4
+    assert not corpus.contains("docA")
+
+    report = corpus.compact(min_deleted_percent=50, grace_seconds=0)
+    assert report["corpus_shards_compacted"] == 1
+    shard.load()
+    assert shard.generation == 2 and shard.n_rows == 2 and shard.dead_rows() == 0
+    hits = corpus.search(corpus.embeddings.embed_query("b 1"), k=1)
+    assert [d.page_content for d, _ in hits] == ["b 1"]
+
+    # the superseded generation goes on the next pass
+    assert corpus.compact(min_deleted_percent=50, grace_seconds=0)["corpus_bytes_freed"] > 0
+    assert not files.path.exists()
+
+
+def test_shards_of_the_previous_format_are_converted(tmp_path: Path) -> None:
+    import faiss
+    import numpy as np
+    from langchain_core.documents import Document
+
+    from app.compact_store import write_index_dir
+
+    embeddings = FakeEmbeddings(DIM)
+    texts = ["legacy 0", "legacy 1", "legacy 2"]
+    index = faiss.IndexFlatL2(DIM)
+    index.add(np.asarray(embeddings.embed_documents(texts), dtype=np.float32))
+    shard_dir = tmp_path / "shard_000"
+    docs = [Document(page_content=t, metadata={"doc_id": "old", "page": 0}) for t in texts]
+    write_index_dir(shard_dir, index, docs)
+    (shard_dir / "members.json").write_text('{"old": 3}')
+
+    corpus = _corpus(tmp_path)
+    assert corpus.contains("old")
+    assert _texts(corpus, "old") == texts
+    assert not (shard_dir / "index.faiss").exists()
+    assert corpus.update_document("old", [0], [], [], [], [])
+    assert _texts(corpus, "old") == texts[1:]
+
+
+def test_writer_spills_batches_until_commit(tmp_path: Path) -> None:
+    from langchain_core.documents import Document
+
+    corpus = _corpus(tmp_path)
+    writer = corpus.writer("docA")
+    for start in (0, 3):
+        docs = [Document(page_content=f"a {i}", metadata={"page": 0}) for i in range(start, start + 3)]
+        writer.add(docs, corpus.embeddings.embed_documents([d.page_content for d in docs]))
+    # nothing is visible before commit, and nothing is held but the spill
+    assert not corpus.contains("docA")
+    assert len(list(corpus.pending_dir.iterdir())) == 1
+
+    writer.commit()
+    assert _texts(corpus, "docA") == [f"a {i}" for i in range(6)]
+    assert list(corpus.pending_dir.iterdir()) == []
+
+    update = corpus.writer("docA", first_serial=6)
+    update.add([Document(page_content="a 6")], corpus.embeddings.embed_documents(["a 6"]))
+    update.removed = [0, 1]
+    update.commit()
+    assert _texts(corpus, "docA") == [f"a {i}" for i in range(2, 7)]
+
+    failed = corpus.writer("docB")
+    failed.add([Document(page_content="b")], corpus.embeddings.embed_documents(["b"]))
+    failed.discard()
+    assert not corpus.contains("docB")
+    assert list(corpus.pending_dir.iterdir()) == []
@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from app import embedding_cache
+from app.embedding_cache import EmbeddingCache, text_key
+
+
+def test_hits_survive_eviction_in_another_worker(tmp_path: Path, monkeypatch) -> None:
+    clock = [100]
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: clock[0])
+    keys = [text_key(f"chunk {i}") for i in range(5)]
+
+    writer = EmbeddingCache(tmp_path, "model", max_rows=4)
+    writer.put_many(keys[:4], [[float(i), 0.0] for i in range(4)])
+
+    # another worker reads the oldest chunk, then shuts down
+    clock[0] = 200
+    reader = EmbeddingCache(tmp_path, "model", max_rows=4)
+    assert reader.get_many(keys[:1])[0] is not None
+    reader.flush()
+
+    # a restarted worker overflows the cache and evicts the least used rows
+    clock[0] = 300
+    restarted = EmbeddingCache(tmp_path, "model", max_rows=4)
+    restarted.put_many(keys[4:], [[4.0, 0.0]])
+
+    kept = [v is not None for v in restarted.get_many(keys)]
+    assert restarted.stats()["rows"] == 3
+    assert kept[0] and kept[4]
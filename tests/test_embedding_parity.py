@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import pytest
+
+# Needs the real model, so it only runs where it is already downloaded (no
+# network is used); the onnx case also needs optimum[onnxruntime].
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("langchain_huggingface")
+
+from app.vectorstore import DEFAULT_EMBEDDING_MODEL  # noqa: E402
+from benchmarks.embedding_parity import compare_backends, parity_failures  # noqa: E402
+
+MIN_COSINE = 0.98
+MIN_OVERLAP = 0.9
+K = 5
+
+
+@pytest.fixture(scope="module", autouse=True)
+def offline_model() -> None:
+    from huggingface_hub import snapshot_download
+
+    try:
+        snapshot_download(DEFAULT_EMBEDDING_MODEL, local_files_only=True)
+    except Exception:
+        pytest.skip(f"{DEFAULT_EMBEDDING_MODEL} is not downloaded")
+
+
+@pytest.mark.parametrize("backend", ["int8", "onnx"])
+def test_backend_matches_fp32(backend: str) -> None:
+    if backend == "onnx":
+        from huggingface_hub import try_to_load_from_cache
+
+        pytest.importorskip("onnxruntime")
+        pytest.importorskip("optimum.onnxruntime")
+        if not isinstance(try_to_load_from_cache(DEFAULT_EMBEDDING_MODEL, "onnx/model.onnx"), str):
+            pytest.skip("the ONNX export of the model is not downloaded")
+    report = compare_backends(DEFAULT_EMBEDDING_MODEL, backend, n_chunks=120, n_questions=30, k=K)
+    assert parity_failures(report[backend], MIN_COSINE, MIN_OVERLAP, K) == []
@@ -0,0 +1,19 @@
+from __future__ import annotations
+
+import os
+
+from benchmarks.import_time import DEFERRED, measure
+
+# app.main must import quickly and leave the heavy libraries for first use;
+# the budget can be raised on slow machines with IMPORT_BUDGET_MS
+BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "800"))
+
+
+def test_app_main_defers_heavy_imports() -> None:
+    _, _, loaded = measure()
+    assert sorted(set(loaded) & set(DEFERRED)) == []
+
+
+def test_app_main_import_time_within_budget() -> None:
+    best_ms = min(measure()[0] for _ in range(3))
+    assert best_ms <= BUDGET_MS, f"app.main took {best_ms:.1f} ms to import, budget is {BUDGET_MS:.0f} ms"
@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from pypdf import PdfReader, PdfWriter
+
+from app.ingestion import _iter_pages_parallel, _iter_pages_serial, _iter_pages_windowed, shutdown_pool
+from benchmarks.synthetic_pdf import write_pdf
+
+
+def test_large_pdf_paths_match_pypdfloader(tmp_path: Path) -> None:
+    plain = write_pdf(tmp_path / "plain.pdf", 12)
+    writer = PdfWriter(clone_from=PdfReader(plain))
+    writer.add_metadata({"/Title": " Quarterly report ", "/CreationDate": "D:20240102030405+06'00'"})
+    pdf = tmp_path / "report.pdf"
+    writer.write(pdf)
+
+    serial = list(_iter_pages_serial(pdf))
+    windowed = list(_iter_pages_windowed(pdf, 12))
+    try:
+        parallel = list(_iter_pages_parallel(pdf, 12, 2))
+    finally:
+        shutdown_pool()
+
+    assert serial[0].metadata["title"] == "Quarterly report"
+    assert serial[0].metadata["page_label"] == "1"
+    for expected, *others in zip(serial, windowed, parallel):
+        for doc in others:
+            assert doc.metadata == expected.metadata
+            assert doc.page_content == expected.page_content
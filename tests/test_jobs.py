@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import multiprocessing
+import threading
+from pathlib import Path
+
+import pytest
+
+from app.jobs import IngestJob, IngestQueue, JobClaimed, claim_job
+
+
+def _job(index_path: Path) -> IngestJob:
+    return IngestJob(doc_id=index_path.name, pdf_path=index_path / "x.pdf", index_path=index_path, manifest={})
+
+
+def _try_claim(index_path: str, out) -> None:
+    out.put(claim_job(Path(index_path)) is not None)
+
+
+def test_only_one_worker_claims_a_job(tmp_path: Path) -> None:
+    index_path = tmp_path / "doc"
+    claim = claim_job(index_path)
+    assert claim is not None
+
+    ctx = multiprocessing.get_context("fork")
+    out = ctx.Queue()
+    other = ctx.Process(target=_try_claim, args=(str(index_path), out))
+    other.start()
+    other.join(30)
+    assert out.get(timeout=5) is False
+
+    claim.release()
+    other = ctx.Process(target=_try_claim, args=(str(index_path), out))
+    other.start()
+    other.join(30)
+    assert out.get(timeout=5) is True
+
+
+def test_queue_holds_the_claim_until_the_job_ends(tmp_path: Path) -> None:
+    index_path = tmp_path / "doc"
+    started, release = threading.Event(), threading.Event()
+
+    def run(job: IngestJob) -> None:
+        started.set()
+        release.wait(10)
+
+    queue = IngestQueue(run)
+    try:
+        queue.submit(_job(index_path))
+        assert started.wait(10)
+        with pytest.raises(JobClaimed):
+            queue.submit(_job(index_path))
+        assert claim_job(index_path) is None
+
+        release.set()
+        queue._executor.shutdown(wait=True)
+        claim = claim_job(index_path)
+        assert claim is not None
+        claim.release()
+    finally:
+        release.set()
+        queue.shutdown()
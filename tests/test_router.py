@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, AsyncIterator, List
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatResult
+
+from app.rag_chain import ModelRouter, RouterSettings
+
+
+class _Model(BaseChatModel):
+    words: List[str] = []
+    first_token_seconds: float = 0.0
+    # a role-only chunk of empty content right away, as Groq streams start
+    role_chunk: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "test"
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        raise NotImplementedError
+
+    async def astream(self, input: Any, config=None, *, stop=None, **kwargs: Any) -> AsyncIterator[AIMessageChunk]:
+        # the raw stream, without LangChain's own check for empty output
+        if self.role_chunk:
+            yield AIMessageChunk(content="")
+        await asyncio.sleep(self.first_token_seconds)
+        for word in self.words:
+            yield AIMessageChunk(content=word)
+
+
+def _router(*models: _Model, **settings: Any) -> ModelRouter:
+    return ModelRouter(names=[f"m{i}" for i in range(len(models))], models=list(models), settings=RouterSettings(**settings))
+
+
+def test_empty_stream_falls_back_to_next_model() -> None:
+    router = _router(_Model(words=[]), _Model(words=["ok"]), hedge=False)
+    message = asyncio.run(router.ainvoke("hi"))
+    assert message.content == "ok"
+    assert router.stats()["m0"]["error_rate"] == 1.0
+
+
+def test_cancelled_hedge_records_its_wait() -> None:
+    slow = _Model(words=["slow"], first_token_seconds=0.5)
+    router = _router(slow, _Model(words=["fast"]), hedge_default_ms=50, hedge_min_ms=0, min_samples=1)
+    message = asyncio.run(router.ainvoke("hi"))
+    assert message.content == "fast"
+    # the primary lost the race, but its p95 now reflects that it was slow
+    assert router.stats()["m0"]["first_token_p95_seconds"] >= 0.05
+
+
+def test_role_chunk_is_not_a_first_token() -> None:
+    stalled = _Model(words=["slow"], first_token_seconds=0.5, role_chunk=True)
+    router = _router(stalled, _Model(words=["fast"], role_chunk=True), hedge_default_ms=50, hedge_min_ms=0, min_samples=1)
+    message = asyncio.run(router.ainvoke("hi"))
+    assert message.content == "fast"
+
+    router = _router(_Model(role_chunk=True), _Model(words=["ok"]), hedge=False)
+    assert asyncio.run(router.ainvoke("hi")).content == "ok"
+    assert router.stats()["m0"]["error_rate"] == 1.0
@@ -1,4 +1,6 @@
+import json
 import os
+import time
 import requests
 import streamlit as st
 from typing import Dict, Any, List
@@ -43,14 +45,66 @@ def api_get(path: str, timeout: int = 60):
 def api_post_json(path: str, payload: dict, timeout: int = 300):
     return requests.post(f"{API}{path}", json=payload, timeout=timeout)
 
+def api_post_sse(path: str, payload: dict, timeout: int = 600):
+    with requests.post(f"{API}{path}", json=payload, stream=True, timeout=timeout) as r:
+        if r.status_code != 200:
+            yield "http_error", {"status": r.status_code, "text": r.text[:800]}
+            return
+
+        r.encoding = r.encoding or "utf-8"
+        event = "message"
+        for line in r.iter_lines(decode_unicode=True):
+            if not line:
+                event = "message"
+                continue
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                yield event, json.loads(line[len("data:"):].strip())
+
 def api_post_file(path: str, filename: str, file_bytes: bytes, timeout: int = 900):
     files = {"file": (filename, file_bytes, "application/pdf")}
     return requests.post(f"{API}{path}", files=files, timeout=timeout)
 
 def load_documents() -> List[Dict[str, Any]]:
-    r = api_get("/documents", timeout=60)
-    r.raise_for_status()
-    return r.json().get("docs", [])
+    docs: List[Dict[str, Any]] = []
+    cursor = None
+    while True:
+        params = f"?limit=200&cursor={cursor}" if cursor else "?limit=200"
+        r = api_get(f"/documents{params}", timeout=60)
+        r.raise_for_status()
+        page = r.json()
+        docs.extend(page.get("docs", []))
+        cursor = page.get("next_cursor")
+        if not cursor:
+            return docs
+
+def wait_for_job(doc_id: str, poll_seconds: float = 1.0) -> Dict[str, Any]:
+    progress = st.progress(0.0, text="Queued")
+    while True:
+        r = api_get(f"/jobs/{doc_id}", timeout=30)
+        r.raise_for_status()
+        job = r.json()
+        status = job.get("status", "")
+
+        if status in {"ready", "failed"}:
+            progress.empty()
+            return job
+
+        if job.get("stage") == "embedding" and job.get("chunks_total"):
+            frac = 0.5 + 0.5 * job.get("chunks_embedded", 0) / job["chunks_total"]
+            text = f'Embedding chunks {job.get("chunks_embedded", 0)}/{job["chunks_total"]}'
+        elif job.get("pages_total"):
+            frac = 0.5 * job.get("pages_parsed", 0) / job["pages_total"]
+            text = f'Parsing pages {job.get("pages_parsed", 0)}/{job["pages_total"]}'
+        else:
+            frac = 0.0
+            text = status.capitalize() or "Queued"
+
+        if job.get("eta_seconds") is not None:
+            text += f' , about {int(job["eta_seconds"])}s left'
+        progress.progress(min(max(frac, 0.0), 1.0), text=text)
+        time.sleep(poll_seconds)
 
 def ensure_state():
     st.session_state.setdefault("docs", [])
@@ -80,7 +134,7 @@ with st.sidebar:
         if pdf is None:
             st.error("Please select a PDF first.")
         else:
-            with st.spinner("Uploading and indexing"):
+            with st.spinner("Uploading"):
                 res = api_post_file("/upload", pdf.name, pdf.getvalue(), timeout=1200)
 
             if res.status_code != 200:
@@ -89,6 +143,11 @@ with st.sidebar:
                 st.stop()
 
             data = res.json()
+            job = wait_for_job(data.get("doc_id", ""))
+            if job.get("status") != "ready":
+                st.error(f'Indexing failed: {job.get("error", "")}')
+                st.stop()
+
             st.success("Upload done")
             st.session_state["doc_id"] = data.get("doc_id", "")
             st.session_state["docs"] = load_documents()
@@ -221,17 +280,31 @@ else:
         }
 
         with st.chat_message("assistant"):
-            with st.spinner("Thinking"):
-                r = api_post_json("/ask", payload, timeout=600)
-
-            if r.status_code != 200:
-                st.error(f"Ask failed, status {r.status_code}")
-                st.text(r.text[:800])
-            else:
-                data = r.json()
-                answer = data.get("answer", "")
-                sources = data.get("sources", [])
-                st.write(answer)
+            placeholder = st.empty()
+            placeholder.markdown("_Thinking_")
+            answer = ""
+            sources = []
+            failed = False
+
+            for event, data in api_post_sse("/ask/stream", payload, timeout=600):
+                if event == "http_error":
+                    placeholder.empty()
+                    st.error(f'Ask failed, status {data["status"]}')
+                    st.text(data["text"])
+                    failed = True
+                elif event == "sources":
+                    sources = data.get("sources", [])
+                elif event == "token":
+                    answer += data.get("text", "")
+                    placeholder.markdown(answer + " ▌")
+                elif event == "done":
+                    answer = data.get("answer", answer)
+                elif event == "error":
+                    st.error(f'Ask failed: {data.get("detail", "")}')
+                    failed = True
+
+            if not failed:
+                placeholder.write(answer)
 
                 if sources:
                     with st.expander("Sources"):